@@ -0,0 +1,167 @@
+import asyncio
+import time
+
+
+# Upper bounds of the batch size histogram buckets
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+class BatchMetrics:
+    """Running counters for batch sizes and queue wait times"""
+
+    def __init__(self):
+        self.batches = 0
+        self.items = 0
+        self.largest_batch = 0
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+        self.batch_size_counts = {bucket: 0 for bucket in BATCH_SIZE_BUCKETS}
+        self.batch_size_overflow = 0
+
+    def observe_batch(self, size, queue_waits):
+        self.batches += 1
+        self.items += size
+        self.largest_batch = max(self.largest_batch, size)
+
+        for bucket in BATCH_SIZE_BUCKETS:
+            if size <= bucket:
+                self.batch_size_counts[bucket] += 1
+                break
+        else:
+            self.batch_size_overflow += 1
+
+        for wait in queue_waits:
+            self.queue_wait_total += wait
+            if wait > self.queue_wait_max:
+                self.queue_wait_max = wait
+
+    def snapshot(self):
+        histogram = {f"le_{bucket}": count for bucket, count in self.batch_size_counts.items()}
+        histogram["overflow"] = self.batch_size_overflow
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": self.items / self.batches if self.batches else 0.0,
+            "largest_batch": self.largest_batch,
+            "mean_queue_wait_ms": 1000.0 * self.queue_wait_total / self.items if self.items else 0.0,
+            "max_queue_wait_ms": 1000.0 * self.queue_wait_max,
+            "batch_size_histogram": histogram,
+        }
+
+
+class MicroBatcher:
+    """Coalesce concurrent scoring requests into a single model call
+
+    Handlers submit one item (a sample) together with the authentication
+    system that should score it. Items are queued until either
+    `max_batch_size` are waiting or `max_wait_ms` has passed since the first
+    one arrived, then scored with a single `await predict_fn(system, items)`
+    call, which returns one score per item and is expected to do the heavy
+    work off the event loop. Each awaiting handler gets its own score back.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=32, max_wait_ms=2.0, name="batcher", max_concurrency=1):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.name = name
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.metrics = BatchMetrics()
+
+        self._pending = []
+        self._has_items = None
+        self._is_full = None
+        self._slots = None
+        self._worker = None
+        self._flushes = set()
+
+    def start(self):
+        if self._worker is None or self._worker.done():
+            self._has_items = asyncio.Event()
+            self._is_full = asyncio.Event()
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+        for task in list(self._flushes):
+            task.cancel()
+
+        for _, _, future, _ in self._pending:
+            if not future.done():
+                future.cancel()
+        self._pending = []
+
+    async def submit(self, system, item):
+        """Queue one item and wait for its model score"""
+        self.start()
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((system, item, future, time.perf_counter()))
+        self._has_items.set()
+        if len(self._pending) >= self.max_batch_size:
+            self._is_full.set()
+
+        return await future
+
+    async def _run(self):
+        while True:
+            await self._has_items.wait()
+            # Keep collecting while every predict slot is busy
+            await self._slots.acquire()
+
+            if len(self._pending) < self.max_batch_size and self.max_wait > 0:
+                self._is_full.clear()
+                try:
+                    await asyncio.wait_for(self._is_full.wait(), self.max_wait)
+                except asyncio.TimeoutError:
+                    pass
+
+            batch = self._pending[:self.max_batch_size]
+            self._pending = self._pending[self.max_batch_size:]
+            if not self._pending:
+                self._has_items.clear()
+                self._is_full.clear()
+
+            task = asyncio.get_running_loop().create_task(self._flush(batch))
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, batch):
+        try:
+            await self._score(batch)
+        finally:
+            self._slots.release()
+
+    async def _score(self, batch):
+        started = time.perf_counter()
+        batch = [entry for entry in batch if not entry[2].done()]
+        if not batch:
+            return
+        self.metrics.observe_batch(len(batch), [started - queued_at for _, _, _, queued_at in batch])
+
+        # Items scored by different models cannot share a predict call
+        groups = {}
+        for entry in batch:
+            groups.setdefault(id(entry[0]), []).append(entry)
+
+        for items in groups.values():
+            system = items[0][0]
+            try:
+                scores = await self.predict_fn(system, [item for _, item, _, _ in items])
+            except Exception as e:
+                for _, _, future, _ in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, _, future, _), score in zip(items, scores):
+                if not future.done():
+                    future.set_result(score)
@@ -0,0 +1,1024 @@
+"""Offline benchmarks for the authentication service
+
+Everything runs in-process against synthetic payloads; no server or
+network is needed. Add --output results.json to keep the numbers and
+compare two runs (e.g. from two commits) with the compare command.
+
+    python benchmark.py payloads [--count 1000] [--model-type pin] > payloads.csv
+    python benchmark.py features [--batch-sizes 1 8 64 512 4096]
+    python benchmark.py parse [--fuzz-cases 20000]
+    python benchmark.py decode
+    python benchmark.py responses
+    python benchmark.py stages [--batch-sizes 1 32 512]
+    python benchmark.py fused [--samples 20000] [--batch-sizes 1 32 512]
+    python benchmark.py quantize [--modes float16 int8] [--validation payloads.csv] [--max-flip-rate 0.001]
+    python benchmark.py imports [--artifact-dir models]
+    python benchmark.py calibration [--users 1000] [--scores 100000]
+    python benchmark.py policy [--users 1000000] [--lookups 100000]
+    python benchmark.py ratelimit [--keys 100000] [--hits 200000]
+    python benchmark.py load [--concurrency 1 8 64] [--requests 2000] [--endpoints ...]
+    python benchmark.py compare baseline.json candidate.json [--threshold 0.10]
+"""
+import argparse
+import ast
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+import main as service
+from main import (
+    AuthenticationResponse, build_sample, detect_payload, extract_features,
+    extract_features_batch, split_payload
+)
+
+
+def synthetic_sample(rng, model_type='captcha'):
+    """Random sample dict shaped like the ones the handlers build"""
+    characters = int(rng.integers(4, 7)) if model_type == 'pin' else int(rng.integers(5, 9))
+    sample = {
+        'username': 'PinUser' if model_type == 'pin' else 'CaptchaUser',
+        'captcha': '******' if model_type == 'pin' else 'aB3xY',
+        'userInput': '******' if model_type == 'pin' else 'aB3xY',
+        'isCorrect': bool(rng.random() < 0.9),
+        'timestamp': '2025-01-01T00:00:00.000Z',
+        'totalTime': float(rng.uniform(1.0, 8.0)),
+        'wpm': float(rng.uniform(10.0, 60.0)),
+        'backspaceCount': float(rng.integers(0, 3)),
+        'avgFlightTime': float(rng.uniform(100.0, 300.0)),
+        'avgDwellTime': float(rng.uniform(60.0, 140.0)),
+        'avgInterKeyPause': float(rng.uniform(100.0, 400.0)),
+        'sessionEntropy': float(rng.uniform(1.0, 3.0)),
+        'keyDwellVariance': float(rng.uniform(10.0, 80.0)),
+        'interKeyVariance': float(rng.uniform(10.0, 120.0)),
+        'pressureVariance': float(rng.uniform(0.0, 0.05)),
+        'touchAreaVariance': float(rng.uniform(50.0, 250.0)),
+        'avgTouchArea': float(rng.uniform(300.0, 700.0)),
+        'avgPressure': float(rng.uniform(0.2, 0.8)),
+        'avgCoordX': float(rng.uniform(50.0, 350.0)),
+        'avgCoordY': float(rng.uniform(10.0, 80.0)),
+        'avgErrorRecoveryTime': float(rng.uniform(0.0, 800.0)),
+        'characterCount': float(characters),
+        # Some sessions lose key events, so lengths vary around the character count
+        'flightTimesArray': [int(x) for x in rng.integers(40, 600, max(0, characters - int(rng.integers(0, 3))))],
+        'dwellTimesArray': [int(x) for x in rng.integers(30, 250, max(0, characters - int(rng.integers(0, 2))))],
+        'interKeyPausesArray': [int(x) for x in rng.integers(40, 800, max(0, characters - 1))],
+    }
+    if model_type == 'pin':
+        sample['typingPatternVector'] = [int(x) for x in rng.integers(0, 10, characters)]
+    return sample
+
+
+def format_array(values):
+    return f"[{';'.join(str(v) for v in values)}]" if values else '[]'
+
+
+def format_payload(sample, model_type='captcha'):
+    """CSV body in the format services/BackendService.ts sends"""
+    fields = [sample['username'], sample['captcha'], sample['userInput'],
+              'true' if sample['isCorrect'] else 'false', sample['timestamp']]
+    fields += [repr(sample[name]) for name in (
+        'totalTime', 'wpm', 'backspaceCount', 'avgFlightTime', 'avgDwellTime',
+        'avgInterKeyPause', 'sessionEntropy', 'keyDwellVariance', 'interKeyVariance',
+        'pressureVariance', 'touchAreaVariance', 'avgTouchArea', 'avgPressure',
+        'avgCoordX', 'avgCoordY', 'avgErrorRecoveryTime', 'characterCount')]
+    fields += [format_array(sample['flightTimesArray']), format_array(sample['dwellTimesArray']),
+               format_array(sample['interKeyPausesArray'])]
+    if model_type == 'pin':
+        fields.append(format_array(sample.get('typingPatternVector', [])))
+    return ','.join(fields)
+
+
+# Reference copies of the character loops the handlers used before
+# split_fields, kept to check the tokenizer against them
+
+def legacy_split_captcha(csv_data):
+    parts = []
+    current_part = ''
+    in_quotes = False
+    for char in csv_data:
+        if char == '"':
+            in_quotes = not in_quotes
+        elif char == ',' and not in_quotes:
+            parts.append(current_part.strip('"'))
+            current_part = ''
+        else:
+            current_part += char
+    if current_part:
+        parts.append(current_part.strip('"'))
+    return parts
+
+
+def legacy_split_pin(csv_data):
+    parts = []
+    current_part = ''
+    in_brackets = False
+    for char in csv_data:
+        if char == '[':
+            in_brackets = True
+            current_part += char
+        elif char == ']':
+            in_brackets = False
+            current_part += char
+        elif char == ',' and not in_brackets:
+            parts.append(current_part)
+            current_part = ''
+        else:
+            current_part += char
+    if current_part:
+        parts.append(current_part)
+    return parts
+
+
+def legacy_detect(csv_data):
+    if len(legacy_split_pin(csv_data)) > 25:
+        return 'pin', legacy_split_pin(csv_data)
+    return 'captcha', legacy_split_captcha(csv_data)
+
+
+def fuzz_payload(rng, payloads):
+    """Either random noise over the characters the tokenizers care about or a mutated real payload"""
+    if rng.random() < 0.5:
+        alphabet = list('ab1;,"[] .')
+        return ''.join(rng.choice(alphabet, size=int(rng.integers(0, 60))))
+    text = list(payloads[int(rng.integers(0, len(payloads)))])
+    for _ in range(int(rng.integers(0, 4))):
+        position = int(rng.integers(0, len(text) + 1))
+        text.insert(position, str(rng.choice(list(',"[]'))))
+    return ''.join(text)
+
+
+def best_of(fn, repeat):
+    """Fastest wall time of `repeat` calls, in seconds"""
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def bench_features(args):
+    rng = np.random.default_rng(args.seed)
+    results = []
+    for batch_size in args.batch_sizes:
+        samples = [synthetic_sample(rng, 'pin' if i % 2 else 'captcha') for i in range(batch_size)]
+
+        reference = np.array([extract_features(s) for s in samples], dtype=np.float64)
+        vectorized = extract_features_batch(samples)
+        if not np.array_equal(reference, vectorized):
+            raise AssertionError(f"extract_features_batch differs from extract_features at batch size {batch_size}")
+
+        per_sample = best_of(lambda: np.array([extract_features(s) for s in samples]), args.repeat)
+        batched = best_of(lambda: extract_features_batch(samples), args.repeat)
+        # What score_samples uses: the scalar extractor for small batches
+        dispatched = best_of(lambda: service.sample_features(samples), args.repeat)
+        results.append({
+            'name': f"features/batch={batch_size}",
+            'batch_size': batch_size,
+            'per_sample_us': 1e6 * per_sample / batch_size,
+            'batched_us': 1e6 * batched / batch_size,
+            'sample_features_us': 1e6 * dispatched / batch_size,
+            'speedup': per_sample / batched,
+        })
+        print(f"batch {batch_size:>6}: extract_features {results[-1]['per_sample_us']:8.2f} us/sample, "
+              f"extract_features_batch {results[-1]['batched_us']:8.2f} us/sample ({results[-1]['speedup']:.1f}x), "
+              f"sample_features {results[-1]['sample_features_us']:8.2f} us/sample")
+    return results
+
+
+def bench_parse(args):
+    rng = np.random.default_rng(args.seed)
+    payloads = [format_payload(synthetic_sample(rng, model_type), model_type)
+                for model_type in ('captcha', 'pin') for _ in range(100)]
+
+    for _ in range(args.fuzz_cases):
+        text = fuzz_payload(rng, payloads)
+        if split_payload(text, 'captcha') != legacy_split_captcha(text):
+            raise AssertionError(f"captcha split differs for {text!r}")
+        if split_payload(text, 'pin') != legacy_split_pin(text):
+            raise AssertionError(f"PIN split differs for {text!r}")
+        if detect_payload(text) != legacy_detect(text):
+            raise AssertionError(f"auto detection differs for {text!r}")
+    print(f"{args.fuzz_cases} fuzzed payloads split identically to the legacy loops")
+
+    results = []
+    for name, legacy, current in (
+        ('captcha', legacy_split_captcha, lambda text: split_payload(text, 'captcha')),
+        ('pin', legacy_split_pin, lambda text: split_payload(text, 'pin')),
+        ('auto', legacy_detect, detect_payload),
+    ):
+        legacy_time = best_of(lambda: [legacy(text) for text in payloads], args.repeat)
+        current_time = best_of(lambda: [current(text) for text in payloads], args.repeat)
+        results.append({
+            'name': f"parse/{name}",
+            'format': name,
+            'legacy_us': 1e6 * legacy_time / len(payloads),
+            'split_fields_us': 1e6 * current_time / len(payloads),
+            'speedup': legacy_time / current_time,
+        })
+        print(f"{name:>8}: legacy loop {results[-1]['legacy_us']:7.2f} us/payload, "
+              f"split_fields {results[-1]['split_fields_us']:7.2f} us/payload ({results[-1]['speedup']:.1f}x)")
+    return results
+
+
+def per_call_us(fn, number, repeat):
+    """Best per-call time of `number` back-to-back calls, in microseconds"""
+    def run():
+        for _ in range(number):
+            fn()
+    return 1e6 * best_of(run, repeat) / number
+
+
+def synthetic_payloads(rng, count, model_type):
+    return [format_payload(synthetic_sample(rng, model_type), model_type) for _ in range(count)]
+
+
+def bench_decode(args):
+    """Time ast.literal_eval, json.loads and the bounded decoder on the /security bodies"""
+    from json_payloads import JSON_DECODER, decode_json
+
+    bodies = {
+        'two-factor': (service.TwoFactorRequest, {'twoFactorChoice': 2}),
+        'emulator-detection': (service.EmulatorDetectionRequest, {'emulatorDetectionResult': 'real_device'}),
+        'wifi-safety': (service.WifiSafetyRequest, {'wifiSafetyChoice': 1}),
+        'navigation-method': (service.NavigationMethodRequest, {'navigationMethod': 'hardwareBack'}),
+        'device-check': (service.DeviceCheckRequest, {
+            'securityCheck': 'completed', 'version': 'enhanced_v2.0',
+            'state': {'deviceModel': 'RMX3660', 'deviceManufacturer': 'realme', 'isDeveloperMode': False,
+                      'isUSBDebugging': False, 'isEmulator': False, 'isRooted': False,
+                      'androidVersion': '14', 'buildFingerprint': 'realme/RMX3660/RMX3660:14/UKQ1', 'timestamp': '2025-01-01T00:00:00.000Z'},
+        }),
+    }
+    results = []
+    for name, (model, document) in bodies.items():
+        body = json.dumps(document).encode('utf-8')
+        try:
+            ast.literal_eval(body.decode('utf-8'))
+            literal_eval_us = per_call_us(lambda: ast.literal_eval(body.decode('utf-8')), 2000, args.repeat)
+        except ValueError:
+            # JSON true/false/null are not Python literals
+            literal_eval_us = float('nan')
+        timings = {
+            'literal_eval_us': literal_eval_us,
+            'json_loads_us': per_call_us(lambda: json.loads(body.decode('utf-8')), 2000, args.repeat),
+            'decode_us': per_call_us(lambda: model.model_validate(decode_json(body, service.SECURITY_MAX_BODY_BYTES,
+                                                                             service.SECURITY_MAX_JSON_DEPTH)),
+                                     2000, args.repeat),
+        }
+        results.append({'name': f"decode/{name}", 'decoder': JSON_DECODER, 'bytes': len(body), **timings,
+                        'speedup': timings['literal_eval_us'] / timings['decode_us']})
+        print(f"{name:>18} ({len(body):>4} B): literal_eval {timings['literal_eval_us']:7.2f} us  "
+              f"json.loads {timings['json_loads_us']:6.2f} us  {JSON_DECODER}+model {timings['decode_us']:6.2f} us  "
+              f"{timings['literal_eval_us'] / timings['decode_us']:5.1f}x")
+    return results
+
+
+def bench_payloads(args):
+    rng = np.random.default_rng(args.seed)
+    for payload in synthetic_payloads(rng, args.count, args.model_type):
+        print(payload)
+    return []
+
+
+def bench_stages(args):
+    """Time each stage of the scoring path in isolation"""
+    captcha_system, pin_system = service.load_auth_systems()
+    rng = np.random.default_rng(args.seed)
+    results = []
+
+    for model_type, auth_system in (('captcha', captcha_system), ('pin', pin_system)):
+        payloads = synthetic_payloads(rng, max(args.batch_sizes), model_type)
+        bodies = [payload.encode('utf-8') for payload in payloads]
+        samples = [build_sample(split_payload(payload, model_type), model_type) for payload in payloads]
+        scaler = auth_system['scaler']
+        model = auth_system['model']
+
+        for batch_size in args.batch_sizes:
+            batch_bodies = bodies[:batch_size]
+            batch_samples = samples[:batch_size]
+            features = extract_features_batch(batch_samples)
+            scaled = scaler.transform(features)
+            confidences = model.predict(scaled, verbose=0)[:, 0]
+            responses = [
+                AuthenticationResponse(
+                    authenticated=bool(confidence >= auth_system['threshold']),
+                    confidence=float(confidence),
+                    threshold=float(auth_system['threshold']),
+                    user=sample['username'],
+                    target_user=auth_system['target_user'],
+                    model_type=model_type
+                )
+                for sample, confidence in zip(batch_samples, confidences)
+            ]
+            number = max(1, args.iterations // batch_size)
+
+            stages = {
+                'decode': lambda: [body.decode('utf-8') for body in batch_bodies],
+                'parse': lambda: [build_sample(split_payload(body.decode('utf-8'), model_type), model_type)
+                                  for body in batch_bodies],
+                'extract_features': (lambda: [extract_features(sample) for sample in batch_samples]) if batch_size == 1
+                                    else (lambda: extract_features_batch(batch_samples)),
+                'scaler_transform': lambda: scaler.transform(features),
+                'predict': lambda: model.predict(scaled, verbose=0),
+                'serialize': lambda: [response.model_dump_json() for response in responses],
+            }
+            for stage, fn in stages.items():
+                total_us = per_call_us(fn, number, args.repeat)
+                results.append({
+                    'name': f"stages/{model_type}/{stage}/batch={batch_size}",
+                    'model_type': model_type,
+                    'stage': stage,
+                    'batch_size': batch_size,
+                    'per_call_us': total_us,
+                    'per_sample_us': total_us / batch_size,
+                })
+                print(f"{model_type:>8} {stage:>17} batch {batch_size:>5}: "
+                      f"{total_us:10.2f} us/call {total_us / batch_size:9.2f} us/sample")
+    return results
+
+
+class ASGIClient:
+    """Minimal in-process HTTP client that calls the ASGI app directly"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def request(self, method, path, body=b'', content_type='text/plain'):
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0', 'spec_version': '2.3'},
+            'http_version': '1.1',
+            'method': method,
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode(),
+            'root_path': '',
+            'query_string': b'',
+            'headers': [(b'content-type', content_type.encode()), (b'content-length', str(len(body)).encode())],
+            'client': ('127.0.0.1', 50000),
+            'server': ('benchmark', 80),
+        }
+        sent_body = False
+        finished = asyncio.Event()
+        status = None
+        chunks = []
+
+        async def receive():
+            nonlocal sent_body
+            if not sent_body:
+                sent_body = True
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+            await finished.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            elif message['type'] == 'http.response.body':
+                chunks.append(message.get('body', b''))
+                if not message.get('more_body', False):
+                    finished.set()
+
+        await self.app(scope, receive, send)
+        finished.set()
+        return status, b''.join(chunks)
+
+
+def bench_fused(args):
+    """Check the folded scaler against scaler.transform + predict and time both"""
+    from inference import NUMPY_ENGINE_TOLERANCE
+
+    rng = np.random.default_rng(args.seed)
+    results = []
+    failures = 0
+    for name, (pickle_path, _, _, label) in service.MODEL_SOURCES.items():
+        reference = service.prepare_auth_system(service.load_pickled_auth_system(pickle_path), 'numpy', label)
+        fused = service.fuse_scaler(dict(reference), label)
+        if fused['model'] is reference['model']:
+            print(f"{name}: scaler could not be folded, skipped")
+            continue
+
+        # Realistic rows plus rows spread well past the training distribution
+        scaler = reference['scaler']
+        realistic = extract_features_batch([synthetic_sample(rng, name) for _ in range(args.samples // 2)])
+        spread = scaler.mean_ + scaler.scale_ * rng.normal(0.0, 3.0, size=(args.samples - len(realistic), len(scaler.mean_)))
+        features = np.vstack([realistic, spread])
+
+        def unfused(rows):
+            return reference['model'].predict(scaler.transform(rows), verbose=0)[:, 0]
+
+        def folded(rows):
+            return fused['model'].predict(fused['scaler'].transform(rows), verbose=0)[:, 0]
+
+        expected = unfused(features)
+        actual = folded(features)
+        difference = float(np.max(np.abs(expected - actual)))
+        threshold = reference['threshold']
+        flipped = int(np.count_nonzero((expected >= threshold) != (actual >= threshold)))
+        failures += difference > NUMPY_ENGINE_TOLERANCE
+        print(f"{name}: max difference {difference:.2e} over {len(features)} rows, {flipped} decisions changed")
+
+        for batch_size in args.batch_sizes:
+            rows = features[:batch_size]
+            unfused_us = per_call_us(lambda: unfused(rows), max(1, args.iterations // batch_size), args.repeat)
+            fused_us = per_call_us(lambda: folded(rows), max(1, args.iterations // batch_size), args.repeat)
+            results.append({
+                'name': f"fused/{name}/batch={batch_size}",
+                'max_difference': difference,
+                'decisions_changed': flipped,
+                'unfused_us': unfused_us,
+                'fused_us': fused_us,
+                'speedup': unfused_us / fused_us,
+            })
+            print(f"{name:>8} batch {batch_size:>5}: transform+predict {unfused_us:8.2f} us, "
+                  f"fused predict {fused_us:8.2f} us ({unfused_us / fused_us:.2f}x)")
+
+    if failures:
+        print(f"❌ Fused models differ by more than {NUMPY_ENGINE_TOLERANCE:.0e}")
+        raise SystemExit(1)
+    return results
+
+
+def validation_features(rng, model_type, count, path=None):
+    """Feature rows from a file of CSV payloads (one per line), or synthetic ones"""
+    if path is None:
+        return extract_features_batch([synthetic_sample(rng, model_type) for _ in range(count)])
+    samples = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line and detect_payload(line)[0] == model_type:
+                samples.append(build_sample(split_payload(line, model_type), model_type))
+    return extract_features_batch(samples) if samples else None
+
+
+def bench_quantize(args):
+    """Calibration report of quantized weights against full precision, gated on decision flips"""
+    from inference import NumpySequential, quantize_model
+
+    rng = np.random.default_rng(args.seed)
+    results = []
+    failures = 0
+    for name, (pickle_path, _, _, label) in service.MODEL_SOURCES.items():
+        reference = service.prepare_auth_system(service.load_pickled_auth_system(pickle_path), 'numpy', label)
+        model = reference['model']
+        if not isinstance(model, NumpySequential):
+            print(f"{name}: not on the NumPy engine, skipped")
+            continue
+        features = validation_features(rng, name, args.samples, args.validation)
+        if features is None:
+            print(f"{name}: no {name} payloads in {args.validation}, skipped")
+            continue
+        scaled = reference['scaler'].transform(features)
+        threshold = reference['threshold']
+        expected = model.predict(scaled)[:, 0]
+        accepted = expected >= threshold
+
+        for mode in args.modes:
+            quantized = quantize_model(model, mode)
+            actual = quantized.predict(scaled)[:, 0]
+            drift = actual - expected
+            flips = int(np.count_nonzero((actual >= threshold) != accepted))
+            flip_rate = flips / len(expected)
+            gated = flip_rate > args.max_flip_rate
+            failures += gated
+            results.append({
+                'name': f"quantize/{name}/{mode}",
+                'rows': len(expected),
+                'weight_bytes': model.nbytes,
+                'quantized_weight_bytes': quantized.nbytes,
+                'max_drift': float(np.max(np.abs(drift))),
+                'mean_drift': float(np.mean(drift)),
+                'p99_drift': float(np.percentile(np.abs(drift), 99)),
+                'near_threshold_rows': int(np.count_nonzero(np.abs(expected - threshold) < args.margin)),
+                'flips_to_accept': int(np.count_nonzero(~accepted & (actual >= threshold))),
+                'flips_to_reject': int(np.count_nonzero(accepted & (actual < threshold))),
+                'flip_rate': flip_rate,
+                'full_us': per_call_us(lambda: model.predict(scaled[:32]), 200, args.repeat),
+                'quantized_us': per_call_us(lambda: quantized.predict(scaled[:32]), 200, args.repeat),
+            })
+            result = results[-1]
+            print(f"{'GATED' if gated else '':>5} {name:>8} {mode:>8}: weights {result['weight_bytes']} -> "
+                  f"{result['quantized_weight_bytes']} B, drift max {result['max_drift']:.2e} "
+                  f"mean {result['mean_drift']:+.2e} p99 {result['p99_drift']:.2e}, "
+                  f"{flips}/{len(expected)} decisions flipped ({100 * flip_rate:.3f}%, "
+                  f"{result['near_threshold_rows']} rows within {args.margin} of the threshold)")
+
+    if failures:
+        print(f"❌ {failures} model/mode pairs flip more than {100 * args.max_flip_rate:.3f}% of decisions")
+        raise SystemExit(1)
+    return results
+
+
+IMPORT_PROBE = """
+import json, resource, sys, time
+started = time.perf_counter()
+{statement}
+print(json.dumps({{
+    'seconds': time.perf_counter() - started,
+    'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+    'tensorflow': 'tensorflow' in sys.modules,
+}}))
+"""
+
+
+def bench_imports(args):
+    """Import time and peak RSS of fresh processes, with and without TensorFlow"""
+    import tempfile
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as scratch:
+        artifact_dir = args.artifact_dir
+        if artifact_dir is None:
+            artifact_dir = os.path.join(scratch, 'models')
+            subprocess.run([sys.executable, 'model_artifacts.py', 'export', '--output-dir', artifact_dir, '--no-check'],
+                           cwd=here, check=True, capture_output=True)
+        load_models = "import main\nfor name in main.MODEL_SOURCES: main.load_model_source(name)"
+        scenarios = (
+            ('import', "import main", {}),
+            ('import_with_tensorflow', "import tensorflow\nimport main", {}),
+            ('serve_artifacts', load_models, {'MODEL_ARTIFACT_DIR': artifact_dir}),
+            ('serve_pickles', load_models, {'MODEL_ARTIFACT_DIR': os.path.join(scratch, 'missing')}),
+        )
+
+        results = []
+        for name, statement, env in scenarios:
+            runs = []
+            for _ in range(args.repeat):
+                completed = subprocess.run([sys.executable, '-c', IMPORT_PROBE.format(statement=statement)], cwd=here,
+                                           env={**os.environ, **env}, check=True, capture_output=True, text=True)
+                runs.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+            results.append({
+                'name': f"imports/{name}",
+                'seconds_ms': 1000.0 * min(run['seconds'] for run in runs),
+                'max_rss_mb': min(run['max_rss_mb'] for run in runs),
+                'tensorflow_imported': runs[0]['tensorflow'],
+            })
+            print(f"{name:>22}: {results[-1]['seconds_ms']:8.1f} ms, peak RSS {results[-1]['max_rss_mb']:7.1f} MB, "
+                  f"TensorFlow {'imported' if runs[0]['tensorflow'] else 'not imported'}")
+    return results
+
+
+def bench_calibration(args):
+    """P² quantile accuracy and the per-score cost of recording and draining"""
+    from calibration import P2Quantile, ThresholdCalibrator
+
+    rng = np.random.default_rng(args.seed)
+    results = []
+    for a, b in ((8.0, 2.0), (5.0, 5.0), (2.0, 2.0)):
+        scores = rng.beta(a, b, size=args.scores)
+        for p in (0.05, 0.5, 0.95):
+            estimator = P2Quantile(p)
+            for score in scores.tolist():
+                estimator.add(score)
+            exact = float(np.quantile(scores, p))
+            results.append({'name': f"calibration/beta({a:g},{b:g})/p={p}", 'estimate': estimator.value(),
+                            'exact': exact, 'error': abs(estimator.value() - exact)})
+            print(f"beta({a:g},{b:g}) p={p:<4}: P² {estimator.value():.4f}  exact {exact:.4f}  "
+                  f"error {results[-1]['error']:.4f}")
+
+    calibrator = ThresholdCalibrator(max_users=args.users)
+    usernames = [f"user{i}" for i in rng.integers(0, args.users, size=args.scores)]
+    confidences = rng.beta(8.0, 2.0, size=args.scores).tolist()
+    started = time.perf_counter()
+    for username, confidence in zip(usernames, confidences):
+        calibrator.record('captcha', username, confidence, 0.55)
+    recorded = time.perf_counter()
+    calibrator.drain()
+    drained = time.perf_counter()
+    lookup_us = per_call_us(lambda: calibrator.threshold('captcha', usernames[0], 0.55), 10000, args.repeat)
+    results.append({
+        'name': 'calibration/cost',
+        'record_us': 1e6 * (recorded - started) / args.scores,
+        'threshold_lookup_us': lookup_us,
+        'drain_us': 1e6 * (drained - recorded) / args.scores,
+    })
+    print(f"record {results[-1]['record_us']:.3f} us/score and threshold lookup {lookup_us:.3f} us on the request path, "
+          f"drain {results[-1]['drain_us']:.2f} us/score in the background")
+
+    # Genuine users with mean scores from well above to just under the base
+    # threshold, with impostor attempts mixed in while calibrating
+    base = 0.55
+    calibrator = ThresholdCalibrator(max_users=args.users)
+    means = rng.uniform(0.45, 0.95, size=args.users)
+    for _ in range(args.attempts):
+        genuine = rng.beta(40 * means, 40 * (1 - means))
+        impostor = rng.beta(2.0, 5.0, size=args.users)
+        for user, (score, other) in enumerate(zip(genuine.tolist(), impostor.tolist())):
+            calibrator.record('captcha', f"user{user}", score, base)
+            if rng.random() < args.impostor_rate:
+                calibrator.record('captcha', f"user{user}", other, base)
+        calibrator.drain()
+    thresholds = np.array([calibrator.threshold('captcha', f"user{user}", base) for user in range(args.users)])
+    genuine = rng.beta(40 * means[:, None], 40 * (1 - means[:, None]), size=(args.users, 200))
+    impostor = rng.beta(2.0, 5.0, size=(args.users, 200))
+    result = {
+        'name': 'calibration/false_rejects',
+        'static_frr': float(np.mean(genuine < base)),
+        'calibrated_frr': float(np.mean(genuine < thresholds[:, None])),
+        'static_far': float(np.mean(impostor >= base)),
+        'calibrated_far': float(np.mean(impostor >= thresholds[:, None])),
+        'min_threshold': float(thresholds.min()),
+        'lowest_allowed': calibrator.lowest_threshold(base),
+    }
+    results.append(result)
+    print(f"false rejects {100 * result['static_frr']:.2f}% -> {100 * result['calibrated_frr']:.2f}%, "
+          f"false accepts {100 * result['static_far']:.3f}% -> {100 * result['calibrated_far']:.3f}%, "
+          f"lowest threshold {result['min_threshold']:.3f} (floor {result['lowest_allowed']:.3f})")
+    if result['calibrated_frr'] >= result['static_frr'] or result['min_threshold'] < result['lowest_allowed']:
+        print("❌ Calibration did not lower the false-reject rate within the floor")
+        raise SystemExit(1)
+    return results
+
+
+def bench_policy(args):
+    """Build time, size and lookup cost of the device policy index"""
+    import tempfile
+    from device_policy import DevicePolicyIndex, build_policy, device_key, denied_device_key, user_key
+
+    rng = np.random.default_rng(args.seed)
+    models = [f"SM-{i:04d}" for i in range(2000)]
+    started = time.perf_counter()
+    allow = [device_key(f"user{i}", 'samsung', models[m]) for i, m in enumerate(rng.integers(0, len(models), args.users))]
+    allow += [user_key(f"user{i}") for i in range(args.users)]
+    deny = [denied_device_key('emulator', f"model{i}") for i in range(1000)]
+    hashed = time.perf_counter()
+
+    results = []
+    with tempfile.TemporaryDirectory() as root:
+        counts = {'users': args.users, 'devices': args.users, 'denied': len(deny)}
+        directory = build_policy(allow, deny, root, counts)
+        built = time.perf_counter()
+        policy = DevicePolicyIndex.load(directory)
+        loaded = time.perf_counter()
+
+        lookups = min(args.lookups, args.users)
+        hits = [(f"user{i}", 'samsung') for i in range(lookups)]
+        started_lookups = time.perf_counter()
+        found = sum(policy.has_user(username) for username, _ in hits)
+        hit_us = 1e6 * (time.perf_counter() - started_lookups) / lookups
+        started_lookups = time.perf_counter()
+        false_positives = sum(policy.allowed(f"nobody{i}", 'samsung', 'SM-0000') for i in range(lookups))
+        miss_us = 1e6 * (time.perf_counter() - started_lookups) / lookups
+        results.append({
+            'name': 'policy',
+            'users': args.users,
+            'hash_s': hashed - started,
+            'build_s': built - hashed,
+            'load_ms': 1e3 * (loaded - built),
+            'bytes': policy.nbytes,
+            'hit_us': hit_us,
+            'miss_us': miss_us,
+            'false_positives': int(false_positives),
+        })
+        if found != lookups:
+            print(f"❌ {lookups - found} enrolled users not found")
+            sys.exit(1)
+    result = results[0]
+    print(f"{args.users} users: hash {result['hash_s']:.2f}s, build {result['build_s']:.2f}s, "
+          f"load {result['load_ms']:.2f} ms, {result['bytes'] / 2 ** 20:.1f} MB")
+    print(f"lookup {hit_us:.2f} us (hit), {miss_us:.2f} us (miss), {false_positives} false positives")
+    return results
+
+
+def bench_ratelimit(args):
+    """Per-request cost of the velocity check and memory per tracked key"""
+    import tracemalloc
+    from rate_limit import LocalVelocityStore, VelocityLimiter
+
+    rng = np.random.default_rng(args.seed)
+    users = [f"user{i}" for i in rng.integers(0, args.keys, size=args.hits)]
+    devices = [f"device{i}" for i in rng.integers(0, args.keys, size=args.hits)]
+
+    def run():
+        limiter = VelocityLimiter(LocalVelocityStore(max_keys=2 * args.keys))
+
+        async def check_all():
+            for username, device in zip(users, devices):
+                await limiter.check(username, device)
+        asyncio.run(check_all())
+        return limiter
+
+    started = time.perf_counter()
+    run()
+    elapsed = time.perf_counter() - started
+    # A second run under tracemalloc, which would distort the timing
+    tracemalloc.start()
+    limiter = run()
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    keys = limiter.store.stats()['keys']
+    result = {'name': 'ratelimit', 'check_us': 1e6 * elapsed / args.hits, 'keys': keys,
+              'bytes_per_key': memory / max(keys, 1)}
+    print(f"{args.hits} checks over {keys} keys: {result['check_us']:.2f} us/check (user and device), "
+          f"~{result['bytes_per_key']:.0f} bytes/key")
+    return [result]
+
+
+def load_test_endpoints(rng):
+    """(name, method, path, content_type, bodies) for every service endpoint"""
+    captcha = [payload.encode() for payload in synthetic_payloads(rng, 200, 'captcha')]
+    pin = [payload.encode() for payload in synthetic_payloads(rng, 200, 'pin')]
+    batch = [b'\n'.join(captcha[i:i + 32] + pin[i:i + 32]) for i in range(0, 160, 32)]
+    device_state = {
+        'deviceModel': 'RMX3660', 'deviceManufacturer': 'realme', 'isDeveloperMode': False,
+        'isUSBDebugging': False, 'isEmulator': False, 'isRooted': False,
+    }
+
+    def as_json(payload):
+        return [json.dumps(payload).encode()]
+
+    return [
+        ('captcha', 'POST', '/authenticate/captcha', 'text/plain', captcha),
+        ('pin', 'POST', '/authenticate/pin', 'text/plain', pin),
+        ('auto', 'POST', '/authenticate/auto', 'text/plain', captcha[:100] + pin[:100]),
+        ('batch', 'POST', '/authenticate/batch', 'text/plain', batch),
+        ('device-check', 'POST', '/security/device-check', 'application/json',
+         as_json({'securityCheck': 'completed', 'version': 'enhanced_v2.0', 'state': device_state})),
+        ('two-factor', 'POST', '/security/two-factor', 'application/json', as_json({'twoFactorChoice': 2})),
+        ('emulator-detection', 'POST', '/security/emulator-detection', 'application/json',
+         as_json({'emulatorDetectionResult': 'real_device'})),
+        ('wifi-safety', 'POST', '/security/wifi-safety', 'application/json', as_json({'wifiSafetyChoice': 1})),
+        ('first-action', 'POST', '/security/first-action', 'application/json',
+         as_json({'firstAction': 'showBalance', 'pressed': True})),
+        ('navigation-method', 'POST', '/security/navigation-method', 'application/json',
+         as_json({'navigationMethod': 'hardwareBack'})),
+        ('session-verify', 'POST', '/security/session-verify', 'application/json', [
+            json.dumps({
+                'deviceCheck': {'securityCheck': 'completed', 'version': 'enhanced_v2.0', 'state': device_state},
+                'twoFactor': {'twoFactorChoice': 2},
+                'emulatorDetection': {'emulatorDetectionResult': 'real_device'},
+                'wifiSafety': {'wifiSafetyChoice': 1},
+                'firstAction': {'firstAction': 'showBalance', 'pressed': True},
+                'navigationMethod': {'navigationMethod': 'hardwareBack'},
+                'keystroke': {'csv': payload.decode(), 'model_type': 'captcha'},
+            }).encode()
+            for payload in captcha[:50]
+        ]),
+        ('health', 'GET', '/health', 'text/plain', [b'']),
+        ('root', 'GET', '/', 'text/plain', [b'']),
+    ]
+
+
+async def run_load(client, endpoint, concurrency, requests):
+    name, method, path, content_type, bodies = endpoint
+    latencies = []
+    errors = 0
+    request_ids = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for request_id in request_ids:
+            started = time.perf_counter()
+            status, _ = await client.request(method, path, bodies[request_id % len(bodies)], content_type)
+            latencies.append(time.perf_counter() - started)
+            if status is None or status >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies_ms = 1000.0 * np.array(latencies)
+    return {
+        'name': f"load/{name}/c={concurrency}",
+        'endpoint': name,
+        'concurrency': concurrency,
+        'requests': requests,
+        'errors': errors,
+        'throughput_rps': requests / elapsed,
+        'p50_ms': float(np.percentile(latencies_ms, 50)),
+        'p95_ms': float(np.percentile(latencies_ms, 95)),
+        'p99_ms': float(np.percentile(latencies_ms, 99)),
+        'max_ms': float(latencies_ms.max()),
+    }
+
+
+async def load_test(args):
+    await service.load_models()
+    client = ASGIClient(service.app)
+    endpoints = load_test_endpoints(np.random.default_rng(args.seed))
+    if args.endpoints:
+        endpoints = [endpoint for endpoint in endpoints if endpoint[0] in args.endpoints]
+
+    results = []
+    try:
+        for endpoint in endpoints:
+            # Warm caches and lazily started workers before measuring
+            await run_load(client, endpoint, 4, 20)
+            for concurrency in args.concurrency:
+                result = await run_load(client, endpoint, concurrency, args.requests)
+                results.append(result)
+                print(f"{endpoint[0]:>18} c={concurrency:<4} {result['throughput_rps']:9.1f} req/s  "
+                      f"p50 {result['p50_ms']:8.2f} ms  p95 {result['p95_ms']:8.2f} ms  "
+                      f"p99 {result['p99_ms']:8.2f} ms  errors {result['errors']}")
+    finally:
+        await service.stop_batchers()
+    return results
+
+
+def bench_load(args):
+    return asyncio.run(load_test(args))
+
+
+# (route, response fields) representative of each response shape
+RESPONSE_SAMPLES = (
+    ('/authenticate/captcha', {'authenticated': True, 'confidence': 0.9789659976959229, 'threshold': 0.55,
+                               'user': 'samarth', 'target_user': 'samarth', 'model_type': 'captcha'}),
+    ('/security/device-check', {'authenticated': True, 'message': 'Device authenticated', 'details': {
+        'deviceModel': 'RMX3660', 'deviceManufacturer': 'realme', 'expectedModel': 'RMX3660',
+        'expectedManufacturer': 'realme', 'deviceMatch': True, 'isDeveloperMode': False, 'isUSBDebugging': False,
+        'isEmulator': False, 'isRooted': False, 'securityCheck': 'completed', 'version': 'enhanced_v2.0'}}),
+    ('/security/two-factor', {'authenticated': True, 'message': 'Two-factor choice correct', 'choice': 2}),
+    ('/security/emulator-detection', {'authenticated': True, 'message': 'Real device detected', 'result': 'real_device'}),
+    ('/security/first-action', {'authenticated': True, 'message': 'First action correct', 'action': 'showBalance'}),
+    ('/security/navigation-method', {'authenticated': True, 'message': 'Navigation method correct',
+                                     'method': 'hardwareBack'}),
+)
+
+async def response_test(args):
+    """Time building a response the validated way and with AUTH_FAST_RESPONSES"""
+    from fastapi.responses import JSONResponse
+    from fastapi.routing import serialize_response
+
+    routes = {route.path: route for route in service.app.routes if hasattr(route, 'response_field')}
+
+    async def per_call(fn):
+        best = float('inf')
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            for _ in range(args.requests):
+                await fn()
+            best = min(best, (time.perf_counter() - started) / args.requests)
+        return 1e6 * best
+
+    results = []
+    for path, fields in RESPONSE_SAMPLES:
+        route = routes[path]
+        response_model = route.response_model
+
+        async def validated():
+            # What FastAPI does with a returned model: validate, encode, then JSONResponse
+            content = await serialize_response(field=route.response_field, response_content=response_model(**fields),
+                                               exclude_none=route.response_model_exclude_none, is_coroutine=True)
+            return JSONResponse(content)
+
+        async def fast():
+            return service.EncodedJSONResponse(service.encode_json(fields))
+
+        assert (await validated()).body == (await fast()).body, path
+        validated_us = await per_call(validated)
+        fast_us = await per_call(fast)
+        results.append({'name': f"responses{path}", 'validated_us': validated_us, 'fast_us': fast_us,
+                        'saved_us': validated_us - fast_us})
+        print(f"{path:>28}: validated {validated_us:6.2f} us  fast {fast_us:6.2f} us  "
+              f"saved {validated_us - fast_us:6.2f} us/request")
+    return results
+
+
+def bench_responses(args):
+    return asyncio.run(response_test(args))
+
+
+# Metrics where a larger value is an improvement; every other timing is lower-is-better
+HIGHER_IS_BETTER = {'throughput_rps', 'speedup'}
+COMPARED_SUFFIXES = ('_us', '_ms', '_rps')
+
+
+def bench_compare(args):
+    with open(args.baseline) as f:
+        baseline = {result['name']: result for result in json.load(f)['results']}
+    with open(args.candidate) as f:
+        candidate = {result['name']: result for result in json.load(f)['results']}
+
+    results = []
+    regressions = 0
+    for name in sorted(baseline.keys() & candidate.keys()):
+        for metric, old in baseline[name].items():
+            new = candidate[name].get(metric)
+            if not metric.endswith(COMPARED_SUFFIXES) or not isinstance(old, (int, float)) or not isinstance(new, (int, float)) or old == 0:
+                continue
+            change = (new - old) / old
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            regressed = worse > args.threshold
+            regressions += regressed
+            results.append({'name': f"{name}/{metric}", 'baseline': old, 'candidate': new, 'change': change, 'regressed': regressed})
+            print(f"{'REGRESSED' if regressed else '':>9} {name}/{metric}: {old:.2f} -> {new:.2f} ({100 * change:+.1f}%)")
+
+    print(f"{regressions} regressions beyond {100 * args.threshold:.0f}%")
+    if regressions:
+        raise SystemExit(1)
+    return results
+
+
+def run_metadata():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'commit': commit,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Authentication service benchmarks")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=5, help="timed repetitions, best is reported")
+    parser.add_argument('--output', help="write results as JSON to this file")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    features = subparsers.add_parser('features', help="extract_features vs extract_features_batch, and the one scoring picks")
+    features.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4, 8, 64, 512, 4096])
+    features.set_defaults(func=bench_features)
+
+    parse = subparsers.add_parser('parse', help="fuzz split_fields against the legacy loops and time both")
+    parse.add_argument('--fuzz-cases', type=int, default=20000)
+    parse.set_defaults(func=bench_parse)
+
+    decode = subparsers.add_parser('decode', help="time the /security body decoders")
+    decode.set_defaults(func=bench_decode)
+
+    payloads = subparsers.add_parser('payloads', help="print synthetic CSV payloads, one per line")
+    payloads.add_argument('--count', type=int, default=1000)
+    payloads.add_argument('--model-type', choices=['captcha', 'pin'], default='captcha')
+    payloads.set_defaults(func=bench_payloads)
+
+    stages = subparsers.add_parser('stages', help="time decode, parse, features, scaling, predict and serialization")
+    stages.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 32, 512])
+    stages.add_argument('--iterations', type=int, default=2000, help="samples timed per repetition")
+    stages.set_defaults(func=bench_stages)
+
+    fused = subparsers.add_parser('fused', help="check and time the scaler folded into the first layer")
+    fused.add_argument('--samples', type=int, default=20000, help="random feature rows compared")
+    fused.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 32, 512])
+    fused.add_argument('--iterations', type=int, default=2000, help="rows timed per repetition")
+    fused.set_defaults(func=bench_fused)
+
+    quantize = subparsers.add_parser('quantize', help="confidence drift and decision flips of quantized weights")
+    quantize.add_argument('--modes', nargs='+', choices=['float16', 'int8'], default=['float16', 'int8'])
+    quantize.add_argument('--samples', type=int, default=20000, help="synthetic validation rows per model")
+    quantize.add_argument('--validation', help="file of CSV payloads to validate on instead of synthetic rows")
+    quantize.add_argument('--max-flip-rate', type=float, default=0.001, help="exit 1 above this decision flip rate")
+    quantize.add_argument('--margin', type=float, default=0.05, help="confidence distance counted as near the threshold")
+    quantize.set_defaults(func=bench_quantize)
+
+    imports = subparsers.add_parser('imports', help="import time and peak RSS with and without TensorFlow")
+    imports.add_argument('--artifact-dir', help="exported models to load (default: export the pickles to a temp dir)")
+    imports.set_defaults(func=bench_imports)
+
+    calibration = subparsers.add_parser('calibration', help="P² quantile accuracy and calibration overhead")
+    calibration.add_argument('--users', type=int, default=1000)
+    calibration.add_argument('--scores', type=int, default=100000)
+    calibration.add_argument('--attempts', type=int, default=50, help="calibrating attempts per simulated user")
+    calibration.add_argument('--impostor-rate', type=float, default=0.2, help="impostor attempts per genuine one")
+    calibration.set_defaults(func=bench_calibration)
+
+    policy = subparsers.add_parser('policy', help="device policy index build time, size and lookups")
+    policy.add_argument('--users', type=int, default=1000000)
+    policy.add_argument('--lookups', type=int, default=100000)
+    policy.set_defaults(func=bench_policy)
+
+    ratelimit = subparsers.add_parser('ratelimit', help="velocity check cost and memory per tracked key")
+    ratelimit.add_argument('--keys', type=int, default=100000)
+    ratelimit.add_argument('--hits', type=int, default=200000)
+    ratelimit.set_defaults(func=bench_ratelimit)
+
+    load = subparsers.add_parser('load', help="in-process ASGI load test of every endpoint")
+    load.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 64])
+    load.add_argument('--requests', type=int, default=2000, help="requests per endpoint and concurrency level")
+    load.add_argument('--endpoints', nargs='+', help="only these endpoints (e.g. captcha pin health)")
+    load.set_defaults(func=bench_load)
+
+    responses = subparsers.add_parser('responses', help="per-request cost with and without AUTH_FAST_RESPONSES")
+    responses.add_argument('--requests', type=int, default=20000, help="responses built per repetition")
+    responses.set_defaults(func=bench_responses)
+
+    compare = subparsers.add_parser('compare', help="compare two --output files and flag regressions")
+    compare.add_argument('baseline')
+    compare.add_argument('candidate')
+    compare.add_argument('--threshold', type=float, default=0.10, help="relative change counted as a regression")
+    compare.set_defaults(func=bench_compare)
+
+    args = parser.parse_args(argv)
+    results = args.func(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'command': args.command, 'meta': run_metadata(), 'results': results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,346 @@
+"""Per-user threshold calibration from streaming confidence statistics
+
+For every (model_type, username) the calibrator keeps a fixed-size
+summary of recent confidence scores:
+
+- P² quantile estimators (Jain & Chlamtac), five markers per quantile
+- an exponentially decayed mean and variance
+
+The adaptive threshold is the `threshold_quantile` of a user's scores,
+clipped to [base - max_adjust, base + max_adjust] and only used after
+`min_samples` scores. It can loosen the decision for a genuine user whose
+scores sit just under the base threshold, and tighten it for one whose
+scores are consistently high. `floor` bounds the loosening: no user's
+threshold goes below it (or below the base threshold, if that is lower).
+
+The statistics take accepted attempts and near misses: scores from the
+lowest threshold the user could get up to the base. A near miss further
+than `near_miss_sigmas` standard deviations below a calibrated user's
+decayed mean is not like the user's own attempts and is ignored, so an
+impostor's near misses cannot drag the threshold down to the floor.
+
+The statistics are kept against the fixed base threshold rather than the
+adaptive one: a quantile of scores cut off at the adaptive threshold
+would sit above it, and every update would push it up again.
+
+Scoring only appends (model_type, username, confidence) to a pending list.
+The statistics are updated by `drain`, which the service runs from a
+background task, and thresholds are looked up from a dict.
+"""
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+CALIBRATION_FORMAT_VERSION = 1
+
+
+class P2Quantile:
+    """Streaming estimate of one quantile in constant memory (the P² algorithm)"""
+
+    __slots__ = ('p', 'count', 'heights', 'positions', 'desired', 'increments')
+
+    def __init__(self, p):
+        self.p = p
+        self.count = 0
+        self.heights = []
+        self.positions = [0.0, 1.0, 2.0, 3.0, 4.0]
+        self.desired = [0.0, 2 * p, 4 * p, 2 + 2 * p, 4.0]
+        self.increments = [0.0, p / 2, p, (1 + p) / 2, 1.0]
+
+    def add(self, x):
+        self.count += 1
+        heights = self.heights
+        if self.count <= 5:
+            heights.append(x)
+            heights.sort()
+            return
+
+        if x < heights[0]:
+            heights[0] = x
+            k = 0
+        elif x >= heights[4]:
+            heights[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= heights[k + 1]:
+                k += 1
+
+        positions = self.positions
+        for i in range(k + 1, 5):
+            positions[i] += 1
+        desired = self.desired
+        for i in range(5):
+            desired[i] += self.increments[i]
+
+        for i in (1, 2, 3):
+            d = desired[i] - positions[i]
+            if (d >= 1 and positions[i + 1] - positions[i] > 1) or (d <= -1 and positions[i - 1] - positions[i] < -1):
+                d = 1.0 if d > 0 else -1.0
+                height = self._parabolic(i, d)
+                if not heights[i - 1] < height < heights[i + 1]:
+                    j = i + int(d)
+                    height = heights[i] + d * (heights[j] - heights[i]) / (positions[j] - positions[i])
+                heights[i] = height
+                positions[i] += d
+
+    def _parabolic(self, i, d):
+        q, n = self.heights, self.positions
+        return q[i] + d / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+        )
+
+    def value(self):
+        if self.count == 0:
+            return math.nan
+        if self.count <= 5:
+            # Exact quantile of the few values seen so far
+            return float(np.quantile(self.heights, self.p))
+        return self.heights[2]
+
+    def to_state(self):
+        heights = self.heights + [math.nan] * (5 - len(self.heights))
+        return [float(self.count)] + heights + self.positions + self.desired
+
+    @classmethod
+    def from_state(cls, p, state):
+        estimator = cls(p)
+        estimator.count = int(state[0])
+        estimator.heights = [h for h in state[1:6] if not math.isnan(h)][:min(estimator.count, 5)]
+        estimator.positions = list(state[6:11])
+        estimator.desired = list(state[11:16])
+        return estimator
+
+
+class ScoreStats:
+    """Decayed mean and variance plus quantile estimators of one user's scores"""
+
+    __slots__ = ('count', 'mean', 'variance', 'updated_at', 'quantiles')
+
+    STATE_SIZE = 4
+
+    def __init__(self, quantiles):
+        self.count = 0
+        self.mean = 0.0
+        self.variance = 0.0
+        self.updated_at = 0.0
+        self.quantiles = [P2Quantile(p) for p in quantiles]
+
+    def add(self, x, decay, now):
+        self.count += 1
+        if self.count == 1:
+            self.mean = x
+        else:
+            # Exponentially weighted mean and variance (West's incremental form)
+            delta = x - self.mean
+            self.mean += decay * delta
+            self.variance = (1 - decay) * (self.variance + decay * delta * delta)
+        self.updated_at = now
+        for estimator in self.quantiles:
+            estimator.add(x)
+
+    def to_state(self):
+        state = [float(self.count), self.mean, self.variance, self.updated_at]
+        for estimator in self.quantiles:
+            state.extend(estimator.to_state())
+        return state
+
+    @classmethod
+    def from_state(cls, quantiles, state):
+        stats = cls(quantiles)
+        stats.count = int(state[0])
+        stats.mean, stats.variance, stats.updated_at = state[1], state[2], state[3]
+        stats.quantiles = [
+            P2Quantile.from_state(p, state[cls.STATE_SIZE + 16 * i:cls.STATE_SIZE + 16 * (i + 1)])
+            for i, p in enumerate(quantiles)
+        ]
+        return stats
+
+
+class ThresholdCalibrator:
+    """Streaming per-user score statistics and the thresholds derived from them
+
+    At most `max_users` users are tracked; the least recently scored one
+    is forgotten first. `max_pending` bounds the scores waiting for
+    `drain`, beyond which new scores are dropped and counted.
+    """
+
+    def __init__(self, max_users=100000, quantiles=(0.05, 0.5, 0.95), threshold_quantile=0.05, decay=0.05,
+                 min_samples=20, max_adjust=0.1, max_pending=65536, floor=0.5, near_miss_sigmas=3.0):
+        self.quantiles = tuple(sorted(set(quantiles) | {threshold_quantile}))
+        self.threshold_index = self.quantiles.index(threshold_quantile)
+        self.max_users = max(1, int(max_users))
+        self.decay = decay
+        self.min_samples = int(min_samples)
+        self.max_adjust = max_adjust
+        self.max_pending = int(max_pending)
+        self.floor = floor
+        self.near_miss_sigmas = near_miss_sigmas
+
+        self._users = OrderedDict()
+        self._thresholds = {}
+        self._pending = []
+        # Bumped by every drain that changes the statistics; saved up to _saved_generation
+        self._generation = 0
+        self._saved_generation = 0
+        self._save_lock = threading.Lock()
+
+        self.recorded = 0
+        self.dropped = 0
+        self.ignored = 0
+        self.near_misses = 0
+        self.evictions = 0
+
+    def lowest_threshold(self, base):
+        """The lowest adaptive threshold a user can get for this base threshold"""
+        return max(base - self.max_adjust, min(base, self.floor))
+
+    def record(self, model_type, username, confidence, base_threshold):
+        """Queue a score for the next drain; never blocks
+
+        Scores below the lowest threshold a user could get are ignored.
+        """
+        if confidence < self.lowest_threshold(base_threshold):
+            self.ignored += 1
+            return
+        if len(self._pending) >= self.max_pending:
+            self.dropped += 1
+            return
+        self._pending.append((model_type, username, float(confidence), float(base_threshold)))
+
+    def drain(self):
+        """Fold every pending score into the statistics; returns how many"""
+        pending, self._pending = self._pending, []
+        now = time.time()
+        for model_type, username, confidence, base in pending:
+            key = (model_type, username)
+            stats = self._users.get(key)
+            if confidence < base:
+                if stats is not None and stats.count >= self.min_samples and \
+                        confidence < stats.mean - self.near_miss_sigmas * math.sqrt(stats.variance):
+                    self.ignored += 1
+                    continue
+                self.near_misses += 1
+            if stats is None:
+                stats = self._users[key] = ScoreStats(self.quantiles)
+                while len(self._users) > self.max_users:
+                    evicted, _ = self._users.popitem(last=False)
+                    self._thresholds.pop(evicted, None)
+                    self.evictions += 1
+            else:
+                self._users.move_to_end(key)
+            stats.add(confidence, self.decay, now)
+            self.recorded += 1
+            if stats.count >= self.min_samples:
+                self._thresholds[key] = (base, self._derive(stats, base))
+        if pending:
+            self._generation += 1
+        return len(pending)
+
+    def _derive(self, stats, base):
+        value = stats.quantiles[self.threshold_index].value()
+        return max(self.lowest_threshold(base), min(base + self.max_adjust, value))
+
+    def threshold(self, model_type, username, base):
+        """The user's adaptive threshold, or `base` until they have enough scores"""
+        entry = self._thresholds.get((model_type, username))
+        if entry is None:
+            return base
+        if entry[0] != base:
+            # The model (and its threshold) changed since the last update
+            return self._derive(self._users[(model_type, username)], base)
+        return entry[1]
+
+    def user_report(self, model_type, username, base):
+        stats = self._users.get((model_type, username))
+        if stats is None:
+            return None
+        return {
+            "model_type": model_type,
+            "user": username,
+            "count": stats.count,
+            "mean": stats.mean,
+            "std": math.sqrt(stats.variance),
+            "quantiles": {str(estimator.p): estimator.value() for estimator in stats.quantiles},
+            "base_threshold": base,
+            "threshold": self.threshold(model_type, username, base),
+            "calibrated": stats.count >= self.min_samples,
+            "updated_at": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(stats.updated_at)),
+        }
+
+    def users(self, model_type=None):
+        """Tracked (model_type, username) keys, most recently scored first"""
+        return [key for key in reversed(self._users) if model_type is None or key[0] == model_type]
+
+    @property
+    def dirty(self):
+        """Whether there are statistics that no save has written yet"""
+        return self._generation > self._saved_generation
+
+    def snapshot(self):
+        """The tracked users and thresholds as of now, for `save`
+
+        Take it on the thread that drains; it copies the containers, so
+        `save` can then run on another thread.
+        """
+        return self._generation, list(self._users.items()), dict(self._thresholds)
+
+    def save(self, path, snapshot=None):
+        """Write a snapshot (by default the current state) to one .npz file, replaced atomically
+
+        Saves are serialized, and one older than the last written is
+        skipped. A drain while the snapshot is written bumps the generation,
+        so the calibrator stays dirty and the next save writes it again.
+        """
+        generation, users, thresholds = self.snapshot() if snapshot is None else snapshot
+        with self._save_lock:
+            if generation < self._saved_generation:
+                return
+            states = np.array([stats.to_state() for _, stats in users], dtype=np.float64).reshape(
+                len(users), ScoreStats.STATE_SIZE + 16 * len(self.quantiles)
+            )
+            bases = np.array([thresholds.get(key, (math.nan, None))[0] for key, _ in users], dtype=np.float64)
+            staging = f"{path}.tmp-{os.getpid()}.npz"
+            np.savez_compressed(
+                staging,
+                format_version=np.array(CALIBRATION_FORMAT_VERSION),
+                quantiles=np.array(self.quantiles, dtype=np.float64),
+                model_types=np.array([key[0] for key, _ in users], dtype=str),
+                usernames=np.array([key[1] for key, _ in users], dtype=str),
+                states=states,
+                bases=bases,
+            )
+            os.replace(staging, path)
+            self._saved_generation = generation
+
+    def load(self, path):
+        """Restore statistics written by save; returns the number of users"""
+        with np.load(path, allow_pickle=False) as data:
+            if int(data['format_version']) != CALIBRATION_FORMAT_VERSION:
+                raise ValueError(f"Unsupported calibration format {int(data['format_version'])} in {path}")
+            if tuple(data['quantiles']) != self.quantiles:
+                raise ValueError(f"{path} tracks quantiles {tuple(data['quantiles'])}, expected {self.quantiles}")
+            for model_type, username, state, base in zip(data['model_types'], data['usernames'], data['states'], data['bases']):
+                key = (str(model_type), str(username))
+                stats = self._users[key] = ScoreStats.from_state(self.quantiles, state.tolist())
+                if stats.count >= self.min_samples and not math.isnan(base):
+                    self._thresholds[key] = (float(base), self._derive(stats, float(base)))
+        return len(self._users)
+
+    def stats(self):
+        return {
+            "users": len(self._users),
+            "calibrated_users": len(self._thresholds),
+            "pending": len(self._pending),
+            "recorded": self.recorded,
+            "ignored": self.ignored,
+            "near_misses": self.near_misses,
+            "dropped": self.dropped,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,256 @@
+"""Device policy index: per-user enrolled devices and a global deny-list
+
+The index is a directory `<root>/v<N>/` with a `manifest.json` and two
+open-addressing hash tables saved as `.npy` files of uint64 keys:
+
+- `allow.npy` holds one key per enrolled (username, manufacturer,
+  model), plus one key per username that has enrolled devices
+- `deny.npy` holds one key per denied build fingerprint and per denied
+  (manufacturer, model)
+
+Keys are 64-bit blake2b digests of the normalized fields; 0 marks an
+empty slot. Tables are sized to a power of two at most half full and
+probed linearly, so a lookup is one hash and usually one or two slot
+reads. They are memory-mapped, so loading takes milliseconds however
+many users there are, and every worker on the host shares the pages.
+
+Build a new version from a CSV dump with:
+
+    python device_policy.py build devices.csv [--output-dir device_policy]
+
+The CSV has a header and the columns `type,username,manufacturer,model,
+fingerprint`. `type` is `allow` (username, manufacturer and model) or
+`deny` (a fingerprint, or a manufacturer and model).
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+
+
+POLICY_FORMAT_VERSION = 1
+
+# Tables are at most this full, which keeps linear probe chains short
+MAX_LOAD_FACTOR = 0.5
+
+
+def _normalize(value):
+    return (value or '').strip().casefold()
+
+
+def policy_key(*parts):
+    """64-bit table key for the given fields; never 0, which marks an empty slot"""
+    digest = hashlib.blake2b('\x1f'.join(parts).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') or 1
+
+
+def user_key(username):
+    return policy_key('user', username)
+
+
+def device_key(username, manufacturer, model):
+    return policy_key('device', username, _normalize(manufacturer), _normalize(model))
+
+
+def denied_fingerprint_key(fingerprint):
+    return policy_key('fingerprint', (fingerprint or '').strip())
+
+
+def denied_device_key(manufacturer, model):
+    return policy_key('model', _normalize(manufacturer), _normalize(model))
+
+
+def build_table(keys):
+    """Open-addressing table (uint64, power-of-two size) holding every distinct key"""
+    keys = np.unique(np.asarray(keys, dtype=np.uint64))
+    size = 1
+    while size * MAX_LOAD_FACTOR < max(len(keys), 1):
+        size *= 2
+    table = np.zeros(size, dtype=np.uint64)
+    mask = np.uint64(size - 1)
+
+    # Place keys a whole probe step at a time: every key whose slot is empty
+    # and that is the first claimant of that slot goes in, the rest move on
+    slots = keys & mask
+    pending = np.arange(len(keys))
+    while len(pending):
+        free = table[slots[pending]] == 0
+        candidates = pending[free]
+        _, first = np.unique(slots[candidates], return_index=True)
+        placed = candidates[first]
+        table[slots[placed]] = keys[placed]
+        remaining = np.ones(len(pending), dtype=bool)
+        remaining[np.flatnonzero(free)[first]] = False
+        pending = pending[remaining]
+        slots[pending] = (slots[pending] + np.uint64(1)) & mask
+    return table
+
+
+def table_contains(table, key):
+    mask = len(table) - 1
+    slot = key & mask
+    while True:
+        value = int(table[slot])
+        if value == key:
+            return True
+        if value == 0:
+            return False
+        slot = (slot + 1) & mask
+
+
+class DevicePolicyIndex:
+    """Memory-mapped allow and deny tables with O(1) lookups"""
+
+    def __init__(self, allow, deny, manifest, directory=None):
+        self.allow = allow
+        self.deny = deny
+        self.manifest = manifest
+        self.directory = directory
+        self.version = f"device-policy-v{manifest['version']}"
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        with open(os.path.join(directory, 'manifest.json')) as f:
+            manifest = json.load(f)
+        if manifest.get('format_version') != POLICY_FORMAT_VERSION:
+            raise ValueError(f"Unsupported device policy format {manifest.get('format_version')} in {directory}")
+        tables = {}
+        for name in ('allow', 'deny'):
+            table = np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode, allow_pickle=False)
+            if table.dtype != np.uint64 or len(table) & (len(table) - 1) or len(table) != manifest['tables'][name]:
+                raise ValueError(f"Table {name} in {directory} does not match its manifest entry")
+            tables[name] = table.view(np.ndarray)
+        return cls(tables['allow'], tables['deny'], manifest, directory)
+
+    def has_user(self, username):
+        """Whether the user has any enrolled device"""
+        return bool(username) and table_contains(self.allow, user_key(username))
+
+    def allowed(self, username, manufacturer, model):
+        return table_contains(self.allow, device_key(username, manufacturer, model))
+
+    def denied(self, manufacturer, model, fingerprint=None):
+        if fingerprint and table_contains(self.deny, denied_fingerprint_key(fingerprint)):
+            return True
+        return table_contains(self.deny, denied_device_key(manufacturer, model))
+
+    @property
+    def nbytes(self):
+        return self.allow.nbytes + self.deny.nbytes
+
+    def stats(self):
+        return {
+            "version": self.version,
+            "directory": self.directory,
+            "users": self.manifest['users'],
+            "devices": self.manifest['devices'],
+            "denied": self.manifest['denied'],
+            "bytes": self.nbytes,
+            "created": self.manifest['created'],
+        }
+
+
+def read_policy_csv(path):
+    """(allow keys, deny keys, counts) from a CSV dump"""
+    allow, deny = [], []
+    users = set()
+    counts = {'devices': 0, 'denied': 0, 'skipped': 0}
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            kind = _normalize(row.get('type'))
+            username = (row.get('username') or '').strip()
+            manufacturer, model = row.get('manufacturer'), row.get('model')
+            fingerprint = (row.get('fingerprint') or '').strip()
+            if kind == 'allow' and username and _normalize(model):
+                allow.append(device_key(username, manufacturer, model))
+                if username not in users:
+                    users.add(username)
+                    allow.append(user_key(username))
+                counts['devices'] += 1
+            elif kind == 'deny' and fingerprint:
+                deny.append(denied_fingerprint_key(fingerprint))
+                counts['denied'] += 1
+            elif kind == 'deny' and _normalize(model):
+                deny.append(denied_device_key(manufacturer, model))
+                counts['denied'] += 1
+            else:
+                counts['skipped'] += 1
+    counts['users'] = len(users)
+    return allow, deny, counts
+
+
+def list_versions(root):
+    if not os.path.isdir(root):
+        return []
+    return sorted(int(entry[1:]) for entry in os.listdir(root)
+                  if entry.startswith('v') and entry[1:].isdigit()
+                  and os.path.isfile(os.path.join(root, entry, 'manifest.json')))
+
+
+def find_policy(root):
+    """Directory of the newest policy version under root, or None"""
+    versions = list_versions(root)
+    return os.path.join(root, f"v{versions[-1]}") if versions else None
+
+
+def build_policy(allow, deny, root, counts, source=None):
+    """Write the tables as the next version and publish it with one rename"""
+    versions = list_versions(root)
+    version = versions[-1] + 1 if versions else 1
+    final_dir = os.path.join(root, f"v{version}")
+    staging_dir = f"{final_dir}.tmp-{os.getpid()}"
+    os.makedirs(staging_dir)
+    try:
+        tables = {'allow': build_table(allow), 'deny': build_table(deny)}
+        for name, table in tables.items():
+            np.save(os.path.join(staging_dir, f"{name}.npy"), table)
+        manifest = {
+            'format_version': POLICY_FORMAT_VERSION,
+            'version': version,
+            'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'users': counts.get('users', 0),
+            'devices': counts.get('devices', 0),
+            'denied': counts.get('denied', 0),
+            'tables': {name: len(table) for name, table in tables.items()},
+        }
+        if source is not None:
+            manifest['source'] = os.path.basename(source)
+        with open(os.path.join(staging_dir, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.rename(staging_dir, final_dir)
+    except Exception:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        raise
+    return final_dir
+
+
+def build_command(args):
+    started = time.perf_counter()
+    allow, deny, counts = read_policy_csv(args.csv)
+    directory = build_policy(allow, deny, args.output_dir, counts, source=args.csv)
+    print(f"✅ Device policy built in {directory} in {time.perf_counter() - started:.1f}s: "
+          f"{counts['users']} users, {counts['devices']} devices, {counts['denied']} denied, "
+          f"{counts['skipped']} rows skipped")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build device policy indexes for /security/device-check")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build = subparsers.add_parser('build', help="build a new policy version from a CSV dump")
+    build.add_argument('csv')
+    build.add_argument('--output-dir', default='device_policy', help="policy root directory")
+    build.set_defaults(func=build_command)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+import asyncio
+import concurrent.futures
+import multiprocessing
+import os
+
+
+EXECUTOR_MODES = ('inline', 'thread', 'process')
+
+
+class Overloaded(Exception):
+    """Raised when the scoring path already holds its maximum in-flight requests"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Scoring backend saturated, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class ScoringExecutor:
+    """Runs CPU-bound scoring off the event loop with bounded admission
+
+    mode 'thread' uses a thread pool (NumPy releases the GIL in the heavy
+    parts), 'process' a process pool whose workers run `initializer` once to
+    preload models, and 'inline' runs on the event loop as before.
+    At most `max_in_flight` requests may hold a slot; the next one gets
+    Overloaded so the handler can answer 429 instead of queueing forever.
+    """
+
+    def __init__(self, mode='thread', workers=None, max_in_flight=1024, retry_after=1,
+                 initializer=None, initargs=()):
+        if mode not in EXECUTOR_MODES:
+            raise ValueError(f"Unknown executor mode: {mode}")
+        self.mode = mode
+        self.workers = workers or os.cpu_count() or 1
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.retry_after = retry_after
+        self.initializer = initializer
+        self.initargs = initargs
+
+        self.in_flight = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self._pool = None
+
+    def _create_pool(self, initargs):
+        if self.mode == 'thread':
+            return concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix='scoring'
+            )
+        # Spawned workers do not inherit the parent's TensorFlow threads
+        return concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=self.initializer,
+            initargs=initargs,
+        )
+
+    def start(self):
+        if self._pool is not None or self.mode == 'inline':
+            return
+        self._pool = self._create_pool(self.initargs)
+
+    async def restart(self, initargs=None, warm=()):
+        """Start a fresh worker pool, warm every worker, then swap it in
+
+        `warm` is a list of (fn, args) calls run once per worker on the new
+        pool, so its workers have started (and run `initializer`) before it
+        takes traffic. If any call fails the new pool is discarded and the
+        error raised; the old pool keeps serving. Work already submitted to
+        the old pool finishes there.
+        """
+        if self.mode == 'inline':
+            return
+        initargs = self.initargs if initargs is None else initargs
+        pool = self._create_pool(initargs)
+        loop = asyncio.get_running_loop()
+        try:
+            for fn, args in warm:
+                # One call per worker at once, so the pool spawns all of them
+                await asyncio.gather(*(loop.run_in_executor(pool, fn, *args) for _ in range(self.workers)))
+        except BaseException:
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+        self.initargs = initargs
+        old_pool, self._pool = self._pool, pool
+        if old_pool is not None:
+            old_pool.shutdown(wait=False)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def acquire(self):
+        """Take an admission slot or raise Overloaded"""
+        if self.in_flight >= self.max_in_flight:
+            self.rejected += 1
+            raise Overloaded(self.retry_after)
+        self.in_flight += 1
+
+    def release(self):
+        self.in_flight -= 1
+
+    async def run(self, fn, *args):
+        """Call fn(*args) on the configured backend and return its result"""
+        self.running += 1
+        try:
+            if self.mode == 'inline':
+                return fn(*args)
+            self.start()
+            return await asyncio.get_running_loop().run_in_executor(self._pool, fn, *args)
+        finally:
+            self.running -= 1
+            self.completed += 1
+
+    def stats(self):
+        return {
+            "mode": self.mode,
+            "workers": 0 if self.mode == 'inline' else self.workers,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "running": self.running,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
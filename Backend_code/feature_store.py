@@ -0,0 +1,271 @@
+"""Write-behind store of scored keystroke sessions as columnar NumPy segments
+
+Handlers call `append` after scoring. It only adds the sample to an
+in-memory buffer and never waits. A background task writes a buffer out
+once it reaches `max_rows` or `max_bytes`, or `max_seconds` after its
+first row, as segments of at most `max_rows` rows. The feature vectors are computed in
+the writer thread, not on the request path. If the writer falls behind
+by more than `max_pending` rows, new rows are dropped and counted rather
+than slowing requests down.
+
+A segment is a directory `<root>/<model_type>/<segment>/` with a
+`manifest.json` and one `.npy` file per column:
+
+- fixed-width columns (`features`, `confidence`, the float fields, ...)
+  are one array with a row per sample
+- ragged columns (timing arrays, strings) are a `<name>.values.npy`
+  array holding every row back to back, plus a `<name>.offsets.npy`
+  int64 array of length rows + 1; row i is values[offsets[i]:offsets[i + 1]]
+  (strings are stored as UTF-8 bytes)
+
+Segments are written under a temporary name and renamed into place, so a
+reader never sees a partial one. `read_segment` loads one back.
+"""
+import asyncio
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+
+SEGMENT_FORMAT_VERSION = 1
+
+STRING_COLUMNS = ('username', 'captcha', 'userInput', 'timestamp', 'model_version')
+RAGGED_COLUMNS = ('flightTimesArray', 'dwellTimesArray', 'interKeyPausesArray', 'typingPatternVector')
+
+
+def _ragged(rows, dtype):
+    """(values, offsets) for a list of variable-length rows"""
+    offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(row) for row in rows])
+    values = np.fromiter((value for row in rows for value in row), dtype=dtype, count=int(offsets[-1]))
+    return values, offsets
+
+
+class FeatureStore:
+    """Buffers scored samples per model type and writes them as segments
+
+    `featurize(samples)` turns a list of samples into the N x 25 feature
+    matrix; `float_fields` are the sample's scalar float fields, stored
+    one column each.
+    """
+
+    def __init__(self, root, featurize, float_fields, max_rows=4096, max_bytes=8 * 1024 * 1024,
+                 max_seconds=60.0, max_pending=65536):
+        self.root = root
+        self.featurize = featurize
+        self.float_fields = tuple(float_fields)
+        self.max_rows = max(1, int(max_rows))
+        self.max_bytes = int(max_bytes)
+        self.max_seconds = max_seconds
+        self.max_pending = int(max_pending)
+
+        # model_type -> [rows, estimated bytes, monotonic time of the first row]
+        self._buffers = {}
+        self._pending = 0
+        self._sequence = 0
+        self._task = None
+        self._wakeup = None
+        # Segment writes left running in their threads by a cancelled flush
+        self._detached_writes = set()
+
+        self.appended = 0
+        self.dropped = 0
+        self.segments_written = 0
+        self.rows_written = 0
+        self.bytes_written = 0
+        self.write_errors = 0
+        self.last_error = None
+
+    def append(self, model_type, sample, confidence, authenticated, model_version):
+        """Queue one scored sample; never blocks"""
+        if self._pending >= self.max_pending:
+            self.dropped += 1
+            return
+        buffer = self._buffers.get(model_type)
+        if buffer is None:
+            buffer = self._buffers[model_type] = [[], 0, time.monotonic()]
+        # Features, scalars and timestamps plus the ragged and string payloads
+        size = 8 * (25 + len(self.float_fields) + 4) + sum(
+            8 * len(sample.get(name) or ()) for name in RAGGED_COLUMNS
+        ) + sum(len(str(sample.get(name) or '')) for name in STRING_COLUMNS)
+        buffer[0].append((sample, float(confidence), bool(authenticated), model_version, time.time(), size))
+        buffer[1] += size
+        self._pending += 1
+        self.appended += 1
+        if self._wakeup is not None and (len(buffer[0]) >= self.max_rows or buffer[1] >= self.max_bytes):
+            self._wakeup.set()
+
+    def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Stop the background writer and write out whatever is buffered"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._detached_writes:
+            await asyncio.wait(self._detached_writes)
+        await self.flush(force=True)
+        if self._pending:
+            print(f"⚠️ {self._pending} rows could not be written to the feature store before shutdown")
+
+    async def flush(self, force=False):
+        for model_type in list(self._buffers):
+            rows, size, first_at = self._buffers[model_type]
+            if not rows:
+                continue
+            if not force and len(rows) < self.max_rows and size < self.max_bytes \
+                    and time.monotonic() - first_at < self.max_seconds:
+                continue
+            # Swap the buffer out first so requests keep appending to a fresh one
+            del self._buffers[model_type]
+            while rows:
+                segment_rows = rows[:self.max_rows]
+                self._sequence += 1
+                write = asyncio.ensure_future(
+                    asyncio.to_thread(self._write_segment, model_type, segment_rows, self._sequence)
+                )
+                try:
+                    await asyncio.shield(write)
+                except asyncio.CancelledError:
+                    # The segment being written finishes in its thread; the rest goes
+                    # back to the buffer for the next flush (stop() writes it out)
+                    self._requeue(model_type, rows[len(segment_rows):], first_at)
+                    self._detached_writes.add(write)
+                    write.add_done_callback(self._detached_writes.discard)
+                    write.add_done_callback(
+                        lambda future, segment=segment_rows: self._written(model_type, future, segment, first_at)
+                    )
+                    raise
+                except Exception:
+                    pass  # reported by _written
+                if not self._written(model_type, write, segment_rows, first_at):
+                    self._requeue(model_type, rows[len(segment_rows):], first_at)
+                    break
+                rows = rows[len(segment_rows):]
+
+    def _requeue(self, model_type, rows, first_at):
+        """Put unwritten rows back in front of whatever was appended since"""
+        if not rows:
+            return
+        buffer = self._buffers.get(model_type)
+        if buffer is None:
+            buffer = self._buffers[model_type] = [[], 0, first_at]
+        buffer[0][:0] = rows
+        buffer[1] += sum(row[5] for row in rows)
+        buffer[2] = min(buffer[2], first_at)
+
+    def _written(self, model_type, write, rows, first_at):
+        """Account for a finished segment write; a failed one is put back for a retry"""
+        error = write.exception()
+        if error is None:
+            self._pending -= len(rows)
+            return True
+        self.write_errors += 1
+        self.last_error = str(error)
+        print(f"⚠️ Could not write {len(rows)} {model_type} rows to the feature store, will retry: {error}")
+        self._requeue(model_type, rows, first_at)
+        return False
+
+    async def _run(self):
+        interval = min(1.0, self.max_seconds / 4) if self.max_seconds > 0 else 1.0
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def _write_segment(self, model_type, rows, sequence):
+        samples = [row[0] for row in rows]
+        columns = {
+            'features': np.asarray(self.featurize(samples), dtype=np.float64),
+            'confidence': np.array([row[1] for row in rows], dtype=np.float64),
+            'authenticated': np.array([row[2] for row in rows], dtype=np.bool_),
+            'received_at': np.array([row[4] for row in rows], dtype=np.float64),
+            'isCorrect': np.array([bool(sample.get('isCorrect')) for sample in samples], dtype=np.bool_),
+        }
+        for name in self.float_fields:
+            columns[name] = np.array([sample.get(name, np.nan) for sample in samples], dtype=np.float64)
+        for name in RAGGED_COLUMNS:
+            columns[f"{name}.values"], columns[f"{name}.offsets"] = _ragged(
+                [sample.get(name) or () for sample in samples], np.int64
+            )
+        for name in STRING_COLUMNS:
+            values = [row[3] if name == 'model_version' else sample.get(name) for sample, row in zip(samples, rows)]
+            encoded = [str(value if value is not None else '').encode('utf-8') for value in values]
+            columns[f"{name}.values"], columns[f"{name}.offsets"] = _ragged(encoded, np.uint8)
+
+        segment = f"{time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())}-{os.getpid()}-{sequence:06d}"
+        final_dir = os.path.join(self.root, model_type, segment)
+        staging_dir = os.path.join(self.root, model_type, f".{segment}.tmp")
+        os.makedirs(staging_dir)
+        try:
+            size = 0
+            for name, array in columns.items():
+                np.save(os.path.join(staging_dir, f"{name}.npy"), array)
+                size += array.nbytes
+            manifest = {
+                'format_version': SEGMENT_FORMAT_VERSION,
+                'model_type': model_type,
+                'rows': len(rows),
+                'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                'fixed': [name for name in columns if '.' not in name],
+                'ragged': list(RAGGED_COLUMNS),
+                'strings': list(STRING_COLUMNS),
+            }
+            with open(os.path.join(staging_dir, 'manifest.json'), 'w') as f:
+                json.dump(manifest, f, indent=2)
+            os.rename(staging_dir, final_dir)
+        except Exception:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            raise
+
+        self.segments_written += 1
+        self.rows_written += len(rows)
+        self.bytes_written += size
+        return final_dir
+
+    def stats(self):
+        return {
+            "enabled": True,
+            "root": self.root,
+            "pending_rows": self._pending,
+            "appended": self.appended,
+            "dropped": self.dropped,
+            "segments_written": self.segments_written,
+            "rows_written": self.rows_written,
+            "bytes_written": self.bytes_written,
+            "write_errors": self.write_errors,
+            "last_error": self.last_error,
+        }
+
+
+def read_segment(directory, mmap_mode='r'):
+    """Columns of one segment; ragged and string columns come back as lists of rows"""
+    with open(os.path.join(directory, 'manifest.json')) as f:
+        manifest = json.load(f)
+    if manifest.get('format_version') != SEGMENT_FORMAT_VERSION:
+        raise ValueError(f"Unsupported segment format {manifest.get('format_version')} in {directory}")
+
+    def load(name):
+        return np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode, allow_pickle=False)
+
+    columns = {name: load(name) for name in manifest['fixed']}
+    for name in manifest['ragged'] + manifest['strings']:
+        values, offsets = load(f"{name}.values"), load(f"{name}.offsets")
+        rows = [values[offsets[i]:offsets[i + 1]] for i in range(manifest['rows'])]
+        if name in manifest['strings']:
+            rows = [bytes(row).decode('utf-8') for row in rows]
+        columns[name] = rows
+    return columns
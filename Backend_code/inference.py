@@ -0,0 +1,324 @@
+import json
+import os
+import threading
+
+import numpy as np
+
+
+# Largest absolute difference in confidence allowed between the NumPy
+# forward pass and Keras before the NumPy engine is rejected for a model
+NUMPY_ENGINE_TOLERANCE = 1e-5
+
+
+def _sigmoid(x):
+    # exp only ever sees non-positive values, so large logits of either sign cannot overflow
+    e = np.exp(-np.abs(x))
+    return np.where(x >= 0, 1.0 / (1.0 + e), e / (1.0 + e))
+
+def _softmax(x):
+    e = np.exp(x - np.max(x, axis=-1, keepdims=True))
+    return e / np.sum(e, axis=-1, keepdims=True)
+
+ACTIVATIONS = {
+    'linear': lambda x: x,
+    'relu': lambda x: np.maximum(x, 0),
+    'sigmoid': _sigmoid,
+    'tanh': np.tanh,
+    'softmax': _softmax,
+}
+
+
+class NumpySequential:
+    """Inference-only forward pass for small Keras Sequential dense nets
+
+    Each layer is a dict with a `type` of 'dense' (kernel, bias, activation)
+    or 'affine' (per-feature multiplier and offset, used for inference-mode
+    BatchNormalization). Dropout is a no-op at inference and is dropped.
+    Quantized dense layers (see quantize_model) hold a float16 kernel, or
+    an int8 kernel plus a per-output `kernel_scale`. They are widened to
+    float32 one layer at a time, in a buffer each thread reuses, so the
+    float32 copy of the weights never outlives the matmul that needs it:
+    the cost is one cast per layer per call and, per thread, a buffer the
+    size of the largest quantized kernel.
+    Exposes `predict(x, verbose=0)` so it can stand in for the Keras model.
+    """
+
+    def __init__(self, layers, dtype=np.float32):
+        self.layers = layers
+        self.dtype = dtype
+
+    @classmethod
+    def from_keras(cls, model):
+        """Pull weights and activations out of a built Keras Sequential"""
+        layers = []
+        for layer in model.layers:
+            kind = layer.__class__.__name__
+            config = layer.get_config()
+
+            if kind == 'Dense':
+                weights = layer.get_weights()
+                kernel = weights[0]
+                bias = weights[1] if config.get('use_bias', True) else np.zeros(kernel.shape[1], kernel.dtype)
+                layers.append({
+                    'type': 'dense',
+                    'kernel': np.asarray(kernel, dtype=np.float32),
+                    'bias': np.asarray(bias, dtype=np.float32),
+                    'activation': _activation_name(config.get('activation', 'linear')),
+                })
+            elif kind == 'BatchNormalization':
+                weights = list(layer.get_weights())
+                gamma = weights.pop(0) if config.get('scale', True) else None
+                beta = weights.pop(0) if config.get('center', True) else None
+                moving_mean, moving_variance = weights
+                multiplier = 1.0 / np.sqrt(moving_variance + config.get('epsilon', 1e-3))
+                if gamma is not None:
+                    multiplier = multiplier * gamma
+                offset = -moving_mean * multiplier
+                if beta is not None:
+                    offset = offset + beta
+                layers.append({
+                    'type': 'affine',
+                    'multiplier': np.asarray(multiplier, dtype=np.float32),
+                    'offset': np.asarray(offset, dtype=np.float32),
+                })
+            elif kind == 'Activation':
+                layers.append({'type': 'activation', 'activation': _activation_name(config['activation'])})
+            elif kind in ('Dropout', 'InputLayer'):
+                continue
+            else:
+                raise ValueError(f"Unsupported layer for NumPy inference: {kind}")
+
+        return cls(layers)
+
+    def predict(self, x, verbose=0):
+        x = np.asarray(x, dtype=self.dtype)
+        for layer in self.layers:
+            kind = layer['type']
+            if kind == 'dense':
+                x = x @ _float_kernel(layer['kernel'])
+                if 'kernel_scale' in layer:
+                    x *= layer['kernel_scale']
+                x = ACTIVATIONS[layer['activation']](x + layer['bias'])
+            elif kind == 'affine':
+                x = x * layer['multiplier'] + layer['offset']
+            else:
+                x = ACTIVATIONS[layer['activation']](x)
+            if x.dtype != self.dtype:
+                x = x.astype(self.dtype)
+        return x
+
+    __call__ = predict
+
+    @property
+    def nbytes(self):
+        """Bytes held by the weight arrays"""
+        return sum(value.nbytes for layer in self.layers for value in layer.values() if isinstance(value, np.ndarray))
+
+    def to_arrays(self):
+        """Split the model into a JSON-able layer spec and named weight arrays"""
+        spec = []
+        arrays = {}
+        for index, layer in enumerate(self.layers):
+            entry = {}
+            for key, value in layer.items():
+                if isinstance(value, np.ndarray):
+                    name = f"layer{index}_{key}"
+                    arrays[name] = value
+                    entry[key] = name
+                else:
+                    entry[key] = value
+            spec.append(entry)
+        return spec, arrays
+
+    @classmethod
+    def from_arrays(cls, spec, arrays):
+        layers = []
+        for entry in spec:
+            layer = {}
+            for key, value in entry.items():
+                layer[key] = arrays[value] if key not in ('type', 'activation') else value
+            layers.append(layer)
+        return cls(layers)
+
+    def save(self, directory):
+        """Write the layer spec and one .npy file per weight array"""
+        os.makedirs(directory, exist_ok=True)
+        spec, arrays = self.to_arrays()
+        for name, array in arrays.items():
+            np.save(os.path.join(directory, f"{name}.npy"), array)
+        with open(os.path.join(directory, 'layers.json'), 'w') as f:
+            json.dump(spec, f, indent=2)
+
+    @classmethod
+    def load(cls, directory, mmap_mode=None):
+        with open(os.path.join(directory, 'layers.json')) as f:
+            spec = json.load(f)
+        arrays = {}
+        for entry in spec:
+            for key, value in entry.items():
+                if key not in ('type', 'activation'):
+                    arrays[value] = np.load(os.path.join(directory, f"{value}.npy"), mmap_mode=mmap_mode)
+        return cls.from_arrays(spec, arrays)
+
+
+# Per-thread float32 buffer quantized kernels are widened into for a matmul
+_kernel_buffers = threading.local()
+
+
+def _float_kernel(kernel):
+    if kernel.dtype in (np.float32, np.float64):
+        return kernel
+    buffer = getattr(_kernel_buffers, 'buffer', None)
+    if buffer is None or buffer.size < kernel.size:
+        buffer = _kernel_buffers.buffer = np.empty(kernel.size, dtype=np.float32)
+    widened = buffer[:kernel.size].reshape(kernel.shape)
+    np.copyto(widened, kernel)
+    return widened
+
+
+def fold_input_scaling(model, mean, scale):
+    """Model computing model.predict((x - mean) / scale) without a scaling step
+
+    The standardization is folded into the first layer's weights and bias.
+    They are computed in float64 and stored in the model's dtype, so the
+    folded layer is no larger than the one it replaces and can be written
+    into an artifact or shared block like any other layer. Returns None
+    when the first layer is not dense or affine.
+    """
+    if not model.layers or model.layers[0]['type'] not in ('dense', 'affine'):
+        return None
+    first = dict(model.layers[0])
+    if first.get('kernel', first.get('multiplier')).dtype not in (np.float32, np.float64):
+        # Folding would turn a quantized kernel back into full precision
+        return None
+    n_features = len(first['kernel'] if first['type'] == 'dense' else first['multiplier'])
+    mean = np.zeros(n_features) if mean is None else np.asarray(mean, dtype=np.float64)
+    scale = np.ones(n_features) if scale is None else np.asarray(scale, dtype=np.float64)
+
+    if first['type'] == 'dense':
+        kernel = np.asarray(first['kernel'], dtype=np.float64)
+        first['kernel'] = (kernel / scale[:, None]).astype(model.dtype)
+        first['bias'] = (np.asarray(first['bias'], dtype=np.float64) - (mean / scale) @ kernel).astype(model.dtype)
+    else:
+        multiplier = np.asarray(first['multiplier'], dtype=np.float64)
+        first['multiplier'] = (multiplier / scale).astype(model.dtype)
+        first['offset'] = (np.asarray(first['offset'], dtype=np.float64) - mean * multiplier / scale).astype(model.dtype)
+    return NumpySequential([first] + model.layers[1:], dtype=model.dtype)
+
+
+QUANTIZATION_MODES = ('float16', 'int8')
+
+
+def quantize_model(model, mode):
+    """Copy of a NumPy model with its dense kernels stored in float16 or int8
+
+    int8 kernels use one symmetric scale per output unit (the column's
+    largest magnitude maps to 127); one scale per layer is too coarse for
+    these kernels and flips decisions. Biases and affine layers stay
+    float32; they are a small share of the weights and set the operating
+    point of each unit. Kernels that are already quantized are kept as
+    they are.
+    """
+    if mode not in QUANTIZATION_MODES:
+        raise ValueError(f"Unknown quantization mode: {mode}")
+    layers = []
+    for layer in model.layers:
+        layer = dict(layer)
+        if layer['type'] == 'dense' and layer['kernel'].dtype in (np.float32, np.float64):
+            kernel = np.asarray(layer['kernel'], dtype=np.float32)
+            if mode == 'float16':
+                layer['kernel'] = kernel.astype(np.float16)
+            else:
+                largest = np.max(np.abs(kernel), axis=0) if kernel.size else np.zeros(kernel.shape[1], np.float32)
+                scale = np.where(largest > 0, largest / 127.0, 1.0).astype(np.float32)
+                layer['kernel'] = np.clip(np.round(kernel / scale), -127, 127).astype(np.int8)
+                layer['kernel_scale'] = scale
+        layers.append(layer)
+    return NumpySequential(layers, dtype=model.dtype)
+
+
+def decision_flip_rate(model, quantized, threshold, n_features, samples=20000, seed=0, mean=None, scale=None):
+    """Share of `confidence >= threshold` decisions the quantized model changes
+
+    Probed on random standardized feature rows, the inputs the models see
+    after the scaler. Models with the scaler folded in (fold_input_scaling)
+    take raw feature rows; pass the folded mean and scale to probe them
+    with the same rows mapped back through the scaling.
+    """
+    probe = np.random.default_rng(seed).normal(size=(samples, n_features))
+    if scale is not None:
+        probe *= scale
+    if mean is not None:
+        probe += mean
+    expected = model.predict(probe)[:, 0] >= threshold
+    actual = quantized.predict(probe)[:, 0] >= threshold
+    return float(np.count_nonzero(expected != actual)) / samples
+
+
+def _activation_name(activation):
+    if isinstance(activation, str):
+        return activation
+    # Serialized activation objects look like {'class_name': ..., 'config': {'name': ...}}
+    if isinstance(activation, dict):
+        return activation.get('config', {}).get('name', activation.get('class_name'))
+    return getattr(activation, '__name__', str(activation))
+
+
+def max_engine_difference(keras_model, numpy_model, n_features, samples=256, seed=0):
+    """Largest absolute output difference between the two engines on random inputs"""
+    rng = np.random.default_rng(seed)
+    probe = rng.normal(0.0, 2.0, size=(samples, n_features)).astype(np.float32)
+    expected = np.asarray(keras_model.predict(probe, verbose=0))
+    actual = numpy_model.predict(probe)
+    return float(np.max(np.abs(expected - actual)))
+
+
+class KerasDirectModel:
+    """Keras model called directly through one traced function
+
+    model.predict builds a data pipeline on every call and traces again for
+    new batch sizes. Calling the model inside a tf.function with a fixed
+    [None, n_features] float32 signature traces once, on the first call,
+    and every batch size reuses that graph.
+    """
+
+    def __init__(self, keras_model, n_features):
+        import tensorflow as tf
+
+        self.keras_model = keras_model
+        self.n_features = n_features
+        self._call = tf.function(
+            lambda x: keras_model(x, training=False),
+            input_signature=[tf.TensorSpec([None, n_features], tf.float32)],
+        )
+
+    def predict(self, x, verbose=0):
+        return self._call(np.asarray(x, dtype=np.float32)).numpy()
+
+
+def build_inference_model(keras_model, engine, n_features, label="model"):
+    """Return the model object the handlers should call for the given engine
+
+    With engine 'numpy' the Keras weights are converted and checked against
+    Keras on random inputs; if the outputs drift beyond
+    NUMPY_ENGINE_TOLERANCE the Keras model is kept instead. Keras models
+    are returned wrapped in KerasDirectModel.
+    """
+    if engine == 'keras':
+        return KerasDirectModel(keras_model, n_features)
+    if engine != 'numpy':
+        raise ValueError(f"Unknown inference engine for {label}: {engine}")
+
+    try:
+        numpy_model = NumpySequential.from_keras(keras_model)
+        difference = max_engine_difference(keras_model, numpy_model, n_features)
+    except Exception as e:
+        print(f"⚠️ NumPy engine unavailable for {label}, using Keras: {e}")
+        return KerasDirectModel(keras_model, n_features)
+
+    if difference > NUMPY_ENGINE_TOLERANCE:
+        print(f"⚠️ NumPy engine for {label} differs from Keras by {difference:.2e}, using Keras")
+        return KerasDirectModel(keras_model, n_features)
+
+    print(f"✅ {label} using NumPy engine (max difference vs Keras {difference:.2e})")
+    return numpy_model
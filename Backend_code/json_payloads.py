@@ -0,0 +1,98 @@
+"""Bounded JSON decoding and fast encoding for small request/response bodies
+
+Bodies are size-checked while they are read and depth-checked with a
+linear scan before the parser sees them, then decoded with orjson when it
+is installed (the standard json module otherwise) and validated into a
+pydantic model. encode_json produces the same compact UTF-8 output as
+FastAPI's JSONResponse.
+"""
+import json
+import re
+
+try:
+    import orjson
+    _loads = orjson.loads
+    _dumps = orjson.dumps
+except ImportError:
+    orjson = None
+    _loads = json.loads
+
+    def _dumps(obj):
+        return json.dumps(obj, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode('utf-8')
+
+from pydantic import ValidationError
+
+
+JSON_DECODER = "orjson" if orjson is not None else "json"
+
+_JSON_STRING = re.compile(rb'"(?:[^"\\]|\\.)*"')
+_JSON_BRACKET = re.compile(rb'[\[\]{}]')
+
+
+class PayloadTooLarge(ValueError):
+    def __init__(self, max_bytes):
+        super().__init__(f"Body exceeds {max_bytes} bytes")
+        self.max_bytes = max_bytes
+
+
+class PayloadTooDeep(ValueError):
+    def __init__(self, max_depth):
+        super().__init__(f"JSON nesting exceeds depth {max_depth}")
+        self.max_depth = max_depth
+
+
+async def read_body(request, max_bytes):
+    """Read a request body, giving up as soon as it grows past max_bytes"""
+    content_length = request.headers.get('content-length')
+    if content_length is not None and content_length.isdigit() and int(content_length) > max_bytes:
+        raise PayloadTooLarge(max_bytes)
+
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > max_bytes:
+            raise PayloadTooLarge(max_bytes)
+    return bytes(body)
+
+
+def json_depth(body):
+    """Deepest array/object nesting in a JSON document, ignoring string contents"""
+    depth = deepest = 0
+    for bracket in _JSON_BRACKET.findall(_JSON_STRING.sub(b'""', body)):
+        if bracket in (b'[', b'{'):
+            depth += 1
+            if depth > deepest:
+                deepest = depth
+        else:
+            depth -= 1
+    return deepest
+
+
+def decode_json(body, max_bytes, max_depth):
+    """Parse a JSON body after checking its size and nesting depth"""
+    if len(body) > max_bytes:
+        raise PayloadTooLarge(max_bytes)
+    # A document cannot nest deeper than its number of opening brackets
+    if body.count(b'{') + body.count(b'[') > max_depth and json_depth(body) > max_depth:
+        raise PayloadTooDeep(max_depth)
+    return _loads(body)
+
+
+def encode_json(obj):
+    """Compact UTF-8 JSON bytes for plain dicts, lists, strings and numbers"""
+    return _dumps(obj)
+
+
+def decode_error_cause(error):
+    """Short cause label for a body that could not be decoded into its model"""
+    if isinstance(error, PayloadTooLarge):
+        return "too_large"
+    if isinstance(error, PayloadTooDeep):
+        return "too_deep"
+    if isinstance(error, UnicodeDecodeError):
+        return "decode"
+    if isinstance(error, ValidationError):
+        return "invalid_fields"
+    if isinstance(error, ValueError):
+        return "malformed_body"
+    return "invalid_value"
@@ -1,18 +1,63 @@
 from fastapi import FastAPI, HTTPException, Request
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
+from pydantic import BaseModel, Field
 import numpy as np
 import re
 import pickle
-import ast
 import json
-from typing import Optional, List
+from typing import Optional, List, Literal, TypedDict
 import uvicorn
 import sys
 import io
+import os
+import itertools
+import asyncio
+import time
+import hmac
+import math
 
-# Just import tensorflow - pickle will find keras modules automatically
-import tensorflow as tf
-from tensorflow import keras
+from batching import MicroBatcher
+from calibration import ThresholdCalibrator
+from device_policy import DevicePolicyIndex, find_policy
+from executor import Overloaded, ScoringExecutor
+from feature_store import FeatureStore
+from json_payloads import PayloadTooLarge, decode_error_cause, decode_json, encode_json, read_body
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsMiddleware, MetricsRegistry
+from inference import (QUANTIZATION_MODES, NumpySequential, build_inference_model, decision_flip_rate,
+                       fold_input_scaling, quantize_model)
+from model_artifacts import ArtifactScaler, file_sha256, find_artifact, load_artifact
+from model_registry import ModelRegistry
+from profiling import SamplingProfiler, SlowRequestLog, SlowRequestMiddleware, collapsed, record_stage
+from rate_limit import VelocityLimiter, create_velocity_store
+from result_cache import ResultCache, body_digest
+from shared_weights import attach_auth_system, publish_auth_system
+
+# TensorFlow thread pools per process (0 keeps TensorFlow's default); the
+# multi-worker launcher sets these so workers do not oversubscribe cores
+TF_INTRA_OP_THREADS = int(os.environ.get('AUTH_TF_INTRA_OP_THREADS', '0'))
+TF_INTER_OP_THREADS = int(os.environ.get('AUTH_TF_INTER_OP_THREADS', '0'))
+
+def import_tensorflow():
+    """Import and configure TensorFlow the first time a pickled model needs it
+
+    Serving exported artifacts never calls this, so the slim profile
+    (requirements-inference.txt) runs without TensorFlow installed.
+    """
+    if 'tensorflow' in sys.modules:
+        return sys.modules['tensorflow']
+    try:
+        import tensorflow as tf
+    except ImportError as e:
+        raise ImportError(
+            "Loading a pickled model needs TensorFlow and scikit-learn (requirements.txt); "
+            "the slim profile only serves exported artifacts, see model_artifacts.py export"
+        ) from e
+    if TF_INTRA_OP_THREADS:
+        tf.config.threading.set_intra_op_parallelism_threads(TF_INTRA_OP_THREADS)
+    if TF_INTER_OP_THREADS:
+        tf.config.threading.set_inter_op_parallelism_threads(TF_INTER_OP_THREADS)
+    return tf
 
 # Custom unpickler to handle Keras compatibility issues
 class KerasCompatUnpickler(pickle.Unpickler):
@@ -45,40 +90,559 @@ def load_pickle_with_keras_compat(filepath):
             return pickle.load(f)
 
 
+def patch_sequential_unpickle():
+    """Monkey patch Sequential to handle old pickle format"""
+    import_tensorflow()
+    from tensorflow.keras.models import Sequential
+    
+    if not hasattr(Sequential, '_unpickle_model'):
+        # Add compatibility method for old pickle files
+        @classmethod
+        def _unpickle_model(cls, *args, **kwargs):
+            # Try to create model from config if available
+            if args and isinstance(args[0], dict):
+                return cls.from_config(args[0])
+            return cls()
+        
+        Sequential._unpickle_model = _unpickle_model
+
+def load_pickled_auth_system(filepath):
+    """Unpickle an authentication system and tag it with a content version"""
+    patch_sequential_unpickle()
+    auth_system = load_pickle_with_keras_compat(filepath)
+    auth_system.setdefault('version', f"pickle-{file_sha256(filepath)[:12]}")
+    return auth_system
+
+
 app = FastAPI(title="Keystroke Authentication API", version="1.0.0")
 
+# Latency and error metrics, served by /metrics
+metrics = MetricsRegistry()
+request_seconds = metrics.histogram(
+    "auth_request_duration_seconds", "Time from request start to the last response byte",
+    ("endpoint", "status")
+)
+stage_seconds = metrics.histogram(
+    "auth_stage_duration_seconds", "Time spent per authentication handler stage",
+    ("endpoint", "model_type", "stage")
+)
+scoring_stage_seconds = metrics.histogram(
+    "auth_scoring_stage_duration_seconds", "Time spent per scoring stage, once per scored batch",
+    ("model_type", "stage")
+)
+bad_requests = metrics.counter(
+    "auth_bad_requests_total", "Requests answered with 400, by cause", ("endpoint", "cause")
+)
+batch_line_errors = metrics.counter(
+    "auth_batch_line_errors_total", "Batch upload lines answered with an error, by cause", ("cause",)
+)
+result_cache_lookups = metrics.counter(
+    "auth_result_cache_lookups_total", "Result cache lookups; hit and replay_denied are duplicate submissions within the TTL",
+    ("endpoint", "result")
+)
+rate_limited_requests = metrics.counter(
+    "auth_rate_limited_total", "Attempts rejected because a velocity limit was exceeded",
+    ("endpoint", "key")
+)
+
+# Fraction of requests to log (0 disables request logging)
+REQUEST_LOG_SAMPLE_RATE = float(os.environ.get('AUTH_REQUEST_LOG_SAMPLE_RATE', '0'))
+
+_endpoint_labels = {}
+
+def endpoint_label(path):
+    """Route path for known endpoints, so unknown URLs cannot grow the label set"""
+    label = _endpoint_labels.get(path)
+    if label is None:
+        routes = {route.path for route in app.routes}
+        label = path if path in routes else "other"
+        if label != "other":
+            _endpoint_labels[path] = label
+    return label
+
+app.add_middleware(MetricsMiddleware, histogram=request_seconds, endpoint_for=endpoint_label,
+                   log_sample_rate=REQUEST_LOG_SAMPLE_RATE)
+
+# Requests at least this slow are kept, newest AUTH_SLOW_REQUEST_ENTRIES, for
+# GET /admin/slow-requests (0 disables the recorder)
+AUTH_SLOW_REQUEST_MS = float(os.environ.get('AUTH_SLOW_REQUEST_MS', '500'))
+AUTH_SLOW_REQUEST_ENTRIES = int(os.environ.get('AUTH_SLOW_REQUEST_ENTRIES', '100'))
+
+slow_requests = SlowRequestLog(AUTH_SLOW_REQUEST_MS / 1000.0, AUTH_SLOW_REQUEST_ENTRIES) if AUTH_SLOW_REQUEST_MS > 0 else None
+if slow_requests is not None:
+    app.add_middleware(SlowRequestMiddleware, log=slow_requests, endpoint_for=endpoint_label)
+
+def observe_stage(endpoint, model_type, stage, seconds):
+    """Record a handler stage in the stage histogram and the request's slow-request entry"""
+    stage_seconds.observe((endpoint, model_type, stage), seconds)
+    record_stage(stage, seconds)
+
 # Global variables to store loaded models
 captcha_auth_system = None
 pin_auth_system = None
 
+# Micro-batching of concurrent predict calls
+BATCH_MAX_SIZE = int(os.environ.get('AUTH_BATCH_MAX_SIZE', '32'))
+BATCH_MAX_WAIT_MS = float(os.environ.get('AUTH_BATCH_MAX_WAIT_MS', '2'))
+
+def score_rows(auth_system, features):
+    """Scale a matrix of feature rows and return one confidence per row"""
+    scaled_features = auth_system['scaler'].transform(features)
+    return auth_system['model'].predict(scaled_features, verbose=0)[:, 0]
+
+# extract_features_batch has a fixed cost per call (padding, masks) that only
+# pays off above about this many samples (see `benchmark.py features`)
+SCALAR_FEATURES_MAX_BATCH = 4
+
+def sample_features(samples):
+    """Feature matrix of a list of samples, from whichever extractor is faster for the count"""
+    if len(samples) <= SCALAR_FEATURES_MAX_BATCH:
+        return np.array([extract_features(sample) for sample in samples], dtype=np.float64)
+    return extract_features_batch(samples)
+
+def score_samples(auth_system, samples):
+    """Extract features for a list of samples and score them in one pass"""
+    return score_rows(auth_system, sample_features(samples))
+
+def score_samples_timed(auth_system, samples):
+    """score_samples that also returns (stage, seconds) pairs for the metrics"""
+    started = time.perf_counter()
+    features = sample_features(samples)
+    extracted = time.perf_counter()
+    scaled_features = auth_system['scaler'].transform(features)
+    scaled = time.perf_counter()
+    scores = auth_system['model'].predict(scaled_features, verbose=0)[:, 0]
+    finished = time.perf_counter()
+    return scores, (('features', extracted - started), ('scale', scaled - extracted), ('inference', finished - scaled))
+
+# Execution backend for scoring: 'thread', 'process' or 'inline' (on the event loop)
+AUTH_EXECUTOR = os.environ.get('AUTH_EXECUTOR', 'thread')
+AUTH_EXECUTOR_WORKERS = int(os.environ.get('AUTH_EXECUTOR_WORKERS', '0')) or None
+AUTH_MAX_IN_FLIGHT = int(os.environ.get('AUTH_MAX_IN_FLIGHT', '1024'))
+AUTH_RETRY_AFTER_SECONDS = int(os.environ.get('AUTH_RETRY_AFTER_SECONDS', '1'))
+
+# Models loaded inside each process-pool worker, by model_type
+_worker_auth_systems = {}
+
+def init_scoring_worker(versions=None):
+    """Process-pool initializer: load the models once per worker
+
+    `versions` pins the artifact version per model so workers started
+    after a hot reload load the same models as the parent.
+    """
+    global _worker_auth_systems
+    if versions is None:
+        _worker_auth_systems = {name: startup_model_source(name) for name in MODEL_SOURCES}
+    else:
+        _worker_auth_systems = {name: load_model_source(name, versions.get(name)) for name in MODEL_SOURCES}
+    for auth_system in _worker_auth_systems.values():
+        warm_auth_system(auth_system)
+
+def score_samples_in_worker(model_type, username, samples):
+    auth_system = None
+    if username is not None and user_model_registry is not None:
+        auth_system = user_model_registry.get(model_type, username)
+    return score_samples_timed(auth_system or _worker_auth_systems[model_type], samples)
+
+scoring_executor = ScoringExecutor(
+    AUTH_EXECUTOR, AUTH_EXECUTOR_WORKERS, AUTH_MAX_IN_FLIGHT, AUTH_RETRY_AFTER_SECONDS,
+    initializer=init_scoring_worker, initargs=(None,)
+)
+
+async def run_scoring(auth_system, samples):
+    """Score samples on the configured execution backend"""
+    model_type = auth_system['model_type']
+    if scoring_executor.mode == 'process':
+        # Workers hold their own copy of the models, only the samples travel
+        scores, timings = await scoring_executor.run(
+            score_samples_in_worker, model_type, auth_system.get('registry_user'), samples
+        )
+    else:
+        scores, timings = await scoring_executor.run(score_samples_timed, auth_system, samples)
+    for stage, seconds in timings:
+        scoring_stage_seconds.observe((model_type, stage), seconds)
+    return scores
+
+def overloaded_exception(error):
+    return HTTPException(
+        status_code=429,
+        detail="Authentication backend is saturated, retry later",
+        headers={"Retry-After": str(error.retry_after)}
+    )
+
+# Inference engine per model: 'numpy' (pure NumPy forward pass) or 'keras'
+CAPTCHA_INFERENCE_ENGINE = os.environ.get('CAPTCHA_INFERENCE_ENGINE', 'numpy')
+PIN_INFERENCE_ENGINE = os.environ.get('PIN_INFERENCE_ENGINE', 'numpy')
+
+# Weight precision of NumPy-engine models: '' (full), 'float16' or 'int8';
+# check the drift first with `python benchmark.py quantize`
+MODEL_QUANTIZATION = {
+    'captcha': os.environ.get('CAPTCHA_QUANTIZATION', ''),
+    'pin': os.environ.get('PIN_QUANTIZATION', ''),
+}
+# A quantization that flips more decisions than this at load falls back to a wider one
+MODEL_QUANTIZATION_MAX_FLIP_RATE = float(os.environ.get('MODEL_QUANTIZATION_MAX_FLIP_RATE', '0.001'))
+
+# Exported artifacts (see model_artifacts.py) are preferred over the pickles
+MODEL_ARTIFACT_DIR = os.environ.get('MODEL_ARTIFACT_DIR', 'models')
+CAPTCHA_MODEL_VERSION = os.environ.get('CAPTCHA_MODEL_VERSION')
+PIN_MODEL_VERSION = os.environ.get('PIN_MODEL_VERSION')
+
+# Per-user models live under USER_MODEL_DIR/<model_type>/<username>/v<N>/;
+# users without one are scored by the shared model
+USER_MODEL_DIR = os.environ.get('USER_MODEL_DIR', os.path.join(MODEL_ARTIFACT_DIR, 'users'))
+USER_MODEL_CACHE_SIZE = int(os.environ.get('USER_MODEL_CACHE_SIZE', '256'))
+USER_MODEL_CACHE_BYTES = int(os.environ.get('USER_MODEL_CACHE_BYTES', str(256 * 1024 * 1024)))
+
+user_model_registry = ModelRegistry(USER_MODEL_DIR, USER_MODEL_CACHE_SIZE, USER_MODEL_CACHE_BYTES) if os.path.isdir(USER_MODEL_DIR) else None
+
+# Cache of results for byte-identical /authenticate/captcha and /pin bodies (0 entries disables it)
+AUTH_RESULT_CACHE_ENTRIES = int(os.environ.get('AUTH_RESULT_CACHE_ENTRIES', '0'))
+AUTH_RESULT_CACHE_BYTES = int(os.environ.get('AUTH_RESULT_CACHE_BYTES', str(16 * 1024 * 1024)))
+AUTH_RESULT_CACHE_TTL_SECONDS = float(os.environ.get('AUTH_RESULT_CACHE_TTL_SECONDS', '300'))
+# Answer a duplicate of an accepted login within the TTL as not authenticated
+AUTH_DENY_DUPLICATE_LOGINS = os.environ.get('AUTH_DENY_DUPLICATE_LOGINS', '0') == '1'
+
+result_cache = ResultCache(AUTH_RESULT_CACHE_ENTRIES, AUTH_RESULT_CACHE_BYTES, AUTH_RESULT_CACHE_TTL_SECONDS)
+
+def prepare_auth_system(auth_system, engine, label):
+    """Swap the unpickled Keras model for the configured inference engine"""
+    auth_system['model'] = build_inference_model(
+        auth_system['model'], engine, auth_system['scaler'].n_features_in_, label=label
+    )
+    return auth_system
+
+# Fold the StandardScaler into the first layer of NumPy-engine models at load time
+AUTH_FUSE_SCALER = os.environ.get('AUTH_FUSE_SCALER', '1') == '1'
+
+def fuse_scaler(auth_system, label="model"):
+    """Fold the scaler into the model so scoring skips the scaling arithmetic
+
+    The scaler is replaced by one that only validates the feature matrix,
+    and the original is kept as `folded_scaler`. Keras-engine models, and
+    models whose first layer cannot absorb the scaling, are left as they
+    are. Artifacts exported folded (the default) skip this, so workers map
+    the folded layer rather than each building their own.
+    """
+    model = auth_system['model']
+    if not isinstance(model, NumpySequential):
+        return auth_system
+    scaler = auth_system['scaler']
+    if not isinstance(scaler, ArtifactScaler):
+        scaler = ArtifactScaler.from_sklearn(scaler)
+    if scaler.mean_ is None and scaler.scale_ is None:
+        return auth_system
+    fused = fold_input_scaling(model, scaler.mean_, scaler.scale_)
+    if fused is None:
+        if not auth_system.get('quantization'):
+            print(f"⚠️ Cannot fold the scaler into the first layer of the {label}, scaling separately")
+        return auth_system
+    auth_system['model'] = fused
+    auth_system['scaler'] = ArtifactScaler(None, None, scaler.n_features_in_)
+    auth_system['folded_scaler'] = scaler
+    return auth_system
+
+def quantize_checked(auth_system, mode, label="model"):
+    """Quantize the model to `mode`, or the widest mode that passes the decision flip gate
+
+    Each candidate, from `mode` back to float16, is compared against full
+    precision with decision_flip_rate; if none stays within
+    MODEL_QUANTIZATION_MAX_FLIP_RATE the model keeps its full precision.
+    """
+    if mode not in QUANTIZATION_MODES:
+        raise ValueError(f"Unknown quantization mode for {label}: {mode}")
+    model = auth_system['model']
+    folded = auth_system.get('folded_scaler')
+    for candidate in reversed(QUANTIZATION_MODES[:QUANTIZATION_MODES.index(mode) + 1]):
+        quantized = quantize_model(model, candidate)
+        flip_rate = decision_flip_rate(model, quantized, auth_system['threshold'], auth_system['scaler'].n_features_in_,
+                                       mean=folded.mean_ if folded else None, scale=folded.scale_ if folded else None)
+        if flip_rate <= MODEL_QUANTIZATION_MAX_FLIP_RATE:
+            auth_system['model'] = quantized
+            auth_system['quantization'] = candidate
+            print(f"✅ {label} weights quantized to {candidate} ({model.nbytes} -> {quantized.nbytes} bytes, "
+                  f"{100 * flip_rate:.3f}% decisions flipped)")
+            return auth_system
+        print(f"⚠️ {candidate} weights flip {100 * flip_rate:.3f}% of {label} decisions "
+              f"(MODEL_QUANTIZATION_MAX_FLIP_RATE {100 * MODEL_QUANTIZATION_MAX_FLIP_RATE:.3f}%), not using them")
+    print(f"⚠️ {label} keeps full-precision weights")
+    return auth_system
+
+def load_auth_system(name, pickle_path, engine, version, label, strict=False):
+    """Load from the newest (or pinned) artifact, falling back to the pickle
+
+    With `strict`, a broken or missing pinned artifact raises instead.
+    """
+    auth_system = None
+    if engine == 'numpy':
+        artifact_dir = find_artifact(MODEL_ARTIFACT_DIR, name, version)
+        if artifact_dir is not None:
+            try:
+                auth_system = load_artifact(artifact_dir)
+                print(f"✅ {label} loaded from artifact {artifact_dir}")
+            except Exception as e:
+                if strict:
+                    raise
+                print(f"⚠️ Could not load artifact {artifact_dir}, falling back to pickle: {e}")
+        elif version is not None:
+            if strict:
+                raise FileNotFoundError(f"Artifact version {version} of {label} not found")
+            print(f"⚠️ Artifact version {version} of {label} not found, falling back to pickle")
+    
+        if auth_system is not None:
+            auth_system['source'] = artifact_dir
+    
+    if auth_system is None:
+        auth_system = prepare_auth_system(load_pickled_auth_system(pickle_path), engine, label)
+        auth_system['source'] = pickle_path
+    auth_system['model_type'] = name
+    quantization = MODEL_QUANTIZATION.get(name)
+    if quantization and isinstance(auth_system['model'], NumpySequential):
+        quantize_checked(auth_system, quantization, label)
+    if AUTH_FUSE_SCALER:
+        fuse_scaler(auth_system, label)
+    return auth_system
+
+# (pickle path, inference engine, pinned artifact version, label) per model
+MODEL_SOURCES = {
+    'captcha': ('keystroke_authentication_system.pkl', CAPTCHA_INFERENCE_ENGINE, CAPTCHA_MODEL_VERSION, "captcha model"),
+    'pin': ('pin_authentication.pkl', PIN_INFERENCE_ENGINE, PIN_MODEL_VERSION, "PIN model"),
+}
+
+def load_model_source(name, version=None, strict=False):
+    """Load one model from its configured source; `version` overrides the pinned one"""
+    pickle_path, engine, pinned_version, label = MODEL_SOURCES[name]
+    return load_auth_system(name, pickle_path, engine, version or pinned_version, label, strict=strict)
+
+# Manifests of models the multi-worker launcher published in shared memory
+SHARED_MODELS = json.loads(os.environ.get('AUTH_SHARED_MODELS') or '{}')
+
+def startup_model_source(name):
+    """The launcher's shared copy of a model when there is one, else load_model_source"""
+    manifest = SHARED_MODELS.get(name)
+    if manifest:
+        auth_system = attach_auth_system(manifest)
+        print(f"✅ {MODEL_LABELS[name][0]} attached to shared weights {manifest['block']}")
+        return auth_system
+    return load_model_source(name)
+
+def load_auth_systems():
+    """Load the captcha and PIN authentication systems"""
+    # Load captcha authentication system
+    print("Loading captcha authentication system...")
+    captcha_system = load_model_source('captcha')
+    print("✅ Captcha authentication system loaded successfully")
+    
+    # Load PIN authentication system
+    print("Loading PIN authentication system...")
+    pin_system = load_model_source('pin')
+    print("✅ PIN authentication system loaded successfully")
+    return captcha_system, pin_system
+
+# Batch sizes run through each model before it serves (empty: powers of two up
+# to AUTH_BATCH_MAX_SIZE, plus the /authenticate/batch chunk size)
+AUTH_WARMUP_BATCH_SIZES = os.environ.get('AUTH_WARMUP_BATCH_SIZES', '')
+
+def warmup_batch_sizes():
+    if AUTH_WARMUP_BATCH_SIZES.strip():
+        return sorted({int(size) for size in AUTH_WARMUP_BATCH_SIZES.split(',') if size.strip()})
+    sizes = {BATCH_MAX_SIZE, BATCH_CHUNK_SIZE}
+    size = 1
+    while size < BATCH_MAX_SIZE:
+        sizes.add(size)
+        size *= 2
+    return sorted(sizes)
+
+def warmup_sample(model_type):
+    """A plausible KeystrokeSample so warm-up runs the real feature path"""
+    sample = {name: 1.0 for name in SAMPLE_FLOAT_FIELDS}
+    sample.update({
+        'username': 'warmup', 'captcha': 'abc123', 'userInput': 'abc123', 'isCorrect': True, 'timestamp': '0',
+        'totalTime': 2400.0, 'wpm': 45.0, 'characterCount': 6.0,
+        'flightTimesArray': [120, 140, 110, 150, 130],
+        'dwellTimesArray': [90, 85, 100, 95, 88, 92],
+        'interKeyPausesArray': [210, 225, 205, 240, 218],
+    })
+    if model_type == 'pin':
+        sample['typingPatternVector'] = [120, 90, 140, 85, 110, 100]
+    return sample
+
+def warm_auth_system(auth_system):
+    """Score every warm-up batch size once and sanity-check the output
+
+    The first call of each shape pays for allocations and, on the Keras
+    engine, tracing the graph; doing it here keeps that off the first
+    requests.
+    """
+    sample = warmup_sample(auth_system['model_type'])
+    for batch_size in warmup_batch_sizes():
+        scores = score_samples(auth_system, [sample] * batch_size)
+        if scores.shape != (batch_size,) or not np.isfinite(scores).all():
+            raise ValueError(f"Warm-up predict for batch size {batch_size} returned {scores!r}")
+
+# One predict per batch may run per executor worker
+captcha_batcher = MicroBatcher(run_scoring, BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS, name="captcha",
+                               max_concurrency=scoring_executor.workers)
+pin_batcher = MicroBatcher(run_scoring, BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS, name="pin",
+                           max_concurrency=scoring_executor.workers)
+
+# Hot reload: POST /admin/reload with X-Admin-Token, or polling of the model files
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+MODEL_WATCH_INTERVAL_SECONDS = float(os.environ.get('MODEL_WATCH_INTERVAL_SECONDS', '0'))
+
+# Load history per model, reported by /health
+model_status = {name: {"reloads": 0, "failed_reloads": 0, "last_error": None} for name in MODEL_SOURCES}
+reload_lock = asyncio.Lock()
+model_watch_task = None
+
+# /health answers 503 until every model and executor worker has been warmed
+service_ready = False
+warmup_status = {"state": "pending", "seconds": None, "batch_sizes": None, "error": None}
+warmup_task = None
+
+def set_auth_system(name, auth_system, load_seconds, warm_seconds):
+    global captcha_auth_system, pin_auth_system
+    # Requests already holding the old system finish on it
+    if name == 'captcha':
+        captcha_auth_system = auth_system
+    else:
+        pin_auth_system = auth_system
+    model_status[name].update({
+        "version": auth_system['version'],
+        "source": auth_system.get('source'),
+        "quantization": auth_system.get('quantization'),
+        "loaded_at": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        "load_seconds": round(load_seconds, 4),
+        "warm_seconds": round(warm_seconds, 4),
+    })
+
+def loaded_model_versions(replacing=None):
+    """Artifact version per model (None for pickles) for process-pool workers
+
+    `replacing` maps a model name to a system about to be swapped in.
+    """
+    versions = {}
+    for name in MODEL_SOURCES:
+        auth_system = (replacing or {}).get(name) or get_auth_system(name) or {}
+        source = auth_system.get('source')
+        versions[name] = os.path.basename(source) if source and os.path.isdir(source) else None
+    return versions
+
+def invalidate_model_caches(model_version):
+    # Cached results are keyed by the shared model's version and can no longer
+    # be looked up once it is replaced. Per-user models are separate artifacts
+    # with their own versions and stay loaded.
+    result_cache.discard_version(model_version)
+
+async def reload_model(name, version=None):
+    """Load, warm and swap in a model without blocking requests
+
+    Loading and warm-up run in a thread; the swap only happens if both
+    succeed, otherwise the current model keeps serving. Returns None on
+    success or the error message.
+    """
+    async with reload_lock:
+        started = time.perf_counter()
+        try:
+            # A broken new artifact must fail the reload, not silently swap in the pickle
+            auth_system = await asyncio.to_thread(load_model_source, name, version, True)
+            loaded = time.perf_counter()
+            await asyncio.to_thread(warm_auth_system, auth_system)
+            if scoring_executor.mode == 'process':
+                # Workers load their own copy; start and warm a new pool on the
+                # new versions before it replaces the current one
+                await scoring_executor.restart(
+                    initargs=(loaded_model_versions({name: auth_system}),),
+                    warm=[(score_samples_in_worker, (model_type, None, [warmup_sample(model_type)]))
+                          for model_type in MODEL_SOURCES],
+                )
+        except Exception as e:
+            model_status[name]["failed_reloads"] += 1
+            model_status[name]["last_error"] = str(e)
+            print(f"❌ Reload of {name} model failed, keeping {model_status[name].get('version')}: {e}")
+            return str(e)
+        
+        replaced = get_auth_system(name)
+        set_auth_system(name, auth_system, loaded - started, time.perf_counter() - loaded)
+        model_status[name]["reloads"] += 1
+        model_status[name]["last_error"] = None
+        if replaced is not None:
+            invalidate_model_caches(replaced['version'])
+        print(f"✅ {name} model reloaded as {auth_system['version']} in {time.perf_counter() - started:.2f}s")
+        return None
+
+def model_source_signature(name):
+    """Changes whenever the artifact or pickle a reload would pick up changes"""
+    pickle_path, _, pinned_version, _ = MODEL_SOURCES[name]
+    try:
+        pickle_mtime = os.stat(pickle_path).st_mtime_ns
+    except OSError:
+        pickle_mtime = None
+    return find_artifact(MODEL_ARTIFACT_DIR, name, pinned_version), pickle_mtime
+
+async def watch_model_files():
+    signatures = {name: model_source_signature(name) for name in MODEL_SOURCES}
+    while True:
+        await asyncio.sleep(MODEL_WATCH_INTERVAL_SECONDS)
+        for name in MODEL_SOURCES:
+            signature = model_source_signature(name)
+            if signature != signatures[name]:
+                signatures[name] = signature
+                print(f"🔄 {name} model files changed, reloading...")
+                await reload_model(name)
+
+async def warm_scoring_executor():
+    """Start every executor worker and push a request through each model
+
+    Process workers load and warm their own copy of the models when they
+    start, which can take seconds; the service reports ready only after
+    that has happened for all of them.
+    """
+    global service_ready
+    started = time.perf_counter()
+    warmup_status.update(state="warming", batch_sizes=warmup_batch_sizes())
+    try:
+        for name in MODEL_SOURCES:
+            auth_system = get_auth_system(name)
+            sample = warmup_sample(name)
+            # One task per worker so the pool spawns all of them now
+            await asyncio.gather(*(run_scoring(auth_system, [sample]) for _ in range(max(1, scoring_executor.workers))))
+    except Exception as e:
+        warmup_status.update(state="failed", error=str(e))
+        print(f"❌ Warm-up failed, service stays not ready: {e}")
+        return
+    
+    warmup_status.update(state="ready", seconds=round(time.perf_counter() - started, 4))
+    service_ready = True
+    print(f"✅ Scoring workers warmed in {warmup_status['seconds']:.2f}s, service ready")
+
 @app.on_event("startup")
 async def load_models():
-    global captcha_auth_system, pin_auth_system
+    global model_watch_task, warmup_task
     
     try:
-        # Monkey patch Sequential to handle old pickle format
-        from tensorflow.keras.models import Sequential
-        
-        if not hasattr(Sequential, '_unpickle_model'):
-            # Add compatibility method for old pickle files
-            @classmethod
-            def _unpickle_model(cls, *args, **kwargs):
-                # Try to create model from config if available
-                if args and isinstance(args[0], dict):
-                    return cls.from_config(args[0])
-                return cls()
-            
-            Sequential._unpickle_model = _unpickle_model
-        
-        # Load captcha authentication system
-        print("Loading captcha authentication system...")
-        captcha_auth_system = load_pickle_with_keras_compat('keystroke_authentication_system.pkl')
-        print("✅ Captcha authentication system loaded successfully")
-        
-        # Load PIN authentication system
-        print("Loading PIN authentication system...")
-        pin_auth_system = load_pickle_with_keras_compat('pin_authentication.pkl')
-        print("✅ PIN authentication system loaded successfully")
+        for name in MODEL_SOURCES:
+            print(f"Loading {name} authentication system...")
+            started = time.perf_counter()
+            auth_system = startup_model_source(name)
+            loaded = time.perf_counter()
+            warm_auth_system(auth_system)
+            set_auth_system(name, auth_system, loaded - started, time.perf_counter() - loaded)
+            print(f"✅ {MODEL_LABELS[name][0]} authentication system loaded successfully")
+        result_cache.clear()
+        scoring_executor.start()
+        if feature_store is not None:
+            feature_store.start()
+        start_calibration()
+        try:
+            policy = load_device_policy()
+            if policy is not None:
+                set_device_policy(policy)
+        except Exception as e:
+            print(f"⚠️ Could not load the device policy, using the default device check: {e}")
+        warmup_task = asyncio.get_running_loop().create_task(warm_scoring_executor())
+        if MODEL_WATCH_INTERVAL_SECONDS > 0 and model_watch_task is None:
+            model_watch_task = asyncio.get_running_loop().create_task(watch_model_files())
         
     except FileNotFoundError as e:
         print(f"❌ Error loading authentication systems: {e}")
@@ -88,6 +652,24 @@ async def load_models():
         print("The pickle files may need to be regenerated with the current Keras version")
         raise e
 
+@app.on_event("shutdown")
+async def stop_batchers():
+    global model_watch_task, warmup_task
+    if warmup_task is not None:
+        warmup_task.cancel()
+        warmup_task = None
+    if model_watch_task is not None:
+        model_watch_task.cancel()
+        model_watch_task = None
+    await captcha_batcher.stop()
+    await pin_batcher.stop()
+    if feature_store is not None:
+        await feature_store.stop()
+    await stop_calibration()
+    if velocity_limiter is not None:
+        await velocity_limiter.store.close()
+    scoring_executor.shutdown()
+
 # Pydantic models for request/response
 class AuthenticationResponse(BaseModel):
     model_config = {'protected_namespaces': ()}
@@ -98,6 +680,12 @@ class AuthenticationResponse(BaseModel):
     user: str
     target_user: str
     model_type: str
+    # Attempts in the rate limit window; only present when AUTH_RATE_LIMIT is on
+    velocity: Optional[dict] = None
+    # Only present on a byte-identical resend within the result cache TTL:
+    # replay is true and duplicate_count says how often the body was seen before
+    replay: Optional[bool] = None
+    duplicate_count: Optional[int] = None
 
 class SecurityCheckResponse(BaseModel):
     authenticated: bool
@@ -129,7 +717,72 @@ class NavigationResponse(BaseModel):
     message: str
     method: str
 
+class SessionVerifyResponse(BaseModel):
+    authenticated: bool
+    message: str
+    checks: dict
+    failed_checks: List[str]
+
+# Typed /security request bodies; strict so e.g. "2" or true never stand in for a choice
+class DeviceState(BaseModel):
+    model_config = {'strict': True}
+    
+    deviceModel: Optional[str] = ''
+    deviceManufacturer: Optional[str] = ''
+    isDeveloperMode: Optional[bool] = False
+    isUSBDebugging: Optional[bool] = False
+    isEmulator: Optional[bool] = False
+    isRooted: Optional[bool] = False
+    buildFingerprint: Optional[str] = ''
+
+class DeviceCheckRequest(BaseModel):
+    model_config = {'strict': True}
+    
+    securityCheck: str = ''
+    version: str = ''
+    # Looks up the user's enrolled devices in the device policy index
+    username: Optional[str] = None
+    state: DeviceState = Field(default_factory=DeviceState)
+
+class TwoFactorRequest(BaseModel):
+    model_config = {'strict': True}
+    
+    twoFactorChoice: int = 0
+
+class EmulatorDetectionRequest(BaseModel):
+    model_config = {'strict': True}
+    
+    emulatorDetectionResult: str = ''
+
+class WifiSafetyRequest(BaseModel):
+    model_config = {'strict': True}
+    
+    wifiSafetyChoice: int = 0
+
+class FirstActionRequest(BaseModel):
+    model_config = {'strict': True}
+    
+    firstAction: str = ''
+    pressed: bool = False
+
+class NavigationMethodRequest(BaseModel):
+    model_config = {'strict': True}
+    
+    navigationMethod: str = ''
+
+class KeystrokeSection(BaseModel):
+    model_config = {'strict': True, 'protected_namespaces': ()}
+    
+    csv: str
+    model_type: Optional[Literal['captcha', 'pin']] = None
+
+# Limits applied to /security bodies before they are parsed
+SECURITY_MAX_BODY_BYTES = int(os.environ.get('SECURITY_MAX_BODY_BYTES', '16384'))
+SECURITY_MAX_JSON_DEPTH = int(os.environ.get('SECURITY_MAX_JSON_DEPTH', '16'))
+
 # Utility functions
+_DIGITS = re.compile(r'\d+')
+
 def parse_array(array_str):
     if isinstance(array_str, str):
         if array_str.startswith('[') and ';' in array_str:
@@ -139,7 +792,7 @@ def parse_array(array_str):
             except:
                 pass
         try:
-            return [int(x) for x in re.findall(r'\d+', array_str)]
+            return [int(x) for x in _DIGITS.findall(array_str)]
         except:
             return []
     return []
@@ -207,411 +860,1201 @@ def extract_features(sample):
     
     return all_features
 
-def parse_csv_line(csv_line):
-    """Parse CSV line handling both captcha and PIN formats"""
-    parts = []
-    current_part = ''
-    in_quotes = False
-    in_brackets = False
-    
-    for char in csv_line:
-        if char == '"':
-            in_quotes = not in_quotes
-        elif char == '[':
-            in_brackets = True
-            current_part += char
-        elif char == ']':
-            in_brackets = False
-            current_part += char
-        elif char == ',' and not in_quotes and not in_brackets:
-            parts.append(current_part.strip('"'))
-            current_part = ''
-        else:
-            current_part += char
-            
-    # Add the last part
-    if current_part:
-        parts.append(current_part.strip('"'))
+# Column layout of extract_features: typing(4), flight(10), dwell(5), touch(4), coords(2)
+FEATURE_COUNT = 25
+
+def _ragged_to_padded(arrays):
+    """Pack ragged lists into a zero-padded float64 matrix plus validity mask"""
+    lengths = np.fromiter((len(a) if a else 0 for a in arrays), dtype=np.intp, count=len(arrays))
+    width = max(int(lengths.max(initial=0)), 1)
+    mask = np.arange(width) < lengths[:, None]
+    padded = np.zeros((len(arrays), width), dtype=np.float64)
+    padded[mask] = np.fromiter(itertools.chain.from_iterable(a for a in arrays if a), dtype=np.float64, count=int(lengths.sum()))
+    return padded, mask, lengths
+
+def _normalized_prefix(padded, mask, mean, count):
+    """First `count` times divided by the row mean, zero where absent or mean <= 0"""
+    prefix = np.zeros((len(padded), count), dtype=np.float64)
+    width = min(count, padded.shape[1])
+    positive = mean > 0
+    prefix[positive, :width] = padded[positive, :width] / mean[positive, None]
+    prefix[:, :width] *= mask[:, :width]
+    return prefix
+
+def extract_features_batch(samples, dtype=np.float64):
+    """Vectorized extract_features for a list of samples, returns an N x 25 matrix
+
+    Ragged flight/dwell arrays are packed into padded arrays with masks.
+    Mean/std/median are reduced over rows grouped by their true length so
+    every value is bit-identical to extract_features (pass dtype=np.float32
+    to get a compact matrix once scores no longer need to match exactly).
+    """
+    n = len(samples)
+    features = np.zeros((n, FEATURE_COUNT), dtype=np.float64)
+    if n == 0:
+        return features.astype(dtype, copy=False)
     
-    return parts
+    scalars = np.array([
+        (s['wpm'], s['totalTime'], s['backspaceCount'], s['keyDwellVariance'],
+         s['avgTouchArea'], s['avgPressure'], s['touchAreaVariance'], s['pressureVariance'],
+         s['avgCoordX'], s['avgCoordY'])
+        for s in samples
+    ], dtype=np.float64)
+    
+    # Typing, touch and coordinate features
+    features[:, 0:4] = scalars[:, 0:4] / (20.0, 10.0, 5.0, 50.0)
+    features[:, 19] = scalars[:, 4] / 600.0
+    features[:, 20] = scalars[:, 5]
+    features[:, 21] = scalars[:, 6] / 200.0
+    features[:, 22] = scalars[:, 7] / 0.2
+    features[:, 23:25] = scalars[:, 8:10] / (300.0, 50.0)
+    
+    # Flight time features (need at least two times)
+    padded, mask, lengths = _ragged_to_padded([s['flightTimesArray'] for s in samples])
+    ft_mean = np.zeros(n)
+    for length in np.unique(lengths[lengths > 1]):
+        rows = lengths == length
+        times = np.ascontiguousarray(padded[rows, :length])
+        transitions = np.diff(times, axis=1)
+        ft_mean[rows] = np.mean(times, axis=1)
+        features[rows, 4] = ft_mean[rows] / 1000.0
+        features[rows, 5] = np.std(times, axis=1) / 1000.0
+        features[rows, 6] = np.median(times, axis=1) / 1000.0
+        features[rows, 7] = np.mean(transitions, axis=1) / 1000.0
+        if length > 2:
+            features[rows, 8] = np.std(transitions, axis=1) / 1000.0
+    has_flight = lengths > 1
+    features[has_flight, 9:14] = _normalized_prefix(padded[has_flight], mask[has_flight], ft_mean[has_flight], 5)
+    
+    # Dwell time features (need at least one time)
+    padded, mask, lengths = _ragged_to_padded([s['dwellTimesArray'] for s in samples])
+    dt_mean = np.zeros(n)
+    for length in np.unique(lengths[lengths > 0]):
+        rows = lengths == length
+        times = np.ascontiguousarray(padded[rows, :length])
+        dt_mean[rows] = np.mean(times, axis=1)
+        features[rows, 14] = dt_mean[rows] / 150.0
+        if length > 1:
+            features[rows, 15] = np.std(times, axis=1) / 50.0
+    has_dwell = lengths > 0
+    features[has_dwell, 16:19] = _normalized_prefix(padded[has_dwell], mask[has_dwell], dt_mean[has_dwell], 3)
+    
+    features[np.isnan(features)] = 0
+    return features.astype(dtype, copy=False)
 
-@app.post("/authenticate/captcha", response_model=AuthenticationResponse)
-async def authenticate_captcha(request: Request):
-    """Authenticate using captcha keystroke dynamics"""
-    if captcha_auth_system is None:
-        raise HTTPException(status_code=500, detail="Captcha authentication system not loaded")
+class KeystrokeSample(TypedDict, total=False):
+    """Typed record built from one captcha or PIN CSV payload"""
+    username: str
+    captcha: str
+    userInput: str
+    isCorrect: bool
+    timestamp: str
+    totalTime: float
+    wpm: float
+    backspaceCount: float
+    avgFlightTime: float
+    avgDwellTime: float
+    avgInterKeyPause: float
+    sessionEntropy: float
+    keyDwellVariance: float
+    interKeyVariance: float
+    pressureVariance: float
+    touchAreaVariance: float
+    avgTouchArea: float
+    avgPressure: float
+    avgCoordX: float
+    avgCoordY: float
+    avgErrorRecoveryTime: float
+    characterCount: float
+    flightTimesArray: List[int]
+    dwellTimesArray: List[int]
+    interKeyPausesArray: List[int]
+    typingPatternVector: List[int]
+
+# CSV columns 5-21 hold floats, 22-24 (and 25 for PIN) hold arrays
+SAMPLE_FLOAT_FIELDS = (
+    'totalTime', 'wpm', 'backspaceCount', 'avgFlightTime', 'avgDwellTime',
+    'avgInterKeyPause', 'sessionEntropy', 'keyDwellVariance', 'interKeyVariance',
+    'pressureVariance', 'touchAreaVariance', 'avgTouchArea', 'avgPressure',
+    'avgCoordX', 'avgCoordY', 'avgErrorRecoveryTime', 'characterCount'
+)
+SAMPLE_ARRAY_FIELDS = ('flightTimesArray', 'dwellTimesArray', 'interKeyPausesArray')
+
+# Captcha payloads may quote fields (quotes are dropped), PIN payloads may
+# bracket them (brackets are kept); a comma only splits outside of those
+_QUOTED_FIELD = re.compile(r'(?:[^",]+|"[^"]*"?)*')
+_BRACKETED_FIELD = re.compile(r'(?:[^\[,]+|\[[^\]]*\]?)*')
+_COMMA_IN_BRACKETS = re.compile(r'\[[^\]]*,')
+
+def split_fields(csv_line, quotes=True, brackets=False):
+    """Split one payload line into fields in a single pass
+
+    quotes=True applies the captcha rule (double quotes protect commas and
+    are removed), brackets=True the PIN rule ('[' up to the next ']'
+    protects commas). A trailing empty field is dropped, as in the
+    original character loops.
+    """
+    if quotes:
+        protected = '"' in csv_line
+    else:
+        protected = brackets and '[' in csv_line and _COMMA_IN_BRACKETS.search(csv_line) is not None
     
-    try:
-        # Get raw body as text
-        csv_data = (await request.body()).decode('utf-8')
-        
-        # Use the same parsing logic from captchaModel.py
+    if not protected:
+        parts = csv_line.split(',')
+    else:
+        match_field = (_QUOTED_FIELD if quotes else _BRACKETED_FIELD).match
         parts = []
-        current_part = ''
-        in_quotes = False
-        
-        for char in csv_data:
-            if char == '"':
-                in_quotes = not in_quotes
-            elif char == ',' and not in_quotes:
-                parts.append(current_part.strip('"'))
-                current_part = ''
+        position = 0
+        end = len(csv_line)
+        while True:
+            field_end = match_field(csv_line, position).end()
+            parts.append(csv_line[position:field_end])
+            if field_end >= end:
+                break
+            position = field_end + 1
+        if quotes:
+            parts = [part.replace('"', '') for part in parts]
+    
+    if parts and parts[-1] == '':
+        parts.pop()
+    return parts
+
+def build_sample(parts, model_type):
+    """Convert split payload fields into a typed KeystrokeSample"""
+    sample = {
+        'username': parts[0],
+        'captcha': parts[1],
+        'userInput': parts[2],
+        'isCorrect': parts[3].lower() == 'true',
+        'timestamp': parts[4]
+    }
+    for index, name in enumerate(SAMPLE_FLOAT_FIELDS, start=5):
+        sample[name] = float(parts[index])
+    for index, name in enumerate(SAMPLE_ARRAY_FIELDS, start=22):
+        sample[name] = parse_array(parts[index])
+    if model_type == 'pin':
+        sample['typingPatternVector'] = parse_array(parts[25]) if len(parts) > 25 else []
+    return sample
+
+def split_payload(csv_data, model_type):
+    """Split a payload with the rules of its format"""
+    if model_type == 'captcha':
+        return split_fields(csv_data, quotes=True, brackets=False)
+    return split_fields(csv_data, quotes=False, brackets=True)
+
+def detect_payload(csv_data):
+    """Pick the model for a payload and return (model_type, fields)
+
+    Uses the PIN splitting rule to count fields (more than 25 means PIN
+    data). Both rules give the same fields unless the body contains quotes
+    or a comma inside brackets, so only then is it split a second time.
+    """
+    parts = split_payload(csv_data, 'pin')
+    if len(parts) > 25:
+        return 'pin', parts
+    if '"' in csv_data or _COMMA_IN_BRACKETS.search(csv_data):
+        parts = split_payload(csv_data, 'captcha')
+    return 'captcha', parts
+
+# Return handler results as pre-encoded JSON instead of having FastAPI validate
+# and serialize them a second time through response_model
+AUTH_FAST_RESPONSES = os.environ.get('AUTH_FAST_RESPONSES', '1') == '1'
+
+class EncodedJSONResponse(Response):
+    media_type = "application/json"
+
+def respond(response_model, fields, headers=None):
+    """Handler result for a dict of response fields given in the model's field order
+
+    With AUTH_FAST_RESPONSES (or when extra headers must be sent) the dict
+    is encoded directly; otherwise it is returned as the model, as before.
+    The routes keep their response_model either way, so the OpenAPI schema
+    does not change.
+    """
+    if AUTH_FAST_RESPONSES or headers:
+        return EncodedJSONResponse(encode_json(fields), headers=headers)
+    return response_model(**fields)
+
+# Write-behind store of scored sessions for retraining (unset FEATURE_STORE_DIR disables it)
+FEATURE_STORE_DIR = os.environ.get('FEATURE_STORE_DIR')
+FEATURE_STORE_SEGMENT_ROWS = int(os.environ.get('FEATURE_STORE_SEGMENT_ROWS', '4096'))
+FEATURE_STORE_SEGMENT_BYTES = int(os.environ.get('FEATURE_STORE_SEGMENT_BYTES', str(8 * 1024 * 1024)))
+FEATURE_STORE_SEGMENT_SECONDS = float(os.environ.get('FEATURE_STORE_SEGMENT_SECONDS', '60'))
+FEATURE_STORE_MAX_PENDING = int(os.environ.get('FEATURE_STORE_MAX_PENDING', '65536'))
+
+feature_store = FeatureStore(
+    FEATURE_STORE_DIR, extract_features_batch, SAMPLE_FLOAT_FIELDS, FEATURE_STORE_SEGMENT_ROWS,
+    FEATURE_STORE_SEGMENT_BYTES, FEATURE_STORE_SEGMENT_SECONDS, FEATURE_STORE_MAX_PENDING
+) if FEATURE_STORE_DIR else None
+
+# Adaptive per-user thresholds: 'off', 'shadow' (tracked and reported only) or 'enforce'
+AUTH_CALIBRATION = os.environ.get('AUTH_CALIBRATION', 'off')
+AUTH_CALIBRATION_FILE = os.environ.get('AUTH_CALIBRATION_FILE')
+AUTH_CALIBRATION_SAVE_SECONDS = float(os.environ.get('AUTH_CALIBRATION_SAVE_SECONDS', '60'))
+AUTH_CALIBRATION_MAX_USERS = int(os.environ.get('AUTH_CALIBRATION_MAX_USERS', '100000'))
+AUTH_CALIBRATION_QUANTILE = float(os.environ.get('AUTH_CALIBRATION_QUANTILE', '0.05'))
+AUTH_CALIBRATION_DECAY = float(os.environ.get('AUTH_CALIBRATION_DECAY', '0.05'))
+AUTH_CALIBRATION_MIN_SAMPLES = int(os.environ.get('AUTH_CALIBRATION_MIN_SAMPLES', '20'))
+AUTH_CALIBRATION_MAX_ADJUST = float(os.environ.get('AUTH_CALIBRATION_MAX_ADJUST', '0.1'))
+# No calibrated threshold goes below this (or below the model's own, if lower)
+AUTH_CALIBRATION_FLOOR = float(os.environ.get('AUTH_CALIBRATION_FLOOR', '0.5'))
+AUTH_CALIBRATION_NEAR_MISS_SIGMAS = float(os.environ.get('AUTH_CALIBRATION_NEAR_MISS_SIGMAS', '3'))
+
+if AUTH_CALIBRATION not in ('off', 'shadow', 'enforce'):
+    raise ValueError(f"AUTH_CALIBRATION must be off, shadow or enforce, not {AUTH_CALIBRATION!r}")
+
+calibrator = ThresholdCalibrator(
+    AUTH_CALIBRATION_MAX_USERS, threshold_quantile=AUTH_CALIBRATION_QUANTILE, decay=AUTH_CALIBRATION_DECAY,
+    min_samples=AUTH_CALIBRATION_MIN_SAMPLES, max_adjust=AUTH_CALIBRATION_MAX_ADJUST,
+    floor=AUTH_CALIBRATION_FLOOR, near_miss_sigmas=AUTH_CALIBRATION_NEAR_MISS_SIGMAS
+) if AUTH_CALIBRATION != 'off' else None
+calibration_task = None
+
+def decision_threshold(auth_system, username):
+    """Threshold the confidence is compared against for this user"""
+    if AUTH_CALIBRATION == 'enforce':
+        return calibrator.threshold(auth_system['model_type'], username, auth_system['threshold'])
+    return auth_system['threshold']
+
+def record_scored_sample(auth_system, sample, confidence, authenticated, calibrate=False):
+    """Keep a scored sample for the feature store and, for calibrate, the user's score statistics
+
+    Only single login attempts are calibrated on, and of those only the
+    ones the model accepts or nearly accepts (see calibration.py); batch
+    and session-verify scoring never are.
+    """
+    if feature_store is not None:
+        feature_store.append(auth_system['model_type'], sample, confidence, authenticated, auth_system['version'])
+    if calibrator is not None and calibrate:
+        calibrator.record(auth_system['model_type'], sample['username'], confidence, auth_system['threshold'])
+
+async def run_calibration():
+    """Fold queued scores into the calibration statistics and save them periodically"""
+    saved_at = time.monotonic()
+    while True:
+        await asyncio.sleep(0.25)
+        calibrator.drain()
+        if AUTH_CALIBRATION_FILE and calibrator.dirty and time.monotonic() - saved_at >= AUTH_CALIBRATION_SAVE_SECONDS:
+            saved_at = time.monotonic()
+            save = asyncio.ensure_future(asyncio.to_thread(calibrator.save, AUTH_CALIBRATION_FILE, calibrator.snapshot()))
+            try:
+                await asyncio.shield(save)
+            except asyncio.CancelledError:
+                # Let the write finish before stop_calibration saves again
+                await asyncio.wait([save])
+                if not save.cancelled() and save.exception() is not None:
+                    print(f"⚠️ Could not save calibration statistics to {AUTH_CALIBRATION_FILE}: {save.exception()}")
+                raise
+            except Exception as e:
+                print(f"⚠️ Could not save calibration statistics to {AUTH_CALIBRATION_FILE}: {e}")
+
+def start_calibration():
+    global calibration_task
+    if calibrator is None or calibration_task is not None:
+        return
+    if AUTH_CALIBRATION_FILE and os.path.exists(AUTH_CALIBRATION_FILE):
+        try:
+            print(f"✅ Calibration statistics for {calibrator.load(AUTH_CALIBRATION_FILE)} users loaded from {AUTH_CALIBRATION_FILE}")
+        except Exception as e:
+            print(f"⚠️ Could not load calibration statistics from {AUTH_CALIBRATION_FILE}, starting empty: {e}")
+    calibration_task = asyncio.get_running_loop().create_task(run_calibration())
+
+async def stop_calibration():
+    global calibration_task
+    if calibration_task is None:
+        return
+    task, calibration_task = calibration_task, None
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    calibrator.drain()
+    if AUTH_CALIBRATION_FILE and calibrator.dirty:
+        await asyncio.to_thread(calibrator.save, AUTH_CALIBRATION_FILE)
+
+# Per-user enrolled devices and deny-list for /security/device-check (see device_policy.py)
+DEVICE_POLICY_DIR = os.environ.get('DEVICE_POLICY_DIR', 'device_policy')
+device_policy = None
+
+def load_device_policy():
+    """Newest device policy index under DEVICE_POLICY_DIR, or None when there is none"""
+    directory = find_policy(DEVICE_POLICY_DIR)
+    if directory is None:
+        return None
+    return DevicePolicyIndex.load(directory)
+
+# Sliding-window attempt limits per username and device: 'off', 'shadow'
+# (counted and returned as velocity only) or 'enforce' (over the limit is a 429)
+AUTH_RATE_LIMIT = os.environ.get('AUTH_RATE_LIMIT', 'off')
+AUTH_RATE_LIMIT_PER_USER = int(os.environ.get('AUTH_RATE_LIMIT_PER_USER', '10'))
+AUTH_RATE_LIMIT_PER_DEVICE = int(os.environ.get('AUTH_RATE_LIMIT_PER_DEVICE', '30'))
+AUTH_RATE_LIMIT_WINDOW_SECONDS = float(os.environ.get('AUTH_RATE_LIMIT_WINDOW_SECONDS', '60'))
+AUTH_RATE_LIMIT_BUCKETS = int(os.environ.get('AUTH_RATE_LIMIT_BUCKETS', '12'))
+AUTH_RATE_LIMIT_MAX_KEYS = int(os.environ.get('AUTH_RATE_LIMIT_MAX_KEYS', '100000'))
+# 'local' counts per worker; a redis:// URL shares the counts between workers and hosts
+AUTH_RATE_LIMIT_BACKEND = os.environ.get('AUTH_RATE_LIMIT_BACKEND', 'local')
+# /authenticate/batch rows count in their own windows, so a replay upload
+# does not use up the live login attempts of the users in it
+AUTH_RATE_LIMIT_BATCH_PER_USER = int(os.environ.get('AUTH_RATE_LIMIT_BATCH_PER_USER', '100'))
+AUTH_RATE_LIMIT_BATCH_PER_DEVICE = int(os.environ.get('AUTH_RATE_LIMIT_BATCH_PER_DEVICE', '0'))
+
+if AUTH_RATE_LIMIT not in ('off', 'shadow', 'enforce'):
+    raise ValueError(f"AUTH_RATE_LIMIT must be off, shadow or enforce, not {AUTH_RATE_LIMIT!r}")
+
+velocity_limiter = VelocityLimiter(
+    create_velocity_store(AUTH_RATE_LIMIT_BACKEND, AUTH_RATE_LIMIT_WINDOW_SECONDS, AUTH_RATE_LIMIT_BUCKETS,
+                          AUTH_RATE_LIMIT_MAX_KEYS),
+    AUTH_RATE_LIMIT_PER_USER, AUTH_RATE_LIMIT_PER_DEVICE
+) if AUTH_RATE_LIMIT != 'off' else None
+batch_velocity_limiter = VelocityLimiter(
+    velocity_limiter.store, AUTH_RATE_LIMIT_BATCH_PER_USER, AUTH_RATE_LIMIT_BATCH_PER_DEVICE, prefix='batch:'
+) if velocity_limiter is not None else None
+
+# Only the start of the body is looked at to find the username
+PAYLOAD_USERNAME_MAX_BYTES = 256
+
+def payload_username(body):
+    """The first CSV field of a payload, found without parsing the rest"""
+    head = body[:PAYLOAD_USERNAME_MAX_BYTES]
+    end = head.find(b',')
+    return (head if end < 0 else head[:end]).decode('utf-8', 'replace').strip().strip('"')
+
+def rate_limit_message(limited):
+    return f"Too many authentication attempts for this {limited}, retry later"
+
+def rate_limited_exception(limited):
+    return HTTPException(status_code=429, detail=rate_limit_message(limited),
+                         headers={"Retry-After": str(velocity_limiter.retry_after)})
+
+async def check_velocities(usernames, device, endpoint, limiter=None):
+    """[(velocity fields, the kind of key to reject the attempt for or None)] per username
+
+    Every attempt is counted; one is only rejected in enforce mode.
+    """
+    verdicts = await (limiter or velocity_limiter).check_many(usernames, device)
+    for index, (velocity, limited) in enumerate(verdicts):
+        if limited is not None:
+            if AUTH_RATE_LIMIT != 'enforce':
+                verdicts[index] = (velocity, None)
             else:
-                current_part += char
-                
-        # Add the last part
-        if current_part:
-            parts.append(current_part.strip('"'))
-        
-        # Create sample for captcha authentication
-        sample = {
-            'username': parts[0],
-            'captcha': parts[1],
-            'userInput': parts[2],
-            'isCorrect': parts[3].lower() == 'true',
-            'timestamp': parts[4],
-            'totalTime': float(parts[5]),
-            'wpm': float(parts[6]),
-            'backspaceCount': float(parts[7]),
-            'avgFlightTime': float(parts[8]),
-            'avgDwellTime': float(parts[9]),
-            'avgInterKeyPause': float(parts[10]),
-            'sessionEntropy': float(parts[11]),
-            'keyDwellVariance': float(parts[12]),
-            'interKeyVariance': float(parts[13]),
-            'pressureVariance': float(parts[14]),
-            'touchAreaVariance': float(parts[15]),
-            'avgTouchArea': float(parts[16]),
-            'avgPressure': float(parts[17]),
-            'avgCoordX': float(parts[18]),
-            'avgCoordY': float(parts[19]),
-            'avgErrorRecoveryTime': float(parts[20]),
-            'characterCount': float(parts[21]),
-            'flightTimesArray': parse_array(parts[22]),
-            'dwellTimesArray': parse_array(parts[23]),
-            'interKeyPausesArray': parse_array(parts[24])
-        }
-        
-        model = captcha_auth_system['model']
-        scaler = captcha_auth_system['scaler']
-        threshold = captcha_auth_system['threshold']
-        target_user = captcha_auth_system['target_user']
+                rate_limited_requests.inc(endpoint, limited)
+    return verdicts
+
+async def check_velocity(request, body, endpoint):
+    """Count the attempt and return the velocity fields, or None when rate limiting is off
+
+    Runs before the body is parsed or scored. In enforce mode an attempt
+    over the user's or the device's limit is answered with 429.
+    """
+    if velocity_limiter is None:
+        return None
+    device = request.headers.get('x-device-fingerprint')
+    [(velocity, limited)] = await check_velocities([payload_username(body)], device, endpoint)
+    if limited is not None:
+        raise rate_limited_exception(limited)
+    return velocity
+
+# Labels used in the handlers' error messages
+MODEL_LABELS = {'captcha': ('Captcha', 'captcha'), 'pin': ('PIN', 'PIN')}
+
+def get_auth_system(model_type):
+    return captcha_auth_system if model_type == 'captcha' else pin_auth_system
+
+async def resolve_auth_system(model_type, username):
+    """The user's own model when one is enrolled, otherwise the shared one"""
+    if user_model_registry is not None:
+        auth_system = await user_model_registry.get_async(model_type, username)
+        if auth_system is not None:
+            return auth_system
+    return get_auth_system(model_type)
+
+def parse_error_cause(error):
+    """Short cause label for a payload that could not be turned into a sample"""
+    if isinstance(error, UnicodeDecodeError):
+        return "decode"
+    if isinstance(error, IndexError):
+        return "missing_fields"
+    return "invalid_value"
+
+def bad_request(endpoint, cause, label, error):
+    bad_requests.inc(endpoint, cause)
+    return HTTPException(status_code=400, detail=f"Error processing {label} authentication: {str(error)}")
+
+async def score_parts(parts, model_type, endpoint, calibrate=True):
+    """Score already split payload fields, returning the AuthenticationResponse fields"""
+    title, label = MODEL_LABELS[model_type]
+    if get_auth_system(model_type) is None:
+        raise HTTPException(status_code=500, detail=f"{title} authentication system not loaded")
+    
+    started = time.perf_counter()
+    try:
+        sample = build_sample(parts, model_type)
+    except Exception as e:
+        raise bad_request(endpoint, parse_error_cause(e), label, e)
+    parsed = time.perf_counter()
+    observe_stage(endpoint, model_type, "build_sample", parsed - started)
+    
+    try:
+        auth_system = await resolve_auth_system(model_type, sample['username'])
+        threshold = decision_threshold(auth_system, sample['username'])
+        target_user = auth_system['target_user']
         
-        # Extract and scale features
-        features = np.array([extract_features(sample)])
-        scaled_features = scaler.transform(features)
+        # Score together with concurrent requests, off the event loop
+        batcher = captcha_batcher if model_type == 'captcha' else pin_batcher
+        confidence = await batcher.submit(auth_system, sample)
+        is_authenticated = bool(confidence >= threshold)
+    except Exception as e:
+        raise bad_request(endpoint, "scoring", label, e)
+    record_scored_sample(auth_system, sample, confidence, is_authenticated, calibrate)
+    observe_stage(endpoint, model_type, "score", time.perf_counter() - parsed)
+    
+    return {
+        "authenticated": is_authenticated,
+        "confidence": float(confidence),
+        "threshold": float(threshold),
+        "user": sample['username'],
+        "target_user": target_user,
+        "model_type": model_type
+    }
+
+def authentication_response(result, endpoint, headers=None, velocity=None, duplicate_count=None):
+    started = time.perf_counter()
+    if velocity is not None:
+        result = dict(result, velocity=velocity)
+    if duplicate_count is not None:
+        result = dict(result, replay=True, duplicate_count=duplicate_count)
+    response = respond(AuthenticationResponse, result, headers)
+    observe_stage(endpoint, result['model_type'], "response", time.perf_counter() - started)
+    return response
+
+async def authenticate_parts(parts, model_type, endpoint, velocity=None):
+    """Score already split payload fields with the model for model_type"""
+    return authentication_response(await score_parts(parts, model_type, endpoint), endpoint, velocity=velocity)
+
+async def cached_authentication(cache_key, model_type, endpoint, velocity=None):
+    """Response for a body already scored within the cache window, or None
+
+    Hits are exact duplicates of an earlier submission, so the response
+    is flagged with replay and duplicate_count (and X-Duplicate-Submission)
+    and keeps the cached score. With AUTH_DENY_DUPLICATE_LOGINS a
+    duplicate of an accepted login is answered as not authenticated.
+    """
+    cached = result_cache.get(cache_key)
+    if cached is None:
+        result_cache_lookups.inc(endpoint, "miss")
+        return None
+    result, model_version, seen = cached
+    # The cached score came from the user's own model, which may have changed since
+    if (await resolve_auth_system(model_type, result['user']))['version'] != model_version:
+        result_cache.discard(cache_key)
+        result_cache_lookups.inc(endpoint, "stale")
+        return None
+    if AUTH_DENY_DUPLICATE_LOGINS and result['authenticated']:
+        result = dict(result, authenticated=False)
+        result_cache_lookups.inc(endpoint, "replay_denied")
+    else:
+        result_cache_lookups.inc(endpoint, "hit")
+    return authentication_response(result, endpoint, headers={"X-Duplicate-Submission": str(seen)}, velocity=velocity,
+                                   duplicate_count=seen)
+
+async def authenticate_body(request, model_type, endpoint):
+    if get_auth_system(model_type) is None:
+        title, _ = MODEL_LABELS[model_type]
+        raise HTTPException(status_code=500, detail=f"{title} authentication system not loaded")
+    
+    # Shed load before reading the body when the scoring backend is saturated
+    try:
+        scoring_executor.acquire()
+    except Overloaded as e:
+        raise overloaded_exception(e)
+    
+    try:
+        started = time.perf_counter()
+        body = await request.body()
+        velocity = await check_velocity(request, body, endpoint)
         
-        # Get prediction
-        confidence = model.predict(scaled_features, verbose=0)[0][0]
-        is_authenticated = confidence >= threshold
+        cache_key = None
+        if result_cache.enabled:
+            cache_key = (endpoint, body_digest(body), get_auth_system(model_type)['version'])
+            response = await cached_authentication(cache_key, model_type, endpoint, velocity)
+            if response is not None:
+                return response
         
-        return AuthenticationResponse(
-            authenticated=is_authenticated,
-            confidence=float(confidence),
-            threshold=float(threshold),
-            user=sample['username'],
-            target_user=target_user,
-            model_type="captcha"
-        )
+        try:
+            # Get raw body as text
+            csv_data = body.decode('utf-8')
+            decoded = time.perf_counter()
+            parts = split_payload(csv_data, model_type)
+        except Exception as e:
+            _, label = MODEL_LABELS[model_type]
+            raise bad_request(endpoint, parse_error_cause(e), label, e)
+        observe_stage(endpoint, model_type, "decode", decoded - started)
+        observe_stage(endpoint, model_type, "split", time.perf_counter() - decoded)
         
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error processing captcha authentication: {str(e)}")
+        result = await score_parts(parts, model_type, endpoint)
+        if cache_key is not None:
+            auth_system = await resolve_auth_system(model_type, result['user'])
+            result_cache.put(cache_key, result, auth_system['version'], len(encode_json(result)))
+        return authentication_response(result, endpoint, velocity=velocity)
+    finally:
+        scoring_executor.release()
+
+@app.post("/authenticate/captcha", response_model=AuthenticationResponse, response_model_exclude_none=True)
+async def authenticate_captcha(request: Request):
+    """Authenticate using captcha keystroke dynamics"""
+    return await authenticate_body(request, 'captcha', '/authenticate/captcha')
 
-@app.post("/authenticate/pin", response_model=AuthenticationResponse)
+@app.post("/authenticate/pin", response_model=AuthenticationResponse, response_model_exclude_none=True)
 async def authenticate_pin(request: Request):
     """Authenticate using PIN keystroke dynamics"""
-    if pin_auth_system is None:
-        raise HTTPException(status_code=500, detail="PIN authentication system not loaded")
-    
+    return await authenticate_body(request, 'pin', '/authenticate/pin')
+
+@app.post("/authenticate/auto", response_model=AuthenticationResponse, response_model_exclude_none=True)
+async def authenticate_auto(request: Request):
+    """Auto-detect and authenticate using the appropriate model based on data format"""
+    endpoint = '/authenticate/auto'
+    started = time.perf_counter()
+    body = await request.body()
+    velocity = await check_velocity(request, body, endpoint)
     try:
         # Get raw body as text
-        csv_data = (await request.body()).decode('utf-8')
-        
-        # Use the same parsing logic from pinModel.py
-        parts = []
-        current_part = ''
-        in_brackets = False
+        csv_data = body.decode('utf-8')
+        decoded = time.perf_counter()
         
-        for char in csv_data:
-            if char == '[':
-                in_brackets = True
-                current_part += char
-            elif char == ']':
-                in_brackets = False
-                current_part += char
-            elif char == ',' and not in_brackets:
-                parts.append(current_part)
-                current_part = ''
+        # Simple heuristic: if there are more than 25 parts, it's likely PIN data
+        model_type, parts = detect_payload(csv_data)
+    except Exception as e:
+        raise bad_request(endpoint, parse_error_cause(e), "keystroke", e)
+    observe_stage(endpoint, model_type, "decode", decoded - started)
+    observe_stage(endpoint, model_type, "split", time.perf_counter() - decoded)
+    
+    try:
+        scoring_executor.acquire()
+    except Overloaded as e:
+        raise overloaded_exception(e)
+    try:
+        return await authenticate_parts(parts, model_type, endpoint, velocity)
+    finally:
+        scoring_executor.release()
+
+# Bulk scoring: rows are scored in chunks and streamed back as NDJSON
+BATCH_CHUNK_SIZE = int(os.environ.get('AUTH_BATCH_CHUNK_SIZE', '512'))
+BATCH_MAX_LINE_BYTES = int(os.environ.get('AUTH_BATCH_MAX_LINE_BYTES', '65536'))
+
+class BodyStreamingResponse(StreamingResponse):
+    """StreamingResponse whose generator may keep reading the request body
+
+    The stock response listens on `receive` for a disconnect while
+    streaming, which would swallow the body chunks the generator is still
+    reading. A disconnect surfaces as ClientDisconnect from request.stream().
+    The background task runs however streaming ends, so it can release
+    what the handler acquired.
+    """
+    async def __call__(self, scope, receive, send):
+        try:
+            await self.stream_response(send)
+        finally:
+            if self.background is not None:
+                await self.background()
+
+async def iter_body_lines(request):
+    """Yield (line_number, bytes) for each body line without buffering the body
+
+    Lines longer than BATCH_MAX_LINE_BYTES are yielded as None.
+    """
+    pending = bytearray()
+    line_number = 0
+    overflow = False
+    
+    async for chunk in request.stream():
+        pending += chunk
+        lines = pending.split(b'\n')
+        pending = bytearray(lines.pop())
+        for line in lines:
+            line_number += 1
+            if overflow:
+                overflow = False
+                yield line_number, None
             else:
-                current_part += char
-                
-        # Add the last part
-        if current_part:
-            parts.append(current_part)
-        
-        # Create sample for PIN authentication
-        sample = {
-            'username': parts[0],
-            'captcha': parts[1],
-            'userInput': parts[2],
-            'isCorrect': parts[3].lower() == 'true',
-            'timestamp': parts[4],
-            'totalTime': float(parts[5]),
-            'wpm': float(parts[6]),
-            'backspaceCount': float(parts[7]),
-            'avgFlightTime': float(parts[8]),
-            'avgDwellTime': float(parts[9]),
-            'avgInterKeyPause': float(parts[10]),
-            'sessionEntropy': float(parts[11]),
-            'keyDwellVariance': float(parts[12]),
-            'interKeyVariance': float(parts[13]),
-            'pressureVariance': float(parts[14]),
-            'touchAreaVariance': float(parts[15]),
-            'avgTouchArea': float(parts[16]),
-            'avgPressure': float(parts[17]),
-            'avgCoordX': float(parts[18]),
-            'avgCoordY': float(parts[19]),
-            'avgErrorRecoveryTime': float(parts[20]),
-            'characterCount': float(parts[21]),
-            'flightTimesArray': parse_array(parts[22]),
-            'dwellTimesArray': parse_array(parts[23]),
-            'interKeyPausesArray': parse_array(parts[24]),
-            'typingPatternVector': parse_array(parts[25]) if len(parts) > 25 else []
-        }
-        
-        model = pin_auth_system['model']
-        scaler = pin_auth_system['scaler']
-        threshold = pin_auth_system['threshold']
-        target_user = pin_auth_system['target_user']
-        
-        # Extract and scale features
-        features = np.array([extract_features(sample)])
-        scaled_features = scaler.transform(features)
-        
-        # Get prediction
-        confidence = model.predict(scaled_features, verbose=0)[0][0]
-        is_authenticated = confidence >= threshold
-        
-        return AuthenticationResponse(
-            authenticated=is_authenticated,
-            confidence=float(confidence),
-            threshold=float(threshold),
-            user=sample['username'],
-            target_user=target_user,
-            model_type="pin"
-        )
+                yield line_number, bytes(line) if len(line) <= BATCH_MAX_LINE_BYTES else None
+        if len(pending) > BATCH_MAX_LINE_BYTES:
+            overflow = True
+            pending.clear()
+    
+    if overflow or pending:
+        yield line_number + 1, None if overflow else bytes(pending)
+
+def sample_from_record(record, model_type):
+    """Build a KeystrokeSample from a JSON object with the CSV column names"""
+    sample = {
+        'username': str(record['username']),
+        'captcha': str(record.get('captcha', '')),
+        'userInput': str(record.get('userInput', '')),
+        'isCorrect': str(record.get('isCorrect', False)).lower() == 'true',
+        'timestamp': str(record.get('timestamp', ''))
+    }
+    for name in SAMPLE_FLOAT_FIELDS:
+        sample[name] = float(record[name])
+    array_fields = SAMPLE_ARRAY_FIELDS + (('typingPatternVector',) if model_type == 'pin' else ())
+    for name in array_fields:
+        values = record.get(name, [])
+        sample[name] = parse_array(values) if isinstance(values, str) else [int(x) for x in values]
+    return sample
+
+def parse_batch_line(text):
+    """Parse one CSV or NDJSON line of a batch upload into (model_type, sample)
+
+    JSON lines either wrap a CSV payload as {"csv": ...} or carry the
+    sample fields directly; "model_type" may be given, otherwise the same
+    heuristic as /authenticate/auto decides.
+    """
+    if text.startswith('{'):
+        record = json.loads(text)
+        model_type = record.get('model_type')
+        if model_type not in (None, 'captcha', 'pin'):
+            raise ValueError(f"Unknown model_type: {model_type}")
+        if 'csv' not in record:
+            model_type = model_type or ('pin' if 'typingPatternVector' in record else 'captcha')
+            return model_type, sample_from_record(record, model_type)
+        text = record['csv']
+        if model_type is not None:
+            return model_type, build_sample(split_payload(text, model_type), model_type)
+    
+    model_type, parts = detect_payload(text)
+    return model_type, build_sample(parts, model_type)
+
+def batch_error_line(line_number, message):
+    return json.dumps({"line": line_number, "error": message}) + "\n"
+
+async def score_batch_chunk(chunk, device=None):
+    """Score parsed rows with one vectorized pass per model, yield NDJSON lines in order
+
+    Every row is an attempt for its username and the request's device,
+    counted against the batch velocity limits (AUTH_RATE_LIMIT_BATCH_*),
+    which are kept apart from the live login ones.
+    """
+    output = {}
+    velocities = {}
+    
+    if batch_velocity_limiter is not None:
+        rows = [(line_number, sample) for line_number, model_type, sample in chunk if model_type is not None]
+        verdicts = await check_velocities([sample['username'] for _, sample in rows], device, "/authenticate/batch",
+                                          batch_velocity_limiter)
+        for (line_number, _), (velocity, limited) in zip(rows, verdicts):
+            if limited is not None:
+                batch_line_errors.inc("rate_limited")
+                output[line_number] = batch_error_line(line_number, rate_limit_message(limited))
+            velocities[line_number] = velocity
+    
+    # Group rows by the model that scores them (shared or per-user)
+    groups = {}
+    for line_number, model_type, sample in chunk:
+        if model_type is None or line_number in output:
+            continue
+        if get_auth_system(model_type) is None:
+            title, _ = MODEL_LABELS[model_type]
+            batch_line_errors.inc("model_not_loaded")
+            output[line_number] = batch_error_line(line_number, f"{title} authentication system not loaded")
+            continue
+        auth_system = await resolve_auth_system(model_type, sample['username'])
+        groups.setdefault(id(auth_system), (auth_system, []))[1].append((line_number, sample))
+    
+    for auth_system, rows in groups.values():
+        model_type = auth_system['model_type']
+        _, label = MODEL_LABELS[model_type]
+        samples = [sample for _, sample in rows]
+        try:
+            confidences = await run_scoring(auth_system, samples)
+        except Exception:
+            # Score row by row so one bad row does not fail the whole chunk
+            confidences = []
+            for sample in samples:
+                try:
+                    confidences.append((await run_scoring(auth_system, [sample]))[0])
+                except Exception as e:
+                    confidences.append(e)
         
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error processing PIN authentication: {str(e)}")
+        for (line_number, sample), confidence in zip(rows, confidences):
+            if isinstance(confidence, Exception):
+                batch_line_errors.inc("scoring")
+                output[line_number] = batch_error_line(line_number, f"Error processing {label} authentication: {str(confidence)}")
+                continue
+            threshold = decision_threshold(auth_system, sample['username'])
+            record_scored_sample(auth_system, sample, confidence, confidence >= threshold)
+            result = {
+                "line": line_number,
+                "authenticated": bool(confidence >= threshold),
+                "confidence": float(confidence),
+                "threshold": float(threshold),
+                "user": sample['username'],
+                "target_user": auth_system['target_user'],
+                "model_type": model_type
+            }
+            if velocities.get(line_number) is not None:
+                result["velocity"] = velocities[line_number]
+            output[line_number] = json.dumps(result) + "\n"
+    
+    for line_number, _, error in chunk:
+        if line_number not in output:
+            output[line_number] = batch_error_line(line_number, error)
+    
+    for line_number in sorted(output):
+        yield output[line_number]
 
-@app.post("/authenticate/auto", response_model=AuthenticationResponse)
-async def authenticate_auto(request: Request):
-    """Auto-detect and authenticate using the appropriate model based on data format"""
-    # Get raw body as text
-    csv_data = (await request.body()).decode('utf-8')
-    
-    parts = []
-    current_part = ''
-    in_brackets = False
-    
-    for char in csv_data:
-        if char == '[':
-            in_brackets = True
-            current_part += char
-        elif char == ']':
-            in_brackets = False
-            current_part += char
-        elif char == ',' and not in_brackets:
-            parts.append(current_part)
-            current_part = ''
+async def stream_batch_results(request):
+    device = request.headers.get('x-device-fingerprint')
+    chunk = []
+    async for line_number, line in iter_body_lines(request):
+        if line is None:
+            batch_line_errors.inc("line_too_long")
+            chunk.append((line_number, None, f"Line exceeds {BATCH_MAX_LINE_BYTES} bytes"))
         else:
-            current_part += char
-            
-    # Add the last part
-    if current_part:
-        parts.append(current_part)
+            try:
+                text = line.decode('utf-8').rstrip('\r')
+                if not text.strip() or (line_number == 1 and text.startswith('username,')):
+                    continue
+                model_type, sample = parse_batch_line(text)
+                chunk.append((line_number, model_type, sample))
+            except Exception as e:
+                batch_line_errors.inc("json" if isinstance(e, json.JSONDecodeError) else parse_error_cause(e))
+                chunk.append((line_number, None, f"Error parsing line: {str(e)}"))
+        
+        if len(chunk) >= BATCH_CHUNK_SIZE:
+            async for output_line in score_batch_chunk(chunk, device):
+                yield output_line
+            chunk = []
     
-    # Simple heuristic: if there are more than 25 parts, it's likely PIN data
-    if len(parts) > 25:
-        return await authenticate_pin(request)
-    else:
-        return await authenticate_captcha(request)
+    if chunk:
+        async for output_line in score_batch_chunk(chunk, device):
+            yield output_line
 
-@app.post("/security/device-check", response_model=SecurityCheckResponse)
-async def device_security_check(request: Request):
-    """Check device security parameters"""
+@app.post("/authenticate/batch")
+async def authenticate_batch(request: Request):
+    """Score a multi-line CSV or NDJSON upload, streaming one NDJSON result per line
+
+    Each result is an AuthenticationResponse plus its input "line" number,
+    or {"line", "error"} for rows that could not be scored.
+    """
+    # The whole upload holds one admission slot while it streams; the
+    # response releases it even if the body is never streamed
     try:
-        # Get raw body as JSON
-        body = await request.body()
-        data = json.loads(body.decode('utf-8'))
-        
-        state = data.get('state', {})
-        
-        # Check device model and manufacturer
-        device_model = state.get('deviceModel', '')
-        device_manufacturer = state.get('deviceManufacturer', '')
-        
-        # Expected values
-        expected_model = "RMX3660"
-        expected_manufacturer = "realme"
-        
-        # Check if device matches expected values
+        scoring_executor.acquire()
+    except Overloaded as e:
+        raise overloaded_exception(e)
+    return BodyStreamingResponse(stream_batch_results(request), media_type="application/x-ndjson",
+                                 background=BackgroundTask(scoring_executor.release))
+
+# Security check rules, shared by the per-check endpoints and /security/session-verify
+def device_check_rule(data):
+    """Check device security parameters"""
+    state = data.state
+    
+    # Check device model and manufacturer
+    device_model = state.deviceModel
+    device_manufacturer = state.deviceManufacturer
+    
+    # Expected values
+    expected_model = "RMX3660"
+    expected_manufacturer = "realme"
+    
+    # Users enrolled in the device policy index are checked against their own
+    # devices; everyone else against the expected values
+    policy = device_policy
+    enrolled = policy is not None and policy.has_user(data.username)
+    if enrolled:
+        device_match = policy.allowed(data.username, device_manufacturer, device_model)
+    else:
         device_match = (device_model == expected_model and device_manufacturer == expected_manufacturer)
-        
-        # Get other security flags
-        is_developer_mode = state.get('isDeveloperMode', False)
-        is_usb_debugging = state.get('isUSBDebugging', False)
-        is_emulator = state.get('isEmulator', False)
-        is_rooted = state.get('isRooted', False)
-        
-        # Device is authenticated if it matches expected model/manufacturer
-        authenticated = device_match
-        
-        details = {
-            "deviceModel": device_model,
-            "deviceManufacturer": device_manufacturer,
-            "expectedModel": expected_model,
-            "expectedManufacturer": expected_manufacturer,
-            "deviceMatch": device_match,
-            "isDeveloperMode": is_developer_mode,
-            "isUSBDebugging": is_usb_debugging,
-            "isEmulator": is_emulator,
-            "isRooted": is_rooted,
-            "securityCheck": data.get('securityCheck', ''),
-            "version": data.get('version', '')
-        }
-        
+    denied = policy is not None and policy.denied(device_manufacturer, device_model, state.buildFingerprint)
+    
+    # Get other security flags
+    is_developer_mode = state.isDeveloperMode
+    is_usb_debugging = state.isUSBDebugging
+    is_emulator = state.isEmulator
+    is_rooted = state.isRooted
+    
+    # Device is authenticated if it matches expected model/manufacturer and is not denied
+    authenticated = device_match and not denied
+    
+    details = {
+        "deviceModel": device_model,
+        "deviceManufacturer": device_manufacturer,
+        "expectedModel": expected_model,
+        "expectedManufacturer": expected_manufacturer,
+        "deviceMatch": device_match,
+        "enrolledDevices": enrolled,
+        "deniedDevice": denied,
+        "isDeveloperMode": is_developer_mode,
+        "isUSBDebugging": is_usb_debugging,
+        "isEmulator": is_emulator,
+        "isRooted": is_rooted,
+        "securityCheck": data.securityCheck,
+        "version": data.version
+    }
+    
+    if denied:
+        message = "Device is on the deny-list"
+    else:
         message = "Device authenticated" if authenticated else "Device not recognized"
-        
-        return SecurityCheckResponse(
-            authenticated=authenticated,
-            message=message,
-            details=details
-        )
-        
+    
+    return {
+        "authenticated": authenticated,
+        "message": message,
+        "details": details
+    }
+
+def two_factor_rule(data):
+    """Check two-factor authentication choice"""
+    choice = data.twoFactorChoice
+    
+    # Only choice 2 is correct
+    authenticated = (choice == 2)
+    
+    message = "Two-factor choice correct" if authenticated else "Invalid two-factor choice"
+    
+    return {
+        "authenticated": authenticated,
+        "message": message,
+        "choice": choice
+    }
+
+def emulator_detection_rule(data):
+    """Check emulator detection result"""
+    result = data.emulatorDetectionResult
+    
+    # Only "real_device" is correct
+    authenticated = (result == "real_device")
+    
+    message = "Real device detected" if authenticated else "Emulator or invalid device detected"
+    
+    return {
+        "authenticated": authenticated,
+        "message": message,
+        "result": result
+    }
+
+def wifi_safety_rule(data):
+    """Check WiFi safety choice"""
+    choice = data.wifiSafetyChoice
+    
+    # Only choice 1 is correct
+    authenticated = (choice == 1)
+    
+    message = "WiFi safety choice correct" if authenticated else "Invalid WiFi safety choice"
+    
+    return {
+        "authenticated": authenticated,
+        "message": message,
+        "choice": choice
+    }
+
+def first_action_rule(data):
+    """Check first action choice"""
+    action = data.firstAction
+    pressed = data.pressed
+    
+    # Only "showBalance" action is correct and pressed should be true
+    authenticated = (action == "showBalance" and pressed)
+    
+    message = "First action correct" if authenticated else "Invalid first action"
+    
+    return {
+        "authenticated": authenticated,
+        "message": message,
+        "action": action
+    }
+
+def navigation_method_rule(data):
+    """Check navigation method"""
+    method = data.navigationMethod
+    
+    # Only "hardwareBack" method is correct
+    authenticated = (method == "hardwareBack")
+    
+    message = "Navigation method correct" if authenticated else "Invalid navigation method"
+    
+    return {
+        "authenticated": authenticated,
+        "message": message,
+        "method": method
+    }
+
+async def decode_security_body(request, endpoint, label):
+    """Read and decode a /security JSON body within the configured limits"""
+    try:
+        body = await read_body(request, SECURITY_MAX_BODY_BYTES)
+        return decode_json(body, SECURITY_MAX_BODY_BYTES, SECURITY_MAX_JSON_DEPTH)
     except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error processing device security check: {str(e)}")
+        bad_requests.inc(endpoint, decode_error_cause(e))
+        status_code = 413 if isinstance(e, PayloadTooLarge) else 400
+        raise HTTPException(status_code=status_code, detail=f"Error processing {label}: {str(e)}")
+
+async def run_security_check(request, request_model, response_model, rule, endpoint, label):
+    """Decode a per-check request body into its model and evaluate its rule"""
+    data = await decode_security_body(request, endpoint, label)
+    try:
+        return respond(response_model, rule(request_model.model_validate(data)))
+    except Exception as e:
+        bad_requests.inc(endpoint, decode_error_cause(e))
+        raise HTTPException(status_code=400, detail=f"Error processing {label}: {str(e)}")
+
+@app.post("/security/device-check", response_model=SecurityCheckResponse)
+async def device_security_check(request: Request):
+    """Check device security parameters"""
+    return await run_security_check(request, DeviceCheckRequest, SecurityCheckResponse, device_check_rule, "/security/device-check",
+                                    "device security check")
 
 @app.post("/security/two-factor", response_model=TwoFactorResponse)
 async def two_factor_check(request: Request):
     """Check two-factor authentication choice"""
-    try:
-        # Get raw body as JSON
-        body = await request.body()
-        data = ast.literal_eval(body.decode('utf-8'))
-        
-        choice = data.get('twoFactorChoice', 0)
-        
-        # Only choice 2 is correct
-        authenticated = (choice == 2)
-        
-        message = "Two-factor choice correct" if authenticated else "Invalid two-factor choice"
-        
-        return TwoFactorResponse(
-            authenticated=authenticated,
-            message=message,
-            choice=choice
-        )
-        
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error processing two-factor check: {str(e)}")
+    return await run_security_check(request, TwoFactorRequest, TwoFactorResponse, two_factor_rule, "/security/two-factor", "two-factor check")
 
 @app.post("/security/emulator-detection", response_model=EmulatorResponse)
 async def emulator_detection_check(request: Request):
     """Check emulator detection result"""
-    try:
-        # Get raw body as JSON
-        body = await request.body()
-        data = ast.literal_eval(body.decode('utf-8'))
-        
-        result = data.get('emulatorDetectionResult', '')
-        
-        # Only "real_device" is correct
-        authenticated = (result == "real_device")
-        
-        message = "Real device detected" if authenticated else "Emulator or invalid device detected"
-        
-        return EmulatorResponse(
-            authenticated=authenticated,
-            message=message,
-            result=result
-        )
-        
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error processing emulator detection: {str(e)}")
+    return await run_security_check(request, EmulatorDetectionRequest, EmulatorResponse, emulator_detection_rule, "/security/emulator-detection",
+                                    "emulator detection")
 
 @app.post("/security/wifi-safety", response_model=WifiSafetyResponse)
 async def wifi_safety_check(request: Request):
     """Check WiFi safety choice"""
-    try:
-        # Get raw body as JSON
-        body = await request.body()
-        data = ast.literal_eval(body.decode('utf-8'))
-        
-        choice = data.get('wifiSafetyChoice', 0)
-        
-        # Only choice 1 is correct
-        authenticated = (choice == 1)
-        
-        message = "WiFi safety choice correct" if authenticated else "Invalid WiFi safety choice"
-        
-        return WifiSafetyResponse(
-            authenticated=authenticated,
-            message=message,
-            choice=choice
-        )
-        
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error processing WiFi safety check: {str(e)}")
+    return await run_security_check(request, WifiSafetyRequest, WifiSafetyResponse, wifi_safety_rule, "/security/wifi-safety", "WiFi safety check")
 
 @app.post("/security/first-action", response_model=FirstActionResponse)
 async def first_action_check(request: Request):
     """Check first action choice"""
-    try:
-        # Get raw body as JSON
-        body = await request.body()
-        data = json.loads(body.decode('utf-8'))
-        
-        action = data.get('firstAction', '')
-        pressed = data.get('pressed', False)
-        
-        # Only "showBalance" action is correct and pressed should be true
-        authenticated = (action == "showBalance" and pressed == True)
-        
-        message = "First action correct" if authenticated else "Invalid first action"
-        
-        return FirstActionResponse(
-            authenticated=authenticated,
-            message=message,
-            action=action
-        )
-        
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error processing first action check: {str(e)}")
+    return await run_security_check(request, FirstActionRequest, FirstActionResponse, first_action_rule, "/security/first-action",
+                                    "first action check")
 
 @app.post("/security/navigation-method", response_model=NavigationResponse)
 async def navigation_method_check(request: Request):
     """Check navigation method"""
+    return await run_security_check(request, NavigationMethodRequest, NavigationResponse, navigation_method_rule, "/security/navigation-method",
+                                    "navigation method check")
+
+# Sections of a /security/session-verify document: the same body each per-check endpoint takes
+SESSION_CHECKS = {
+    'deviceCheck': (DeviceCheckRequest, device_check_rule),
+    'twoFactor': (TwoFactorRequest, two_factor_rule),
+    'emulatorDetection': (EmulatorDetectionRequest, emulator_detection_rule),
+    'wifiSafety': (WifiSafetyRequest, wifi_safety_rule),
+    'firstAction': (FirstActionRequest, first_action_rule),
+    'navigationMethod': (NavigationMethodRequest, navigation_method_rule),
+}
+
+async def evaluate_session_rule(request_model, rule, data):
     try:
-        # Get raw body as JSON
-        body = await request.body()
-        data = ast.literal_eval(body.decode('utf-8'))
-        
-        method = data.get('navigationMethod', '')
-        
-        # Only "hardwareBack" method is correct
-        authenticated = (method == "hardwareBack")
-        
-        message = "Navigation method correct" if authenticated else "Invalid navigation method"
-        
-        return NavigationResponse(
-            authenticated=authenticated,
-            message=message,
-            method=method
+        return rule(request_model.model_validate(data))
+    except Exception as e:
+        bad_requests.inc("/security/session-verify", decode_error_cause(e))
+        return {"authenticated": False, "message": "Check could not be evaluated", "error": str(e)}
+
+async def evaluate_session_keystroke(keystroke, device=None):
+    """Score the optional keystroke section: {"csv": ..., "model_type": "captcha" | "pin"}
+
+    The section counts against the velocity limits like a single
+    authentication; in enforce mode one over the limit fails the whole
+    request with 429.
+    """
+    try:
+        section = KeystrokeSection.model_validate(keystroke)
+        model_type = section.model_type
+        if model_type is None:
+            model_type, parts = detect_payload(section.csv)
+        else:
+            parts = split_payload(section.csv, model_type)
+    except Exception as e:
+        bad_requests.inc("/security/session-verify", decode_error_cause(e))
+        return {"authenticated": False, "message": "Keystroke data could not be parsed", "error": str(e)}
+    
+    velocity = None
+    if velocity_limiter is not None:
+        [(velocity, limited)] = await check_velocities([parts[0].strip().strip('"')], device, "/security/session-verify")
+        if limited is not None:
+            raise rate_limited_exception(limited)
+    
+    try:
+        result = await score_parts(parts, model_type, "/security/session-verify", calibrate=False)
+    except HTTPException as e:
+        return {"authenticated": False, "message": "Keystroke authentication failed", "error": e.detail}
+    if velocity is not None:
+        result["velocity"] = velocity
+    return {"message": "Keystroke pattern matched" if result['authenticated'] else "Keystroke pattern not recognized",
+            **result}
+
+@app.post("/security/session-verify", response_model=SessionVerifyResponse)
+async def session_verify(request: Request):
+    """Evaluate every login risk signal in one request
+
+    The body is one JSON object whose optional sections are the bodies of
+    the per-check endpoints (deviceCheck, twoFactor, emulatorDetection,
+    wifiSafety, firstAction, navigationMethod) plus a keystroke section.
+    The session is authenticated only if every section present passes.
+    """
+    data = await decode_security_body(request, "/security/session-verify", "session verification")
+    try:
+        if not isinstance(data, dict):
+            raise TypeError("Session document must be a JSON object")
+        unknown = set(data) - set(SESSION_CHECKS) - {'keystroke'}
+        if unknown:
+            raise ValueError(f"Unknown checks: {', '.join(sorted(unknown))}")
+        if not data:
+            raise ValueError("No checks given")
+    except Exception as e:
+        bad_requests.inc("/security/session-verify", decode_error_cause(e))
+        raise HTTPException(status_code=400, detail=f"Error processing session verification: {str(e)}")
+    
+    names = [name for name in SESSION_CHECKS if name in data]
+    checks = [evaluate_session_rule(*SESSION_CHECKS[name], data[name]) for name in names]
+    
+    holds_slot = 'keystroke' in data
+    if holds_slot:
+        try:
+            scoring_executor.acquire()
+        except Overloaded as e:
+            raise overloaded_exception(e)
+        names.append('keystroke')
+        checks.append(evaluate_session_keystroke(data['keystroke'], request.headers.get('x-device-fingerprint')))
+    
+    try:
+        results = await asyncio.gather(*checks)
+    finally:
+        if holds_slot:
+            scoring_executor.release()
+    
+    verdicts = dict(zip(names, results))
+    failed_checks = [name for name, verdict in verdicts.items() if not verdict['authenticated']]
+    authenticated = not failed_checks
+    
+    return respond(SessionVerifyResponse, {
+        "authenticated": authenticated,
+        "message": "Session verified" if authenticated else f"Session rejected: {', '.join(failed_checks)} failed",
+        "checks": verdicts,
+        "failed_checks": failed_checks
+    })
+
+def check_admin_token(request):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Admin endpoints are disabled")
+    token = request.headers.get('x-admin-token', '')
+    if not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+@app.post("/admin/reload")
+async def admin_reload(request: Request, model: Optional[str] = None, version: Optional[str] = None):
+    """Reload one model (?model=captcha|pin, optional ?version=N) or both
+
+    Requests keep being served by the current models until the new ones
+    are loaded and warmed; a model that fails to load is not swapped in.
+    """
+    check_admin_token(request)
+    if AUTH_WORKERS > 1:
+        # Only the worker that got this request would reload
+        raise HTTPException(
+            status_code=409,
+            detail="Reload is per process and cannot reach every worker with AUTH_WORKERS > 1; "
+                   "set MODEL_WATCH_INTERVAL_SECONDS so each worker picks up new model files"
         )
-        
+    if model is not None and model not in MODEL_SOURCES:
+        raise HTTPException(status_code=400, detail=f"Unknown model: {model}")
+    if version is not None and model is None:
+        raise HTTPException(status_code=400, detail="A version can only be given together with a model")
+    
+    errors = {}
+    for name in [model] if model else list(MODEL_SOURCES):
+        error = await reload_model(name, version)
+        if error is not None:
+            errors[name] = error
+    if errors:
+        raise HTTPException(status_code=500, detail={"message": "Reload failed, previous models kept", "errors": errors})
+    return {"reloaded": [model] if model else list(MODEL_SOURCES), "models": model_status}
+
+def set_device_policy(policy):
+    global device_policy
+    # Checks already holding the old index finish on it
+    device_policy = policy
+    stats = policy.stats()
+    print(f"✅ Device policy {stats['version']} loaded: {stats['users']} users, {stats['devices']} devices, "
+          f"{stats['denied']} denied")
+
+@app.post("/admin/device-policy/reload")
+async def admin_reload_device_policy(request: Request):
+    """Swap in the newest device policy version under DEVICE_POLICY_DIR"""
+    check_admin_token(request)
+    try:
+        policy = await asyncio.to_thread(load_device_policy)
     except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error processing navigation method check: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Device policy reload failed, previous index kept: {e}")
+    if policy is None:
+        raise HTTPException(status_code=404, detail=f"No device policy found in {DEVICE_POLICY_DIR}")
+    set_device_policy(policy)
+    return policy.stats()
+
+@app.get("/admin/calibration")
+async def admin_calibration(request: Request, model_type: Optional[str] = None, user: Optional[str] = None,
+                            limit: int = 100):
+    """Adaptive thresholds and score distributions, for one user or the most recently scored ones"""
+    check_admin_token(request)
+    if calibrator is None:
+        raise HTTPException(status_code=404, detail="Threshold calibration is off (AUTH_CALIBRATION)")
+    if model_type is not None and model_type not in MODEL_SOURCES:
+        raise HTTPException(status_code=400, detail=f"Unknown model type: {model_type}")
+    
+    def report(key):
+        auth_system = get_auth_system(key[0])
+        return calibrator.user_report(key[0], key[1], auth_system['threshold'] if auth_system else math.nan)
+    
+    if user is not None:
+        if model_type is None:
+            raise HTTPException(status_code=400, detail="A user can only be given together with a model_type")
+        user_report = report((model_type, user))
+        if user_report is None:
+            raise HTTPException(status_code=404, detail=f"No {model_type} scores recorded for {user}")
+        return user_report
+    return {
+        "mode": AUTH_CALIBRATION,
+        "stats": calibrator.stats(),
+        "users": [report(key) for key in calibrator.users(model_type)[:max(0, limit)]],
+    }
+
+# Longest profile /admin/profile will take, and one profile at a time
+AUTH_PROFILE_MAX_SECONDS = float(os.environ.get('AUTH_PROFILE_MAX_SECONDS', '60'))
+profile_lock = asyncio.Lock()
+
+@app.post("/admin/profile")
+async def admin_profile(request: Request, seconds: float = 10.0, interval_ms: float = 5.0):
+    """Sample this worker's stacks for ?seconds and return them as collapsed stacks
+
+    The result loads into flamegraph.pl, speedscope or inferno. Requests
+    keep being served while the profile runs.
+    """
+    check_admin_token(request)
+    if not 0 < seconds <= AUTH_PROFILE_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds must be in (0, {AUTH_PROFILE_MAX_SECONDS:g}]")
+    if not 1 <= interval_ms <= 1000:
+        raise HTTPException(status_code=400, detail="interval_ms must be between 1 and 1000")
+    if profile_lock.locked():
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    async with profile_lock:
+        print(f"🔄 Profiling for {seconds:g}s every {interval_ms:g}ms...")
+        stacks, samples = await asyncio.to_thread(SamplingProfiler(interval_ms / 1000.0).run, seconds)
+    print(f"✅ Profile done: {samples} samples, {len(stacks)} distinct stacks")
+    return Response(
+        collapsed(stacks), media_type="text/plain",
+        headers={
+            "Content-Disposition": f'attachment; filename="profile-{os.getpid()}-{time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())}.folded"',
+            "X-Profile-Samples": str(samples),
+        }
+    )
+
+@app.get("/admin/slow-requests")
+async def admin_slow_requests(request: Request, limit: int = 100):
+    """The most recent requests over AUTH_SLOW_REQUEST_MS, newest first"""
+    check_admin_token(request)
+    if slow_requests is None:
+        raise HTTPException(status_code=404, detail="The slow request recorder is off (AUTH_SLOW_REQUEST_MS)")
+    return {"stats": slow_requests.stats(), "requests": slow_requests.snapshot()[:max(0, limit)]}
 
 @app.get("/")
 async def root():
@@ -619,11 +2062,129 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    return {
-        "status": "healthy",
+    status = {
+        "status": "healthy" if service_ready else "warming_up",
+        "ready": service_ready,
+        "warmup": warmup_status,
         "captcha_model_loaded": captcha_auth_system is not None,
-        "pin_model_loaded": pin_auth_system is not None
+        "pin_model_loaded": pin_auth_system is not None,
+        "captcha_model_version": captcha_auth_system['version'] if captcha_auth_system else None,
+        "pin_model_version": pin_auth_system['version'] if pin_auth_system else None,
+        "models": model_status,
+        "executor": scoring_executor.stats(),
+        "model_registry": user_model_registry.stats() if user_model_registry is not None else None,
+        "result_cache": result_cache.stats(),
+        "feature_store": feature_store.stats() if feature_store is not None else None,
+        "calibration": dict(calibrator.stats(), mode=AUTH_CALIBRATION) if calibrator is not None else None,
+        "device_policy": device_policy.stats() if device_policy is not None else None,
+        "rate_limit": dict(velocity_limiter.stats(), mode=AUTH_RATE_LIMIT, batch=batch_velocity_limiter.stats())
+                      if velocity_limiter is not None else None,
+        "slow_requests": slow_requests.stats() if slow_requests is not None else None,
+        "batching": {
+            "captcha": captcha_batcher.metrics.snapshot(),
+            "pin": pin_batcher.metrics.snapshot()
+        }
     }
+    if not service_ready:
+        # Load balancers must not route to a worker that has not been warmed
+        return JSONResponse(status_code=503, content=status)
+    return status
+
+def service_metrics():
+    """Executor, batching and model cache state as /metrics samples"""
+    executor_stats = scoring_executor.stats()
+    yield ("auth_in_flight_requests", "gauge", "Requests holding a scoring admission slot",
+           [({}, executor_stats["in_flight"])])
+    yield ("auth_rejected_requests_total", "counter", "Requests answered with 429 because scoring was saturated",
+           [({}, executor_stats["rejected"])])
+    
+    batchers = (("captcha", captcha_batcher.metrics.snapshot()), ("pin", pin_batcher.metrics.snapshot()))
+    yield ("auth_batches_total", "counter", "Micro-batches scored",
+           [({"model_type": name}, snapshot["batches"]) for name, snapshot in batchers])
+    yield ("auth_batched_items_total", "counter", "Requests scored through micro-batches",
+           [({"model_type": name}, snapshot["items"]) for name, snapshot in batchers])
+    yield ("auth_batch_queue_wait_max_seconds", "gauge", "Longest time a request waited for its batch",
+           [({"model_type": name}, snapshot["max_queue_wait_ms"] / 1000.0) for name, snapshot in batchers])
+    
+    if result_cache.enabled:
+        cache_stats = result_cache.stats()
+        yield ("auth_result_cache_entries", "gauge", "Results held in the duplicate-submission cache",
+               [({}, cache_stats["entries"])])
+        yield ("auth_result_cache_bytes", "gauge", "Estimated bytes held by the result cache",
+               [({}, cache_stats["bytes_in_use"])])
+        yield ("auth_result_cache_evictions_total", "counter", "Result cache entries evicted to stay within bounds",
+               [({}, cache_stats["evictions"])])
+    
+    if feature_store is not None:
+        store_stats = feature_store.stats()
+        yield ("auth_feature_store_pending_rows", "gauge", "Scored sessions buffered for the feature store",
+               [({}, store_stats["pending_rows"])])
+        yield ("auth_feature_store_rows_total", "counter", "Scored sessions by what happened to them in the feature store",
+               [({"result": "written"}, store_stats["rows_written"]), ({"result": "dropped"}, store_stats["dropped"])])
+        yield ("auth_feature_store_write_errors_total", "counter", "Feature store segments that failed to write",
+               [({}, store_stats["write_errors"])])
+    
+    if velocity_limiter is not None and AUTH_RATE_LIMIT_BACKEND == 'local':
+        yield ("auth_rate_limit_keys", "gauge", "Usernames and devices tracked by the velocity limits",
+               [({}, velocity_limiter.store.stats()["keys"])])
+    
+    if user_model_registry is not None:
+        registry_stats = user_model_registry.stats()
+        yield ("auth_user_models", "gauge", "Per-user models held in memory", [({}, registry_stats["models"])])
+        yield ("auth_user_model_bytes", "gauge", "Bytes of per-user weights held in memory",
+               [({}, registry_stats["bytes_in_use"])])
+        yield ("auth_user_model_lookups_total", "counter", "Per-user model lookups",
+               [({"result": "hit"}, registry_stats["hits"]), ({"result": "miss"}, registry_stats["misses"])])
+
+metrics.add_collector(service_metrics)
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus text exposition of latency histograms and error counters"""
+    return Response(metrics.render(), media_type=METRICS_CONTENT_TYPE)
+
+# Worker processes for `python main.py`; above 1 the models are loaded once and shared
+AUTH_WORKERS = int(os.environ.get('AUTH_WORKERS', '1'))
+# BLAS/OpenMP threads and scoring executor workers per worker (0: CPU count
+# divided by AUTH_WORKERS)
+AUTH_WORKER_THREADS = int(os.environ.get('AUTH_WORKER_THREADS', '0'))
+
+def serve(host="0.0.0.0", port=8000):
+    """Run the API, in AUTH_WORKERS processes sharing one copy of the weights"""
+    if AUTH_WORKERS <= 1:
+        uvicorn.run(app, host=host, port=port)
+        return
+    
+    threads = AUTH_WORKER_THREADS or max(1, (os.cpu_count() or 1) // AUTH_WORKERS)
+    # Read by the workers' BLAS, TensorFlow and scoring executor when they
+    # import; explicit settings win
+    for variable in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'AUTH_TF_INTRA_OP_THREADS',
+                     'AUTH_EXECUTOR_WORKERS'):
+        os.environ.setdefault(variable, str(threads))
+    os.environ.setdefault('AUTH_TF_INTER_OP_THREADS', '1')
+    
+    blocks = []
+    shared = {}
+    try:
+        for name in MODEL_SOURCES:
+            manifest, block = publish_auth_system(load_model_source(name))
+            if manifest is None:
+                print(f"⚠️ {MODEL_LABELS[name][0]} does not use the NumPy engine, each worker loads its own copy")
+                continue
+            blocks.append(block)
+            shared[name] = manifest
+            print(f"✅ {MODEL_LABELS[name][0]} published in shared memory block {block.name} ({block.size} bytes)")
+        
+        os.environ['AUTH_SHARED_MODELS'] = json.dumps(shared)
+        if not MODEL_WATCH_INTERVAL_SECONDS:
+            print("⚠️ /admin/reload cannot reach every worker; set MODEL_WATCH_INTERVAL_SECONDS to pick up new models")
+        print(f"🔄 Starting {AUTH_WORKERS} workers with {threads} threads each")
+        uvicorn.run("main:app", host=host, port=port, workers=AUTH_WORKERS,
+                    app_dir=os.path.dirname(os.path.abspath(__file__)))
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    serve()
\ No newline at end of file
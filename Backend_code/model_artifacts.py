@@ -0,0 +1,303 @@
+"""Versioned, memory-mappable model artifacts
+
+An artifact is a directory `<root>/<name>/v<N>/` holding a `manifest.json`
+and one raw `.npy` file per weight array. Workers load it with
+`np.load(mmap_mode='r')`, so loading takes milliseconds, needs neither
+TensorFlow nor scikit-learn, and every process on the host shares the same
+page-cache copy of the weights.
+
+Export the pickled systems with:
+
+    python model_artifacts.py export [--output-dir models] [--user USERNAME]
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+
+from inference import QUANTIZATION_MODES, NumpySequential, decision_flip_rate, quantize_model
+
+
+ARTIFACT_FORMAT_VERSION = 1
+
+# Pickled systems shipped with the service, by artifact name
+PICKLED_SYSTEMS = {
+    'captcha': 'keystroke_authentication_system.pkl',
+    'pin': 'pin_authentication.pkl',
+}
+
+
+class ArtifactScaler:
+    """StandardScaler.transform without scikit-learn
+
+    With neither mean nor scale (the scaling was folded into the model)
+    transform only validates its input.
+    """
+
+    def __init__(self, mean, scale, n_features=None):
+        self.mean_ = mean
+        self.scale_ = scale
+        if n_features is None:
+            n_features = len(mean if mean is not None else scale)
+        self.n_features_in_ = n_features
+
+    @classmethod
+    def from_sklearn(cls, scaler):
+        return cls(
+            None if scaler.mean_ is None else np.asarray(scaler.mean_, dtype=np.float64),
+            None if scaler.scale_ is None else np.asarray(scaler.scale_, dtype=np.float64),
+            scaler.n_features_in_,
+        )
+
+    def transform(self, X):
+        if self.mean_ is None and self.scale_ is None:
+            X = np.asarray(X, dtype=np.float64)
+        else:
+            X = np.array(X, dtype=np.float64)
+        if X.ndim != 2 or X.shape[1] != self.n_features_in_:
+            raise ValueError(f"X has {X.shape[-1]} features, but scaler is expecting {self.n_features_in_} features as input")
+        if not np.isfinite(X).all():
+            raise ValueError("Input X contains infinity or a value too large for dtype('float64').")
+        if self.mean_ is not None:
+            X -= self.mean_
+        if self.scale_ is not None:
+            X /= self.scale_
+        return X
+
+
+def file_sha256(filepath):
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def array_sha256(array):
+    array = np.ascontiguousarray(array)
+    digest = hashlib.sha256(f"{array.dtype.str}{array.shape}".encode())
+    digest.update(array.tobytes())
+    return digest.hexdigest()
+
+
+def list_versions(root, name):
+    """Exported version numbers for a model, oldest first"""
+    directory = os.path.join(root, name)
+    if not os.path.isdir(directory):
+        return []
+    versions = []
+    for entry in os.listdir(directory):
+        if entry.startswith('v') and entry[1:].isdigit() and os.path.isfile(os.path.join(directory, entry, 'manifest.json')):
+            versions.append(int(entry[1:]))
+    return sorted(versions)
+
+
+def find_artifact(root, name, version=None):
+    """Directory of the requested (or newest) artifact version, or None"""
+    versions = list_versions(root, name)
+    if version is not None:
+        version = int(str(version).lstrip('v'))
+        return os.path.join(root, name, f"v{version}") if version in versions else None
+    return os.path.join(root, name, f"v{versions[-1]}") if versions else None
+
+
+def export_auth_system(auth_system, root, name, source=None):
+    """Write an unpickled authentication system as the next artifact version
+
+    A system whose scaler was folded into the model (main.fuse_scaler) is
+    written folded: the artifact holds the folded first layer, and the
+    scaler it absorbed is kept only to probe quantized exports.
+    """
+    model = auth_system['model']
+    if not isinstance(model, NumpySequential):
+        model = NumpySequential.from_keras(model)
+    scaler = auth_system['scaler']
+    if not isinstance(scaler, ArtifactScaler):
+        scaler = ArtifactScaler.from_sklearn(scaler)
+
+    layers, arrays = model.to_arrays()
+    if scaler.mean_ is not None:
+        arrays['scaler_mean'] = scaler.mean_
+    if scaler.scale_ is not None:
+        arrays['scaler_scale'] = scaler.scale_
+    folded = auth_system.get('folded_scaler')
+    if folded is not None and folded.mean_ is not None:
+        arrays['folded_mean'] = folded.mean_
+    if folded is not None and folded.scale_ is not None:
+        arrays['folded_scale'] = folded.scale_
+
+    versions = list_versions(root, name)
+    version = versions[-1] + 1 if versions else 1
+    final_dir = os.path.join(root, name, f"v{version}")
+    staging_dir = f"{final_dir}.tmp-{os.getpid()}"
+    os.makedirs(staging_dir)
+
+    try:
+        for array_name, array in arrays.items():
+            np.save(os.path.join(staging_dir, f"{array_name}.npy"), np.ascontiguousarray(array))
+
+        manifest = {
+            'format_version': ARTIFACT_FORMAT_VERSION,
+            'name': name,
+            'version': version,
+            'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'threshold': float(auth_system['threshold']),
+            'target_user': auth_system['target_user'],
+            'feature_count': int(auth_system.get('feature_count', scaler.n_features_in_)),
+            'quantization': auth_system.get('quantization'),
+            'layers': layers,
+            'scaler': {
+                'mean': 'scaler_mean' if scaler.mean_ is not None else None,
+                'scale': 'scaler_scale' if scaler.scale_ is not None else None,
+                'folded_mean': 'folded_mean' if 'folded_mean' in arrays else None,
+                'folded_scale': 'folded_scale' if 'folded_scale' in arrays else None,
+            },
+            'arrays': {
+                array_name: {
+                    'dtype': array.dtype.str,
+                    'shape': list(array.shape),
+                    'sha256': array_sha256(array),
+                }
+                for array_name, array in arrays.items()
+            },
+        }
+        if source is not None:
+            manifest['source'] = {'file': os.path.basename(source), 'sha256': file_sha256(source)}
+
+        with open(os.path.join(staging_dir, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+        # Publish the whole version at once so a loader never sees half of it
+        os.rename(staging_dir, final_dir)
+    except Exception:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        raise
+
+    return final_dir
+
+
+def read_manifest(directory):
+    with open(os.path.join(directory, 'manifest.json')) as f:
+        manifest = json.load(f)
+    if manifest.get('format_version') != ARTIFACT_FORMAT_VERSION:
+        raise ValueError(f"Unsupported artifact format {manifest.get('format_version')} in {directory}")
+    return manifest
+
+
+def load_artifact_arrays(directory, manifest, mmap_mode='r'):
+    arrays = {}
+    for array_name, meta in manifest['arrays'].items():
+        array = np.load(os.path.join(directory, f"{array_name}.npy"), mmap_mode=mmap_mode, allow_pickle=False)
+        if list(array.shape) != meta['shape'] or array.dtype.str != meta['dtype']:
+            raise ValueError(f"Array {array_name} in {directory} does not match its manifest entry")
+        # Plain ndarray view over the mapping keeps the hot path off np.memmap
+        arrays[array_name] = array.view(np.ndarray)
+    return arrays
+
+
+def auth_system_from_arrays(manifest, arrays):
+    """Assemble the dict shape the handlers expect from manifest and arrays"""
+    scaler_meta = manifest['scaler']
+    folded_mean, folded_scale = scaler_meta.get('folded_mean'), scaler_meta.get('folded_scale')
+    return {
+        'model': NumpySequential.from_arrays(manifest['layers'], arrays),
+        'scaler': ArtifactScaler(
+            arrays[scaler_meta['mean']] if scaler_meta['mean'] else None,
+            arrays[scaler_meta['scale']] if scaler_meta['scale'] else None,
+            manifest['feature_count'],
+        ),
+        'folded_scaler': ArtifactScaler(
+            arrays[folded_mean] if folded_mean else None,
+            arrays[folded_scale] if folded_scale else None,
+            manifest['feature_count'],
+        ) if folded_mean or folded_scale else None,
+        'threshold': manifest['threshold'],
+        'target_user': manifest['target_user'],
+        'feature_count': manifest['feature_count'],
+        'quantization': manifest.get('quantization'),
+        'version': f"{manifest['name']}-v{manifest['version']}",
+    }
+
+
+def load_artifact(directory, mmap_mode='r', verify=False):
+    """Load an exported authentication system; weights stay memory-mapped"""
+    manifest = read_manifest(directory)
+    arrays = load_artifact_arrays(directory, manifest, mmap_mode=mmap_mode)
+    if verify:
+        for array_name, meta in manifest['arrays'].items():
+            if array_sha256(arrays[array_name]) != meta['sha256']:
+                raise ValueError(f"Checksum mismatch for {array_name} in {directory}")
+    return auth_system_from_arrays(manifest, arrays)
+
+
+def export_command(args):
+    from main import fuse_scaler, load_pickled_auth_system
+
+    for name in args.models:
+        source = os.path.join(args.source_dir, PICKLED_SYSTEMS[name])
+        print(f"Exporting {source}...")
+        auth_system = load_pickled_auth_system(source)
+        reference_model = auth_system['model']
+        reference_scaler = auth_system['scaler']
+        auth_system['model'] = NumpySequential.from_keras(reference_model)
+        if args.fuse_scaler:
+            # Folded here, before quantizing, so workers map the folded layer instead of building it
+            fuse_scaler(auth_system, f"{name} model")
+        if args.quantize:
+            full = auth_system['model']
+            folded = auth_system.get('folded_scaler')
+            auth_system['model'] = quantize_model(full, args.quantize)
+            auth_system['quantization'] = args.quantize
+            flip_rate = decision_flip_rate(full, auth_system['model'], auth_system['threshold'],
+                                           auth_system['scaler'].n_features_in_,
+                                           mean=folded.mean_ if folded else None,
+                                           scale=folded.scale_ if folded else None)
+            if flip_rate > args.max_flip_rate:
+                print(f"❌ {args.quantize} weights flip {100 * flip_rate:.3f}% of {name} decisions "
+                      f"(--max-flip-rate {100 * args.max_flip_rate:.3f}%), not exported")
+                raise SystemExit(1)
+        if args.user:
+            # Per-user layout read by model_registry.ModelRegistry
+            auth_system['target_user'] = args.user
+            directory = export_auth_system(auth_system, os.path.join(args.output_dir, 'users', name), args.user, source=source)
+        else:
+            directory = export_auth_system(auth_system, args.output_dir, name, source=source)
+        print(f"✅ {name} model exported to {directory}")
+
+        if args.check:
+            exported = load_artifact(directory, verify=True)
+            probe = np.random.default_rng(0).normal(size=(256, exported['scaler'].n_features_in_))
+            expected = reference_model.predict(reference_scaler.transform(probe), verbose=0)
+            actual = exported['model'].predict(exported['scaler'].transform(probe))
+            print(f"   max difference vs pickle: {float(np.max(np.abs(expected - actual))):.2e}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export pickled authentication systems as model artifacts")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export = subparsers.add_parser('export', help="convert the .pkl systems into a new artifact version")
+    export.add_argument('--source-dir', default='.', help="directory containing the .pkl files")
+    export.add_argument('--output-dir', default='models', help="artifact root directory")
+    export.add_argument('--models', nargs='+', choices=sorted(PICKLED_SYSTEMS), default=sorted(PICKLED_SYSTEMS))
+    export.add_argument('--user', help="export as this user's model under <output-dir>/users/")
+    export.add_argument('--quantize', choices=QUANTIZATION_MODES,
+                        help="store dense kernels in this precision (see `benchmark.py quantize`)")
+    export.add_argument('--max-flip-rate', type=float, default=0.001,
+                        help="refuse a quantization that flips more decisions than this")
+    export.add_argument('--no-fuse-scaler', dest='fuse_scaler', action='store_false',
+                        help="store the scaler separately instead of folded into the first layer")
+    export.add_argument('--no-check', dest='check', action='store_false', help="skip comparing against the pickle")
+    export.set_defaults(func=export_command)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,201 @@
+import asyncio
+import os
+import re
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from model_artifacts import auth_system_from_arrays, find_artifact, read_manifest
+
+
+# Usernames become directory names, so anything else never maps to a model
+_SAFE_USERNAME = re.compile(r'^[A-Za-z0-9_.@-]{1,128}$')
+
+
+class ModelRegistry:
+    """Per-user authentication systems, loaded lazily and kept in an LRU cache
+
+    Artifacts live at `<root>/<model_type>/<username>/v<N>/` in the format
+    written by model_artifacts.py. Weight arrays are interned by their
+    manifest checksum, so users whose scaler or layers are identical share
+    one memory-mapped copy, and the byte budget counts each array once.
+    Users without an artifact are remembered for `negative_ttl` seconds so
+    the filesystem is not probed on every request.
+
+    On the event loop use `get_async`: a miss reads the manifest and maps
+    the arrays in a thread, and concurrent misses for the same user share
+    one load. `get` loads inline, for process-pool workers.
+    """
+
+    def __init__(self, root, max_models=256, max_bytes=256 * 1024 * 1024, negative_ttl=60.0):
+        self.root = root
+        self.max_models = max(1, int(max_models))
+        self.max_bytes = int(max_bytes)
+        self.negative_ttl = negative_ttl
+
+        self._systems = OrderedDict()
+        self._missing = OrderedDict()
+        self._arrays = {}
+        self._loading = {}
+        self.bytes_in_use = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.load_failures = 0
+        self.not_found = 0
+        self.evictions = 0
+
+    def _cached(self, key):
+        auth_system = self._systems.get(key)
+        if auth_system is not None:
+            self._systems.move_to_end(key)
+            self.hits += 1
+            return auth_system, True
+
+        self.misses += 1
+        missing_until = self._missing.get(key)
+        return None, missing_until is not None and missing_until > time.monotonic()
+
+    def get(self, model_type, username):
+        """The user's authentication system, or None when they have no artifact"""
+        key = (model_type, username)
+        auth_system, known = self._cached(key)
+        if known:
+            return auth_system
+        try:
+            found = self._read(model_type, username)
+        except Exception as e:
+            found = e
+        return self._install(key, found)
+
+    async def get_async(self, model_type, username):
+        """`get` that loads a missing model off the event loop, once for all concurrent callers"""
+        key = (model_type, username)
+        auth_system, known = self._cached(key)
+        if known:
+            return auth_system
+        loading = self._loading.get(key)
+        if loading is None:
+            loading = self._loading[key] = asyncio.ensure_future(self._load_async(key))
+            loading.add_done_callback(lambda _: self._loading.pop(key, None))
+        # One caller giving up must not cancel the load for the others
+        return await asyncio.shield(loading)
+
+    async def _load_async(self, key):
+        try:
+            found = await asyncio.to_thread(self._read, *key)
+        except Exception as e:
+            found = e
+        return self._install(key, found)
+
+    def clear(self):
+        self._systems.clear()
+        self._missing.clear()
+        self._arrays.clear()
+        self.bytes_in_use = 0
+
+    def _read(self, model_type, username):
+        """(manifest, arrays) of the user's newest artifact, or None; touches no shared state"""
+        if not _SAFE_USERNAME.match(username):
+            return None
+        directory = find_artifact(os.path.join(self.root, model_type), username)
+        if directory is None:
+            return None
+
+        manifest = read_manifest(directory)
+        arrays = {}
+        for array_name, meta in manifest['arrays'].items():
+            array = np.load(os.path.join(directory, f"{array_name}.npy"), mmap_mode='r', allow_pickle=False)
+            if list(array.shape) != meta['shape'] or array.dtype.str != meta['dtype']:
+                raise ValueError(f"Array {array_name} in {directory} does not match its manifest entry")
+            arrays[array_name] = array.view(np.ndarray)
+        return manifest, arrays
+
+    def _install(self, key, found):
+        """Cache what _read found (or the error it raised) and return the system or None"""
+        model_type, username = key
+        auth_system = None
+        if found is None:
+            self.not_found += 1
+        elif not isinstance(found, Exception):
+            auth_system = self._systems.get(key)
+            if auth_system is None:
+                try:
+                    auth_system = self._assemble(key, *found)
+                except Exception as e:
+                    found = e
+        if isinstance(found, Exception):
+            self.load_failures += 1
+            print(f"⚠️ Could not load {model_type} model for {username}: {found}")
+        if auth_system is None:
+            self._missing[key] = time.monotonic() + self.negative_ttl
+            self._missing.move_to_end(key)
+            while len(self._missing) > self.max_models * 16:
+                self._missing.popitem(last=False)
+            return None
+
+        self._missing.pop(key, None)
+        self._systems[key] = auth_system
+        self._systems.move_to_end(key)
+        self._evict()
+        return auth_system
+
+    def _assemble(self, key, manifest, loaded):
+        digests = []
+        arrays = {}
+        try:
+            for array_name, meta in manifest['arrays'].items():
+                arrays[array_name] = self._intern(meta['sha256'], loaded[array_name])
+                digests.append(meta['sha256'])
+            auth_system = auth_system_from_arrays(manifest, arrays)
+        except Exception:
+            self._release(digests)
+            raise
+
+        self.loads += 1
+        auth_system['model_type'] = key[0]
+        auth_system['registry_user'] = key[1]
+        auth_system['_array_digests'] = digests
+        return auth_system
+
+    def _intern(self, digest, array):
+        # An identical array already in use is shared and the new mapping dropped
+        entry = self._arrays.get(digest)
+        if entry is None:
+            entry = [array, 0]
+            self._arrays[digest] = entry
+            self.bytes_in_use += array.nbytes
+        entry[1] += 1
+        return entry[0]
+
+    def _release(self, digests):
+        for digest in digests:
+            entry = self._arrays[digest]
+            entry[1] -= 1
+            if entry[1] == 0:
+                self.bytes_in_use -= entry[0].nbytes
+                del self._arrays[digest]
+
+    def _evict(self):
+        # Always keep the entry that was just inserted
+        while len(self._systems) > 1 and (len(self._systems) > self.max_models or self.bytes_in_use > self.max_bytes):
+            _, auth_system = self._systems.popitem(last=False)
+            self._release(auth_system['_array_digests'])
+            self.evictions += 1
+
+    def stats(self):
+        return {
+            "models": len(self._systems),
+            "max_models": self.max_models,
+            "bytes_in_use": self.bytes_in_use,
+            "max_bytes": self.max_bytes,
+            "shared_arrays": len(self._arrays),
+            "hits": self.hits,
+            "misses": self.misses,
+            "loads": self.loads,
+            "load_failures": self.load_failures,
+            "not_found": self.not_found,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,245 @@
+"""On-demand sampling profiler and a recorder of slow requests
+
+`SamplingProfiler` reads the stack of every thread in the process
+(`sys._current_frames`) at a fixed interval for a bounded time and
+counts identical stacks. `collapsed` renders the counts in the collapsed
+stack format (`frame;frame;frame count` per line) that flamegraph.pl,
+speedscope and inferno read. Only the current process is sampled; with
+AUTH_EXECUTOR=process the model runs in the worker processes, and shows
+up here as time waiting on them.
+
+`SlowRequestMiddleware` times every request and keeps the last N over a
+latency threshold in a `SlowRequestLog` ring buffer, with the handler's
+stage timings (reported through `record_stage`) and the shape of the
+payload. The shape keeps field counts, types and lengths but no values,
+so the log holds no keystroke timings, usernames or device details.
+"""
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextvars import ContextVar
+
+
+class SamplingProfiler:
+    """Counts the stacks of every thread, sampled every `interval` seconds"""
+
+    def __init__(self, interval=0.005, max_depth=128):
+        self.interval = interval
+        self.max_depth = max_depth
+        self._labels = {}
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            name = getattr(code, 'co_qualname', code.co_name)
+            label = self._labels[code] = f"{name} ({os.path.basename(code.co_filename)})".replace(';', ':')
+        return label
+
+    def _stack(self, thread_name, frame):
+        frames = []
+        while frame is not None and len(frames) < self.max_depth:
+            frames.append(self._label(frame.f_code))
+            frame = frame.f_back
+        frames.append(f"thread:{thread_name}".replace(';', ':'))
+        return ';'.join(reversed(frames))
+
+    def run(self, seconds):
+        """Sample for `seconds`; returns (Counter of collapsed stacks, number of samples)"""
+        own = threading.get_ident()
+        names = {}
+        stacks = Counter()
+        samples = 0
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                name = names.get(ident)
+                if name is None:
+                    names.update((thread.ident, thread.name) for thread in threading.enumerate())
+                    name = names.setdefault(ident, str(ident))
+                stacks[self._stack(name, frame)] += 1
+            samples += 1
+            time.sleep(self.interval)
+        return stacks, samples
+
+
+def collapsed(stacks):
+    """Collapsed stack text, one `stack count` line per distinct stack"""
+    return ''.join(f"{stack} {count}\n" for stack, count in sorted(stacks.items()))
+
+
+# Stage timings of the request being handled, set by SlowRequestMiddleware
+_request_stages = ContextVar('request_stages', default=None)
+
+
+def record_stage(stage, seconds):
+    """Add a stage timing to the current request's slow-request entry"""
+    stages = _request_stages.get()
+    if stages is not None:
+        stages[stage] = stages.get(stage, 0.0) + seconds
+
+
+_CSV_FIELD = re.compile(r'(?:[^",\[]+|"[^"]*"?|\[[^\]]*\]?)*')
+_NUMBER = re.compile(r'-?\d+(?:\.\d+)?')
+
+
+def _value_shape(text):
+    text = text.strip()
+    if text.startswith('['):
+        return f"array[{len(_NUMBER.findall(text))}]"
+    if text.lower() in ('true', 'false'):
+        return "bool"
+    try:
+        float(text)
+        return "number"
+    except ValueError:
+        return f"str[{len(text)}]"
+
+
+def _json_shape(value, depth=0):
+    if depth >= 8:
+        return "..."
+    if isinstance(value, dict):
+        return {str(key): _json_shape(item, depth + 1) for key, item in value.items()}
+    if isinstance(value, list):
+        return {"items": len(value), "first": _json_shape(value[0], depth + 1)} if value else "list[0]"
+    if isinstance(value, str):
+        return f"str[{len(value)}]"
+    if isinstance(value, bool):
+        return "bool"
+    if value is None:
+        return "null"
+    return "number"
+
+
+def payload_shape(body, content_type='', total_bytes=None):
+    """Field names, types and lengths of a request body, without any values
+
+    `total_bytes` is the full body size when only the start of it was kept.
+    """
+    shape = {"bytes": len(body) if total_bytes is None else total_bytes, "content_type": content_type}
+    if len(body) < shape["bytes"]:
+        shape["truncated"] = True
+    if not body:
+        return shape
+    try:
+        text = body.decode('utf-8')
+    except UnicodeDecodeError:
+        shape["decode"] = "error"
+        return shape
+
+    if 'json' in content_type or text.lstrip()[:1] in ('{', '['):
+        try:
+            shape["json"] = _json_shape(json.loads(text))
+            return shape
+        except ValueError:
+            if 'json' in content_type:
+                shape["json"] = "invalid"
+                return shape
+
+    fields = []
+    for line in text.splitlines()[:1]:
+        position = 0
+        while True:
+            end = _CSV_FIELD.match(line, position).end()
+            fields.append(_value_shape(line[position:end]))
+            if end >= len(line):
+                break
+            position = end + 1
+    shape["lines"] = text.count('\n') + (not text.endswith('\n'))
+    shape["fields"] = len(fields)
+    shape["field_shapes"] = fields
+    return shape
+
+
+class SlowRequestLog:
+    """The last `max_entries` requests that took at least `threshold_seconds`"""
+
+    def __init__(self, threshold_seconds=0.5, max_entries=100):
+        self.threshold_seconds = threshold_seconds
+        self.entries = deque(maxlen=max(1, int(max_entries)))
+        self.requests = 0
+        self.recorded = 0
+
+    def record(self, entry):
+        self.entries.append(entry)
+        self.recorded += 1
+
+    def snapshot(self):
+        """Entries, newest first"""
+        return list(reversed(self.entries))
+
+    def stats(self):
+        return {
+            "threshold_ms": 1000.0 * self.threshold_seconds,
+            "entries": len(self.entries),
+            "max_entries": self.entries.maxlen,
+            "requests": self.requests,
+            "recorded": self.recorded,
+        }
+
+
+class SlowRequestMiddleware:
+    """ASGI middleware adding every request slower than the log's threshold to it
+
+    The request body is kept by reference, up to `max_body_bytes`, and only
+    turned into a payload shape when the request turns out to be slow.
+    """
+
+    def __init__(self, app, log, endpoint_for, max_body_bytes=65536):
+        self.app = app
+        self.log = log
+        self.endpoint_for = endpoint_for
+        self.max_body_bytes = max_body_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+        chunks = []
+        body_bytes = 0
+        stages = {}
+        token = _request_stages.set(stages)
+
+        async def receive_and_keep():
+            nonlocal body_bytes
+            message = await receive()
+            if message['type'] == 'http.request':
+                chunk = message.get('body', b'')
+                if body_bytes + len(chunk) <= self.max_body_bytes:
+                    chunks.append(chunk)
+                body_bytes += len(chunk)
+            return message
+
+        async def send_with_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive_and_keep, send_with_status)
+        finally:
+            _request_stages.reset(token)
+            elapsed = time.perf_counter() - started
+            self.log.requests += 1
+            if elapsed >= self.log.threshold_seconds:
+                content_type = next((value.decode('latin-1') for name, value in scope['headers']
+                                     if name == b'content-type'), '')
+                self.log.record({
+                    "at": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                    "method": scope['method'],
+                    "endpoint": self.endpoint_for(scope['path']),
+                    "status": status,
+                    "duration_ms": 1000.0 * elapsed,
+                    "stages_ms": {stage: 1000.0 * seconds for stage, seconds in stages.items()},
+                    "payload": payload_shape(b''.join(chunks), content_type, body_bytes),
+                })
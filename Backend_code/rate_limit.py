@@ -0,0 +1,198 @@
+"""Sliding-window request velocity per username and device fingerprint
+
+Each tracked key has a ring of `buckets` counters covering
+`window_seconds`; a counter holds the requests of one
+`window_seconds / buckets` slice of time and is reset when its slot comes
+round again. A key's velocity is the sum of the slices still inside the
+window, so the memory per key is fixed however many requests it makes.
+
+`LocalVelocityStore` keeps the rings in process. It is only used from the
+event loop, so it takes no locks. Keys not seen for a whole window count
+zero and are evicted as new requests arrive; `max_keys` bounds the rest,
+least recently seen first. `RedisVelocityStore` keeps the same slices in
+Redis so every worker and host counts against one window.
+
+Keys are hashed before they are stored, so a long username or
+fingerprint costs no more memory than a short one.
+"""
+import hashlib
+import math
+import time
+from collections import OrderedDict
+
+
+def velocity_key(kind, value):
+    return f"{kind}:{hashlib.blake2b(value.encode('utf-8'), digest_size=8).hexdigest()}"
+
+
+class LocalVelocityStore:
+    """In-process sliding-window counters for one worker"""
+
+    def __init__(self, window_seconds=60.0, buckets=12, max_keys=100000):
+        self.window_seconds = float(window_seconds)
+        self.buckets = max(1, int(buckets))
+        self.slice_seconds = self.window_seconds / self.buckets
+        self.max_keys = max(1, int(max_keys))
+
+        # key -> [counts per slot, slice number per slot, last slice seen]
+        self._rings = OrderedDict()
+        self.idle_evictions = 0
+        self.evictions = 0
+
+    async def hit(self, keys, now=None):
+        """Count one request for every key; returns each key's count in the window"""
+        current = int((time.time() if now is None else now) // self.slice_seconds)
+        oldest = current - self.buckets + 1
+        rings = self._rings
+        counts = []
+        for key in keys:
+            ring = rings.get(key)
+            if ring is None:
+                ring = rings[key] = [[0] * self.buckets, [current] * self.buckets, current]
+            else:
+                rings.move_to_end(key)
+            slot_counts, slot_slices, _ = ring
+            slot = current % self.buckets
+            if slot_slices[slot] != current:
+                slot_slices[slot] = current
+                slot_counts[slot] = 0
+            slot_counts[slot] += 1
+            ring[2] = current
+            counts.append(sum(count for count, number in zip(slot_counts, slot_slices) if number >= oldest))
+
+        # Least recently seen keys come first; those idle for a window count zero anyway
+        while rings:
+            key, ring = next(iter(rings.items()))
+            if ring[2] >= oldest:
+                break
+            del rings[key]
+            self.idle_evictions += 1
+        while len(rings) > self.max_keys:
+            rings.popitem(last=False)
+            self.evictions += 1
+        return counts
+
+    async def close(self):
+        pass
+
+    def stats(self):
+        return {
+            "backend": "local",
+            "keys": len(self._rings),
+            "max_keys": self.max_keys,
+            "idle_evictions": self.idle_evictions,
+            "evictions": self.evictions,
+        }
+
+
+class RedisVelocityStore:
+    """Sliding-window counters shared by every worker through Redis
+
+    Each slice of a key is one Redis counter that expires once it has left
+    the window. A hit is one pipelined round trip per request.
+    """
+
+    def __init__(self, url, window_seconds=60.0, buckets=12, prefix='auth:velocity:'):
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise ImportError("A redis:// rate limit backend needs the redis package (pip install redis)") from e
+        self.client = redis.from_url(url)
+        self.url = url
+        self.window_seconds = float(window_seconds)
+        self.buckets = max(1, int(buckets))
+        self.slice_seconds = self.window_seconds / self.buckets
+        self.prefix = prefix
+        self.errors = 0
+
+    async def hit(self, keys, now=None):
+        current = int((time.time() if now is None else now) // self.slice_seconds)
+        ttl = math.ceil(self.window_seconds + self.slice_seconds)
+        pipeline = self.client.pipeline(transaction=False)
+        for key in keys:
+            name = f"{self.prefix}{key}:"
+            pipeline.incr(f"{name}{current}")
+            pipeline.expire(f"{name}{current}", ttl)
+            # With one bucket there are no earlier slices; the placeholder reads as None
+            pipeline.mget([f"{name}{current - age}" for age in range(1, self.buckets)] or [f"{name}-"])
+        try:
+            replies = await pipeline.execute()
+        except Exception:
+            self.errors += 1
+            raise
+        counts = []
+        for index in range(len(keys)):
+            latest, _, earlier = replies[3 * index:3 * index + 3]
+            counts.append(int(latest) + sum(int(value) for value in earlier if value))
+        return counts
+
+    async def close(self):
+        await self.client.aclose()
+
+    def stats(self):
+        return {"backend": "redis", "url": self.url.split('@')[-1], "errors": self.errors}
+
+
+def create_velocity_store(backend, window_seconds=60.0, buckets=12, max_keys=100000):
+    """Store for AUTH_RATE_LIMIT_BACKEND: 'local' or a redis:// URL"""
+    if backend == 'local':
+        return LocalVelocityStore(window_seconds, buckets, max_keys)
+    if backend.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisVelocityStore(backend, window_seconds, buckets)
+    raise ValueError(f"Unknown rate limit backend {backend!r}, expected 'local' or a redis:// URL")
+
+
+class VelocityLimiter:
+    """Counts attempts per username and device and checks them against the limits
+
+    Every attempt counts, including rejected ones, so a client that keeps
+    retrying stays limited until it slows down. A limit of 0 tracks the
+    key without ever rejecting it. Limiters with different `prefix`es
+    can share a store and still count separately.
+    """
+
+    def __init__(self, store, max_per_user=10, max_per_device=30, prefix=''):
+        self.store = store
+        self.prefix = prefix
+        self.limits = {'user': int(max_per_user), 'device': int(max_per_device)}
+        self.checks = 0
+        self.limited = {'user': 0, 'device': 0}
+
+    @property
+    def retry_after(self):
+        """Seconds until the oldest slice of the window expires"""
+        return max(1, math.ceil(self.store.slice_seconds))
+
+    async def check(self, username, device=None):
+        """(velocity fields, the kind of key over its limit or None)"""
+        return (await self.check_many([username], device))[0]
+
+    async def check_many(self, usernames, device=None):
+        """`check` for several attempts from one device, counted in one store round trip"""
+        identities = []
+        for username in usernames:
+            identities.append(('user', username))
+            if device:
+                identities.append(('device', device))
+        counts = await self.store.hit([velocity_key(f"{self.prefix}{kind}", value) for kind, value in identities])
+        self.checks += len(usernames)
+
+        width = 2 if device else 1
+        verdicts = []
+        for index in range(0, len(counts), width):
+            attempt = counts[index:index + width]
+            velocity = {"window_seconds": self.store.window_seconds, "user_attempts": attempt[0],
+                        "device_attempts": attempt[1] if device else None}
+            limited = None
+            for (kind, _), count in zip(identities[index:index + width], attempt):
+                if self.limits[kind] and count > self.limits[kind]:
+                    self.limited[kind] += 1
+                    limited = kind
+                    break
+            verdicts.append((velocity, limited))
+        return verdicts
+
+    def stats(self):
+        return dict(self.store.stats(), checks=self.checks, limited=dict(self.limited),
+                    max_per_user=self.limits['user'], max_per_device=self.limits['device'],
+                    window_seconds=self.store.window_seconds)
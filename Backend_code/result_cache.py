@@ -0,0 +1,107 @@
+import hashlib
+import time
+from collections import OrderedDict
+
+
+# Rough per-entry bookkeeping cost (key, tuple, dict slots) counted against max_bytes
+ENTRY_OVERHEAD_BYTES = 512
+
+
+def body_digest(body):
+    return hashlib.blake2b(body, digest_size=16).digest()
+
+
+class ResultCache:
+    """Bounded LRU cache of authentication results keyed by the raw request body
+
+    Keys combine the endpoint, a blake2b digest of the body and the version
+    of the model that scored it, so a model reload never serves old scores.
+    Entries expire after `ttl` seconds. The byte budget counts the encoded
+    response plus a fixed overhead per entry. Every hit is an exact
+    duplicate of a body seen within the window; `get` returns how many
+    times it was seen before so callers can treat it as a replay signal.
+    """
+
+    def __init__(self, max_entries=10000, max_bytes=16 * 1024 * 1024, ttl=300.0):
+        self.max_entries = max(0, int(max_entries))
+        self.max_bytes = int(max_bytes)
+        self.ttl = ttl
+
+        self._entries = OrderedDict()
+        self.bytes_in_use = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def get(self, key):
+        """(fields, model_version, times_seen_before) for a live entry, or None"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        fields, model_version, size, expires_at, seen = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            self.expired += 1
+            self.misses += 1
+            return None
+
+        self._entries[key] = (fields, model_version, size, expires_at, seen + 1)
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return fields, model_version, seen
+
+    def put(self, key, fields, model_version, size):
+        if not self.enabled:
+            return
+        size += ENTRY_OVERHEAD_BYTES
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (fields, model_version, size, time.monotonic() + self.ttl, 1)
+        self.bytes_in_use += size
+        while len(self._entries) > self.max_entries or self.bytes_in_use > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def discard(self, key):
+        if key in self._entries:
+            self._remove(key)
+            self.invalidations += 1
+
+    def discard_version(self, model_version):
+        """Drop the entries whose key ends in `model_version`, e.g. after that model was replaced"""
+        for key in [key for key in self._entries if key[-1] == model_version]:
+            self._remove(key)
+            self.invalidations += 1
+
+    def clear(self):
+        self.invalidations += len(self._entries)
+        self._entries.clear()
+        self.bytes_in_use = 0
+
+    def _remove(self, key):
+        self.bytes_in_use -= self._entries.pop(key)[2]
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "bytes_in_use": self.bytes_in_use,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,122 @@
+"""Authentication systems published in shared memory for multi-worker serving
+
+The launching process loads each model once and copies its weight and
+scaler arrays into one `multiprocessing.shared_memory` block per model.
+It describes the block in a small JSON-able manifest, which workers get
+through the AUTH_SHARED_MODELS environment variable. Workers attach to
+the block and build read-only NumPy views over it, so N workers hold one
+copy of the weights rather than N. A model whose scaler was folded in at
+load is published folded, so the folded first layer is shared as well.
+
+Only NumPy-engine models can be shared. Keras-engine models are left out
+of the manifest, and each worker loads its own copy of those.
+"""
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from inference import NumpySequential
+from model_artifacts import ArtifactScaler
+
+
+# Start of every array in a block is aligned to this many bytes
+ARRAY_ALIGNMENT = 64
+
+# Blocks this process has attached to; the views are only valid while they stay open
+_attached_blocks = {}
+
+
+def _aligned(offset):
+    return (offset + ARRAY_ALIGNMENT - 1) // ARRAY_ALIGNMENT * ARRAY_ALIGNMENT
+
+
+def publish_auth_system(auth_system):
+    """Copy a loaded system into a new shared memory block
+
+    Returns (manifest, block), or (None, None) when the model is not a
+    NumPy-engine model. The caller owns the block and must close and
+    unlink it once every worker has exited.
+    """
+    model = auth_system['model']
+    if not isinstance(model, NumpySequential):
+        return None, None
+    scaler = auth_system['scaler']
+    if not isinstance(scaler, ArtifactScaler):
+        scaler = ArtifactScaler.from_sklearn(scaler)
+
+    layers, arrays = model.to_arrays()
+    if scaler.mean_ is not None:
+        arrays['scaler_mean'] = scaler.mean_
+    if scaler.scale_ is not None:
+        arrays['scaler_scale'] = scaler.scale_
+
+    layout = {}
+    size = 0
+    for array_name, array in arrays.items():
+        offset = _aligned(size)
+        layout[array_name] = {'offset': offset, 'dtype': array.dtype.str, 'shape': list(array.shape)}
+        size = offset + array.nbytes
+
+    block = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    for array_name, array in arrays.items():
+        meta = layout[array_name]
+        view = np.ndarray(meta['shape'], dtype=meta['dtype'], buffer=block.buf, offset=meta['offset'])
+        view[...] = array
+
+    manifest = {
+        'block': block.name,
+        'layers': layers,
+        'arrays': layout,
+        'scaler': {
+            'mean': 'scaler_mean' if scaler.mean_ is not None else None,
+            'scale': 'scaler_scale' if scaler.scale_ is not None else None,
+        },
+        'threshold': float(auth_system['threshold']),
+        'target_user': auth_system['target_user'],
+        'feature_count': int(auth_system.get('feature_count', scaler.n_features_in_)),
+        'quantization': auth_system.get('quantization'),
+        'version': auth_system['version'],
+        'source': auth_system.get('source'),
+        'model_type': auth_system.get('model_type'),
+    }
+    return manifest, block
+
+
+def _attach_block(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13 attaching also registers the block with the
+        # resource tracker. Workers started by multiprocessing share the
+        # parent's tracker, so the block is still unlinked once, by the parent.
+        return shared_memory.SharedMemory(name=name)
+
+
+def attach_auth_system(manifest):
+    """Build an authentication system over the arrays of a published block"""
+    block = _attached_blocks.get(manifest['block'])
+    if block is None:
+        block = _attached_blocks[manifest['block']] = _attach_block(manifest['block'])
+
+    arrays = {}
+    for array_name, meta in manifest['arrays'].items():
+        array = np.ndarray(meta['shape'], dtype=meta['dtype'], buffer=block.buf, offset=meta['offset'])
+        array.flags.writeable = False
+        arrays[array_name] = array
+
+    scaler_meta = manifest['scaler']
+    return {
+        'model': NumpySequential.from_arrays(manifest['layers'], arrays),
+        'scaler': ArtifactScaler(
+            arrays[scaler_meta['mean']] if scaler_meta['mean'] else None,
+            arrays[scaler_meta['scale']] if scaler_meta['scale'] else None,
+            manifest['feature_count'],
+        ),
+        'threshold': manifest['threshold'],
+        'target_user': manifest['target_user'],
+        'feature_count': manifest['feature_count'],
+        'quantization': manifest['quantization'],
+        'version': manifest['version'],
+        'source': manifest['source'],
+        'model_type': manifest['model_type'],
+    }
@@ -16,6 +16,14 @@ export interface AuthenticationResponse {
   user: string;
   target_user: string;
   model_type: string;
+  velocity?: {
+    window_seconds: number;
+    user_attempts: number;
+    device_attempts: number | null;
+  };
+  // Set when the same body was already submitted within the backend's cache window
+  replay?: boolean;
+  duplicate_count?: number;
 }
 
 export interface SecurityCheckResponse {
@@ -66,14 +74,47 @@ export interface NavigationResponse {
   method: string;
 }
 
+export interface SessionSignals {
+  username?: string;
+  securityState?: any;
+  twoFactorChoice?: number;
+  emulatorDetectionResult?: string;
+  wifiSafetyChoice?: number;
+  firstAction?: { action: string; pressed: boolean };
+  navigationMethod?: string;
+  keystrokeData?: any;
+}
+
+export interface SessionCheckVerdict {
+  authenticated: boolean;
+  message: string;
+  error?: string;
+  [key: string]: any;
+}
+
+export interface SessionVerifyResponse {
+  authenticated: boolean;
+  message: string;
+  checks: { [check: string]: SessionCheckVerdict };
+  failed_checks: string[];
+}
+
 export class BackendService {
   private static instance: BackendService;
   private baseURL: string;
+  private deviceFingerprint?: string;
 
   constructor(baseURL = BACKEND_URL) {
     this.baseURL = baseURL;
   }
 
+  /**
+   * Send the device's build fingerprint with every request (rate limited per device)
+   */
+  setDeviceFingerprint(fingerprint?: string): void {
+    this.deviceFingerprint = fingerprint;
+  }
+
   static getInstance(): BackendService {
     if (!BackendService.instance) {
       BackendService.instance = new BackendService();
@@ -93,12 +134,17 @@ export class BackendService {
     try {
       const url = `${this.baseURL}${endpoint}`;
 
+      const headers: Record<string, string> = {
+        'Content-Type': contentType,
+        'Accept': 'application/json',
+      };
+      if (this.deviceFingerprint) {
+        headers['X-Device-Fingerprint'] = this.deviceFingerprint;
+      }
+
       const config: RequestInit = {
         method,
-        headers: {
-          'Content-Type': contentType,
-          'Accept': 'application/json',
-        },
+        headers,
       };
 
       if (data && method === 'POST') {
@@ -309,15 +355,19 @@ export class BackendService {
   /**
    * Check device security parameters
    */
-  async checkDeviceSecurity(securityState: any): Promise<SecurityCheckResponse> {
+  async checkDeviceSecurity(securityState: any, username?: string): Promise<SecurityCheckResponse> {
     try {
       console.log('🛡️ Checking device security...');
 
-      const payload = {
+      const payload: any = {
         securityCheck: 'completed',
         version: 'enhanced_v2.0',
         state: securityState
       };
+      if (username !== undefined) {
+        // Checks against the user's enrolled devices instead of the default one
+        payload.username = username;
+      }
 
       console.log('📝 Security check payload:', payload);
 
@@ -451,6 +501,63 @@ export class BackendService {
     }
   }
 
+  /**
+   * Verify all collected login signals with a single request
+   */
+  async verifySession(signals: SessionSignals): Promise<SessionVerifyResponse> {
+    try {
+      console.log('🛡️ Verifying session signals...');
+
+      const payload: any = {};
+      if (signals.securityState !== undefined) {
+        payload.deviceCheck = {
+          securityCheck: 'completed',
+          version: 'enhanced_v2.0',
+          state: signals.securityState
+        };
+        if (signals.username !== undefined) {
+          payload.deviceCheck.username = signals.username;
+        }
+      }
+      if (signals.twoFactorChoice !== undefined) {
+        payload.twoFactor = { twoFactorChoice: signals.twoFactorChoice };
+      }
+      if (signals.emulatorDetectionResult !== undefined) {
+        payload.emulatorDetection = { emulatorDetectionResult: signals.emulatorDetectionResult };
+      }
+      if (signals.wifiSafetyChoice !== undefined) {
+        payload.wifiSafety = { wifiSafetyChoice: signals.wifiSafetyChoice };
+      }
+      if (signals.firstAction !== undefined) {
+        payload.firstAction = {
+          firstAction: signals.firstAction.action,
+          pressed: signals.firstAction.pressed
+        };
+      }
+      if (signals.navigationMethod !== undefined) {
+        payload.navigationMethod = { navigationMethod: signals.navigationMethod };
+      }
+      if (signals.keystrokeData !== undefined) {
+        const data = signals.keystrokeData;
+        const isPinData = data.characterCount <= 6 && data.username === 'PinUser';
+        payload.keystroke = {
+          csv: isPinData ? this.formatPinData(data) : this.formatCaptchaData(data),
+          model_type: isPinData ? 'pin' : 'captcha'
+        };
+      }
+
+      console.log('📝 Session verify payload:', payload);
+
+      const response = await this.makeRequest('/security/session-verify', 'POST', payload);
+
+      console.log('✅ Session verification result:', response);
+      return response;
+    } catch (error) {
+      console.error('❌ Session verification failed:', error);
+      throw error;
+    }
+  }
+
   /**
    * Health check endpoint
    */